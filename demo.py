@@ -7,12 +7,8 @@ import json
 import time
 import datetime
 from typing import Optional, List
-import serial
-from aiocoap import Context, Message, POST
-import aiocoap.error
 
 # --- Logging setup ---
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 # --- Placeholder controller IP ---
@@ -20,6 +16,7 @@ bento_controller_ip = None
 
 # --- Async CoAP command ---
 async def send_controller_comand(register: str, value, close_connection=False) -> dict:
+    from aiocoap import Context, Message, POST
     timeout_s = 60
     logger.debug("send_controller_comand")
 
@@ -61,6 +58,7 @@ async def pneumatic_read_valve_state(channel_number: int):
     return reply
 
 def send_usb_command_retrieve_response(serial_port: str, command: str) -> List[str]:
+    import serial
     try:
         with serial.Serial(serial_port, baudrate=115200, timeout=2) as ser:
             ser.write((command + '\n').encode('utf-8'))
@@ -237,4 +235,5 @@ class PneumaticControlGUI:
         schedule_coro(sequence_task())
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
     PneumaticControlGUI()
@@ -4,16 +4,15 @@ import threading
 import logging
 import json
 import time
-from aiocoap import Context, Message, POST
-import aiocoap.error
 
 # --- Logging setup ---
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 
 # --- Async CoAP command ---
 async def send_controller_comand(register: str, value, close_connection=False) -> dict:
+    from aiocoap import Context, Message, POST
+    import aiocoap.error
     timeout_s = 60
     logger.debug("send_controller_comand")
 
@@ -180,4 +179,5 @@ class PneumaticControlGUI:
         schedule_coro(_task())
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
     PneumaticControlGUI()
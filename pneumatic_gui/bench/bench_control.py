@@ -0,0 +1,215 @@
+# Benchmark suite for the control stack. Drives send_controller_comand,
+# pneumatic_set_valve, pneumatic_read_valve_state and the valve_test plan
+# against the local controller simulator (or any controller given with
+# --target) and reports p50/p95/p99 latency, commands per second and
+# wall-clock time per box test.
+#
+#   cd pneumatic_gui && python -m bench.bench_control --json results.json
+#   cd pneumatic_gui && python -m bench.bench_control --compare results.json
+#
+# --compare exits with status 1 when a metric regressed by more than
+# --tolerance against the saved results.
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import statistics
+import sys
+import time
+
+from control.coap_client import CoapSession, ControllerClient, send_controller_comand
+from control.pneumatic_control import pneumatic_set_valve, pneumatic_read_valve_state, pneumatic_set_valves, set_valve_command
+from sim.bento_sim import build_simulator
+from testplan.engine import run_plan
+from testplan.plan import compile_plan, load_plan
+
+P_READ = {"origin_can_id": 0x0402, "dest_can_bus_id": 544, "cmd": "p_read", "data": {"valve_n": 1}}
+
+# metric -> True when higher is better
+METRICS = {"p50_ms": False, "p95_ms": False, "p99_ms": False, "cmd_per_s": True, "box_test_s": False}
+
+
+def percentile(sorted_values, pct):
+    # nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return None
+    rank = max(1, round(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies, elapsed_s):
+    latencies = sorted(latencies) or [float("nan")]
+    return {
+        "n": len(latencies),
+        "mean_ms": statistics.mean(latencies) * 1e3,
+        "p50_ms": percentile(latencies, 50) * 1e3,
+        "p95_ms": percentile(latencies, 95) * 1e3,
+        "p99_ms": percentile(latencies, 99) * 1e3,
+        "max_ms": latencies[-1] * 1e3,
+        "cmd_per_s": len(latencies) / elapsed_s,
+    }
+
+
+async def _timed_commands(make_call, n, concurrency):
+    # failed calls are counted, not timed
+    latencies = []
+    errors = 0
+    remaining = iter(range(n))
+
+    async def worker():
+        nonlocal errors
+        for i in remaining:
+            start = time.perf_counter()
+            try:
+                await make_call(i)
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result = summarize(latencies, time.perf_counter() - started)
+    result["errors"] = errors
+    return result
+
+
+async def run_suite(controller, n, concurrency, box_runs, channels):
+    results = {}
+
+    scenarios = {
+        "send_controller_comand": lambda i: send_controller_comand("RELAY_TO_MODULE_J", P_READ, controller=controller),
+        # force: past the first cycle every command would match the valve
+        # shadow and never reach the controller
+        "pneumatic_set_valve": lambda i: pneumatic_set_valve(channels[i % len(channels)], i % 2 == 0,
+                                                             controller=controller, force=True),
+        "pneumatic_read_valve_state": lambda i: pneumatic_read_valve_state(channels[i % len(channels)],
+                                                                           controller=controller),
+    }
+    for name, call in scenarios.items():
+        await _timed_commands(call, min(10, n), 1)  # warm up
+        results[name] = await _timed_commands(call, n, 1)
+        if concurrency > 1:
+            results[f"{name}[x{concurrency}]"] = await _timed_commands(call, n, concurrency)
+
+    # closing every valve, one command after the other vs pipelined; latency
+    # here is per batch of len(channels) commands
+    closes = [set_valve_command(channel, False) for channel in channels]
+
+    async def close_all_sequential(i):
+        for register, value in closes:
+            await controller.send(register, value)
+
+    async def close_all_pipelined(i):
+        await controller.send_many(closes)
+
+    async def close_all_batch(i):
+        await pneumatic_set_valves({channel: False for channel in channels}, controller=controller, force=True)
+
+    batches = max(1, n // len(channels))
+    results["close_all[sequential]"] = await _timed_commands(close_all_sequential, batches, 1)
+    results["close_all[pipelined]"] = await _timed_commands(close_all_pipelined, batches, 1)
+    results["close_all[batch]"] = await _timed_commands(close_all_batch, batches, 1)
+
+    # the valve_test plan the GUI and the CLI run
+    plan = compile_plan(load_plan("valve_test"), {"channels": list(channels)})
+    box_times = []
+    commands = 0
+    for _ in range(box_runs):
+        requests_before = controller.stats.requests
+        started = time.perf_counter()
+        await run_plan(plan, controller)
+        box_times.append(time.perf_counter() - started)
+        commands = controller.stats.requests - requests_before
+    if box_runs:
+        results["valve_test"] = {
+            "n": box_runs,
+            "box_test_s": statistics.mean(box_times),
+            "min_s": min(box_times),
+            "max_s": max(box_times),
+            "commands": commands,
+        }
+    return results
+
+
+def print_results(results):
+    print(f"{'scenario':<34}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'cmd/s':>10}{'errors':>8}")
+    for name, r in results.items():
+        if "box_test_s" in r:
+            print(f"{name:<34}{'box test':>18} {r['box_test_s']:8.3f} s  ({r['commands']} commands, {r['n']} runs)")
+        else:
+            print(f"{name:<34}{r['p50_ms']:9.2f}{r['p95_ms']:9.2f}{r['p99_ms']:9.2f}{r['cmd_per_s']:10.1f}"
+                  f"{r['errors']:8d}")
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, r in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            if metric not in r or metric not in old or not old[metric]:
+                continue
+            change = (r[metric] - old[metric]) / old[metric]
+            worse = -change if higher_is_better else change
+            marker = "  REGRESSION" if worse > tolerance else ""
+            print(f"{name:<34}{metric:<12}{old[metric]:10.2f} -> {r[metric]:10.2f}  ({change:+.1%}){marker}")
+            if marker:
+                regressions.append((name, metric))
+    return regressions
+
+
+async def main(args):
+    session = CoapSession()
+    sim = None
+    target = args.target
+    if target is None:
+        sim = build_simulator(latency={544: args.module_latency, 0x0320: args.module_latency},
+                              jitter_s=args.jitter, loss=args.loss, net_latency_s=args.net_latency)
+        await sim.start("127.0.0.1", args.port)
+        target = f"127.0.0.1:{args.port}"
+    controller = ControllerClient(target, session=session)
+    channels = list(range(1, args.channels + 1))
+    try:
+        results = await run_suite(controller, args.n, args.concurrency, args.box_runs, channels)
+    finally:
+        await session.shutdown()
+        if sim is not None:
+            await sim.stop()
+
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "config": {k: v for k, v in vars(args).items() if k not in ("json", "compare")},
+                "results": results,
+            }, f, indent=2)
+        print(f"results written to {args.json}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Control stack benchmark suite")
+    parser.add_argument("-n", type=int, default=200, help="commands per scenario")
+    parser.add_argument("--concurrency", type=int, default=1, help="also run each scenario with this many callers")
+    parser.add_argument("--box-runs", type=int, default=1, help="full valve test runs")
+    parser.add_argument("--channels", type=int, default=6)
+    parser.add_argument("--target", help="ip[:port] of a controller to use instead of the simulator")
+    parser.add_argument("--port", type=int, default=56890, help="simulator port")
+    parser.add_argument("--module-latency", type=float, default=0.005, help="simulated module service time (s)")
+    parser.add_argument("--net-latency", type=float, default=0.0, help="simulated one-way network delay (s)")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--loss", type=float, default=0.0, help="simulated datagram loss probability")
+    parser.add_argument("--json", help="write machine-readable results to this file")
+    parser.add_argument("--compare", help="compare against results saved with --json")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed relative regression")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,73 @@
+# Per-command latency with a one-shot CoAP context per command versus the
+# shared session. Runs against an in-process echo controller on localhost.
+#
+#   cd pneumatic_gui && python -m bench.bench_session_reuse -n 200
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import aiocoap
+import aiocoap.resource as resource
+
+from control.coap_client import CoapSession, ControllerClient, send_controller_comand
+
+
+class _EchoController(resource.Resource):
+    async def render_post(self, request):
+        body = json.loads(request.payload.decode('utf-8'))
+        val = body["val"]
+        reply = {
+            "dest_can_bus_id": val["origin_can_id"],
+            "origin_can_id": val["dest_can_bus_id"],
+            "cmd": val["cmd"],
+            "data": {"ret": "OK", "psi": 0.0, "cmd": val["cmd"]},
+            "ret": "OK",
+        }
+        return aiocoap.Message(code=aiocoap.CHANGED, payload=json.dumps(reply).encode('utf-8'))
+
+
+P_READ = {"origin_can_id": 0x0402, "dest_can_bus_id": 544, "cmd": "p_read", "data": {"valve_n": 1}}
+
+
+async def _measure(n, **kwargs):
+    latencies = []
+    for _ in range(n):
+        start = time.perf_counter()
+        await send_controller_comand("RELAY_TO_MODULE_J", P_READ, **kwargs)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def _report(label, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{label:<22} mean {statistics.mean(latencies) * 1e3:7.3f} ms   "
+          f"p50 {statistics.median(latencies) * 1e3:7.3f} ms   p95 {p95 * 1e3:7.3f} ms")
+
+
+async def main(n, port):
+    site = resource.Site()
+    site.add_resource(["controller"], _EchoController())
+    server = await aiocoap.Context.create_server_context(site, bind=("127.0.0.1", port))
+    session = CoapSession()
+    controller = ControllerClient(f"127.0.0.1:{port}", session=session)
+    try:
+        # warm up both paths before measuring
+        await _measure(5, controller=controller, close_connection=True)
+        await _measure(5, controller=controller)
+
+        _report("context per command", await _measure(n, controller=controller, close_connection=True))
+        _report("shared session", await _measure(n, controller=controller))
+    finally:
+        await session.shutdown()
+        await server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CoAP session reuse benchmark")
+    parser.add_argument("-n", type=int, default=200, help="commands per variant")
+    parser.add_argument("--port", type=int, default=56830)
+    args = parser.parse_args()
+    asyncio.run(main(args.n, args.port))
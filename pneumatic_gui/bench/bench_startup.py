@@ -0,0 +1,112 @@
+# Startup import budget. Imports the modules main.py needs before the window
+# can be drawn in a fresh interpreter with `python -X importtime`, takes the
+# median over several runs and fails when
+#   - the import time exceeds --budget-ms, or
+#   - a module that must load on first use (aiocoap, pyserial, numpy) shows
+#     up in the startup imports.
+#
+#   cd pneumatic_gui && python -m bench.bench_startup
+#   cd pneumatic_gui && python -m bench.bench_startup --json startup.json
+#   cd pneumatic_gui && python -m bench.bench_startup --compare startup.json
+#
+# Exit status 1 on a regression (budget, lazy module imported or --compare).
+import argparse
+import datetime
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+
+STARTUP_MODULES = ("gui.gui", "utils.threading_loop")
+LAZY_MODULES = ("aiocoap", "serial", "numpy")
+
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_times(modules, python=sys.executable) -> dict:
+    # module -> (self_us, cumulative_us, depth) for one fresh interpreter
+    code = "; ".join(f"import {module}" for module in modules)
+    proc = subprocess.run([python, "-X", "importtime", "-c", code], capture_output=True, text=True,
+                          cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    if proc.returncode != 0:
+        raise Exception(f"importing {', '.join(modules)} failed:\n{proc.stderr.strip()}")
+    times = {}
+    for line in proc.stderr.splitlines():
+        m = _LINE.match(line)
+        if m:
+            times[m.group(4)] = (int(m.group(1)), int(m.group(2)), len(m.group(3)) // 2)
+    return times
+
+
+def lazy_imported(times: dict, lazy=LAZY_MODULES) -> list:
+    return sorted({name.split(".")[0] for name in times} & set(lazy))
+
+
+def measure(modules, runs: int) -> dict:
+    totals = []
+    times = {}
+    for _ in range(runs):
+        times = import_times(modules)
+        # top-level entries only; their cumulative time includes everything below
+        totals.append(sum(cumulative for _, cumulative, depth in times.values() if depth == 0) / 1e3)
+    top = sorted(((name, cumulative / 1e3) for name, (_, cumulative, depth) in times.items() if depth <= 1),
+                 key=lambda item: -item[1])
+    return {
+        "import_ms": statistics.median(totals),
+        "min_ms": min(totals),
+        "max_ms": max(totals),
+        "modules": len(times),
+        "lazy_imported": lazy_imported(times),
+        "slowest": top[:10],
+    }
+
+
+def print_results(result, budget_ms):
+    print(f"startup imports: {result['import_ms']:.1f} ms median "
+          f"({result['min_ms']:.1f} - {result['max_ms']:.1f} ms, {result['modules']} modules, "
+          f"budget {budget_ms:.0f} ms)")
+    for name, ms in result["slowest"]:
+        print(f"  {name:<40}{ms:8.1f} ms")
+    for name in result["lazy_imported"]:
+        print(f"  LAZY MODULE IMPORTED AT STARTUP: {name}")
+
+
+def main(args) -> int:
+    result = measure(STARTUP_MODULES, args.runs)
+    print_results(result, args.budget_ms)
+    failed = False
+    if result["lazy_imported"]:
+        failed = True
+    if result["import_ms"] > args.budget_ms:
+        print(f"REGRESSION: startup imports take {result['import_ms']:.1f} ms, budget {args.budget_ms:.0f} ms")
+        failed = True
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "config": {k: v for k, v in vars(args).items() if k not in ("json", "compare")},
+                "results": result,
+            }, f, indent=2)
+        print(f"results written to {args.json}")
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)["results"]["import_ms"]
+        change = (result["import_ms"] - old) / old
+        marker = "  REGRESSION" if change > args.tolerance else ""
+        print(f"{'import_ms':<12}{old:10.1f} -> {result['import_ms']:10.1f}  ({change:+.1%}){marker}")
+        failed = failed or bool(marker)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Startup import time budget")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to measure (median is used)")
+    parser.add_argument("--budget-ms", type=float, default=300, help="allowed median import time")
+    parser.add_argument("--json", help="write machine-readable results to this file")
+    parser.add_argument("--compare", help="compare against results saved with --json")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed relative regression")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,230 @@
+# Headless test runner: runs a test plan against one or more boxes without
+# the Tk GUI (this module and everything it imports stay clear of tkinter).
+#
+#   cd pneumatic_gui && python cli.py 172.16.50.74=box17 172.16.50.75=box18
+#   cd pneumatic_gui && python cli.py --mode parallel --groups "1-3;4-6" --format jsonl 172.16.50.74
+#   cd pneumatic_gui && python cli.py --plan gimatic_test 172.16.50.74
+#
+# Each BOX is IP[:PORT][=REPORT_NAME]; with no BOX the controller IP is read
+# over USB like the GUI's "Fetch IP Address", or taken from the IP cache when
+# the cached controller answers a ping. Boxes run concurrently and every
+# box gets its own bento-elec-<timestamp>_<name>.txt report, plus the step
+# records streamed to bento-elec-<timestamp>_<name>.jsonl while it runs.
+#
+# Exit status: 0 every box passed, 1 a box failed, 2 usage, plan or
+# connection setup error.
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+from control.coap_client import CoapSession, ControllerClient
+from control.pressure_capture import PressureRingBuffer
+from testplan.engine import run_plan
+from testplan.parallel import run_parallel_valve_test, parse_groups
+from testplan.plan import PlanError, compile_plan, load_plan
+from utils.ip_cache import DEFAULT_CACHE, IpCache
+from utils.ip_utils import DEFAULT_SERIAL_PORT, discover_ip_controller
+from utils.report_sink import ReportSink
+from utils.reports import report_filename, report_timestamp, write_report
+from utils.serial_transport import close_serial_transports
+
+logger = logging.getLogger(__name__)
+
+EXIT_PASS = 0
+EXIT_FAIL = 1
+EXIT_ERROR = 2
+
+
+def parse_box(text: str):
+    ip, _, name = text.partition("=")
+    if not ip:
+        raise argparse.ArgumentTypeError(f"missing controller IP in {text!r}")
+    return ip, name or None
+
+
+def parse_param(text: str):
+    key, sep, value = text.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"expected KEY=VALUE, got {text!r}")
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+class Output:
+    # text: report lines prefixed with the box; jsonl: one JSON object per
+    # line and event; json: a single document once every box is done
+    def __init__(self, fmt: str, stream=sys.stdout):
+        self.fmt = fmt
+        self.stream = stream
+
+    def _write(self, text: str):
+        self.stream.write(text + "\n")
+        self.stream.flush()
+
+    def step(self, box: str, line: str, ok: bool):
+        if self.fmt == "text":
+            self._write(f"[{box}] {line}")
+        elif self.fmt == "jsonl":
+            self._write(json.dumps({"event": "step", "box": box, "line": line, "ok": ok, "t": time.time()}))
+
+    def box_done(self, result: dict):
+        if self.fmt == "text":
+            verdict = "PASS" if result["passed"] else "FAIL"
+            detail = f"report {result['report']}" if result.get("report") else result.get("error") or ""
+            self._write(f"[{result['box']}] {verdict} in {result['elapsed_s']:.2f} s {detail}".rstrip())
+        elif self.fmt == "jsonl":
+            self._write(json.dumps({"event": "result", **result}))
+
+    def summary(self, results: list):
+        passed = all(r["passed"] for r in results)
+        if self.fmt == "json":
+            self._write(json.dumps({"passed": passed, "boxes": results}, indent=2))
+        elif self.fmt == "jsonl":
+            self._write(json.dumps({"event": "summary", "passed": passed, "boxes": len(results),
+                                    "failed": [r["box"] for r in not_passed(results)]}))
+        else:
+            self._write(f"{len(results) - len(not_passed(results))}/{len(results)} boxes passed")
+
+
+def not_passed(results: list) -> list:
+    return [r for r in results if not r["passed"]]
+
+
+async def resolve_boxes(args, session: CoapSession) -> list:
+    if args.boxes:
+        return args.boxes
+    try:
+        found = await discover_ip_controller(args.serial_port, IpCache(args.ip_cache), session,
+                                             refresh=args.no_ip_cache)
+    finally:
+        await close_serial_transports()
+    if found.ip:
+        return [(found.ip, None)]
+    raise Exception("No controller IP given and none could be fetched over USB")
+
+
+async def run_box(ip: str, name: str, args, session: CoapSession, timestamp: str, out: Output) -> dict:
+    controller = ControllerClient(ip, session=session)
+    pressure = PressureRingBuffer() if args.plan == "valve_test" and not args.no_trace else None
+    started = time.monotonic()
+    result = {"box": ip, "report_name": name, "passed": False}
+    report_name = name or ip.replace(":", "_")
+    sink = None
+    if not args.no_report:
+        sink = ReportSink(os.path.join(args.report_dir, report_filename(timestamp, report_name, ".jsonl")))
+        sink.record("start", plan=args.plan, ip=ip, mode=args.mode, params=dict(args.param))
+
+    def on_step(line, ok):
+        out.step(ip, line, ok)
+
+    try:
+        params = dict(args.param)
+        if args.mode == "parallel":
+            run = await run_parallel_valve_test(controller, parse_groups(args.groups), on_step=on_step,
+                                                capture=pressure, crosstalk_psi=args.crosstalk_psi,
+                                                params=params, sink=sink)
+            steps = {step_id: step.as_dict() for plan_result in run.plan_results
+                     for step_id, step in plan_result.steps.items()}
+            result.update(modes=run.modes, timings=run.timings)
+        else:
+            plan = compile_plan(load_plan(args.plan), params)
+            run = await run_plan(plan, controller, on_step=on_step, capture=pressure, sink=sink)
+            steps = {step_id: step.as_dict() for step_id, step in run.steps.items()}
+        result.update(passed=run.passed, steps=steps)
+    except PlanError:
+        raise
+    except Exception as e:
+        logger.debug("box %s failed", ip, exc_info=True)
+        result["error"] = str(e) or repr(e)
+    finally:
+        if sink is not None:
+            error = {"error": result["error"]} if "error" in result else {}
+            sink.record("end", ip=ip, passed=result["passed"], **error)
+            await sink.aclose()
+    if sink is not None and "error" not in result:
+        # write_report moves the closed record file next to the report
+        try:
+            result["report"] = write_report(run.report_lines, timestamp, report_name, args.report_dir, pressure,
+                                            sink.path)
+        except Exception as e:
+            logger.debug("box %s report failed", ip, exc_info=True)
+            result["error"] = str(e) or repr(e)
+    result["elapsed_s"] = time.monotonic() - started
+    out.box_done(result)
+    return result
+
+
+# Compiles the plan the boxes will run, so a bad plan, --groups or --param
+# fails before any box starts
+def check_plan(args):
+    if args.mode == "parallel":
+        if args.plan != "valve_test":
+            raise PlanError("--mode parallel only applies to the valve_test plan")
+        channels = [channel for group in parse_groups(args.groups) for channel in group]
+        compile_plan(load_plan(args.plan), {**dict(args.param), "channels": channels, "serial": False})
+    else:
+        compile_plan(load_plan(args.plan), dict(args.param))
+
+
+async def main(args) -> int:
+    out = Output(args.format)
+    try:
+        check_plan(args)
+    except Exception as e:
+        print(f"error: {e}", file=sys.stderr)
+        return EXIT_ERROR
+
+    session = CoapSession()
+    try:
+        boxes = await resolve_boxes(args, session)
+    except Exception as e:
+        await session.shutdown()
+        print(f"error: {e}", file=sys.stderr)
+        return EXIT_ERROR
+    timestamp = report_timestamp()
+    try:
+        # every box finishes (or fails) before the session goes away
+        results = await asyncio.gather(*(run_box(ip, name, args, session, timestamp, out) for ip, name in boxes),
+                                       return_exceptions=True)
+    finally:
+        await session.shutdown()
+    for result in results:
+        if isinstance(result, PlanError):
+            print(f"error: {result}", file=sys.stderr)
+            return EXIT_ERROR
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    out.summary(results)
+    return EXIT_PASS if all(r["passed"] for r in results) else EXIT_FAIL
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a bento box test without the GUI")
+    parser.add_argument("boxes", nargs="*", type=parse_box, metavar="BOX", help="IP[:PORT][=REPORT_NAME]")
+    parser.add_argument("--plan", default="valve_test", help="test plan name or path (default: valve_test)")
+    parser.add_argument("--param", type=parse_param, action="append", default=[], metavar="KEY=VALUE",
+                        help="override a plan parameter; VALUE is JSON, e.g. channels=[1,2,3]")
+    parser.add_argument("--mode", choices=("serial", "parallel"), default="serial", help="valve test mode")
+    parser.add_argument("--groups", default="1-6", help="channels tested together in parallel mode, e.g. 1-3;4-6")
+    parser.add_argument("--crosstalk-psi", type=float, default=0.5,
+                        help="rise on another channel that counts as cross-talk in parallel mode")
+    parser.add_argument("--format", choices=("text", "jsonl", "json"), default="text", help="output format")
+    parser.add_argument("--serial-port", default=DEFAULT_SERIAL_PORT,
+                        help=f"controller USB console used when no BOX is given (default: {DEFAULT_SERIAL_PORT})")
+    parser.add_argument("--ip-cache", default=DEFAULT_CACHE, help=f"controller IP cache file (default: {DEFAULT_CACHE})")
+    parser.add_argument("--no-ip-cache", action="store_true",
+                        help="query the controller IP over USB even when a cached one answers")
+    parser.add_argument("--report-dir", default=".", help="directory for the report files")
+    parser.add_argument("--no-report", action="store_true", help="do not write report files")
+    parser.add_argument("--no-trace", action="store_true", help="do not record the pressure trace CSV")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING, stream=sys.stderr)
+    sys.exit(asyncio.run(main(args)))
@@ -1,10 +1,18 @@
 import json
 import logging
-from aiocoap import Context, Message, POST
 import asyncio
+import random
+import threading
+import time
+
+from control.modules import Module, ModuleQueue
+from control.valve_shadow import ValveShadow
 
 logger = logging.getLogger(__name__)
 
+# aiocoap is imported where it is first used, not at module load: importing
+# it pulls in most of the network stack and would delay the GUI window.
+
 bento_controller_ip = None  # This should be set externally by GUI or config
 
 def set_controller_ip(ip: str):
@@ -14,29 +22,393 @@ def set_controller_ip(ip: str):
 def get_controller_ip():
     return bento_controller_ip
 
-async def send_controller_comand(register: str, value, close_connection=False) -> dict:
-    if not bento_controller_ip:
+
+class CoapSession:
+    # Long-lived aiocoap client context. The UDP endpoint is bound on first use
+    # and reused for every request until shutdown() is called.
+    def __init__(self):
+        self._context = None
+        self._lock = asyncio.Lock()
+
+    async def get_context(self):
+        if self._context is None:
+            async with self._lock:
+                if self._context is None:
+                    from aiocoap import Context
+                    logger.debug("creating shared CoAP client context")
+                    self._context = await Context.create_client_context()
+        return self._context
+
+    async def request(self, request, timeout_s: float):
+        context = await self.get_context()
+        return await asyncio.wait_for(context.request(request).response, timeout=timeout_s)
+
+    async def shutdown(self):
+        context, self._context = self._context, None
+        if context is not None:
+            logger.debug("shutting down shared CoAP client context")
+            await context.shutdown()
+
+
+class ControllerUnavailable(Exception):
+    pass
+
+
+class AdaptiveTimeout:
+    # Retransmission timeout derived from measured round trips (RFC 6298):
+    # rto = srtt + 4 * rttvar, clamped to [min_s, max_s]. A timeout doubles the
+    # current value until the next successful sample.
+    def __init__(self, initial_s: float = 2.0, min_s: float = 1.0, max_s: float = 60.0):
+        self.initial_s = initial_s
+        self.min_s = min_s
+        self.max_s = max_s
+        self.srtt = None
+        self.rttvar = None
+        self._rto = initial_s
+
+    def current(self) -> float:
+        return self._rto
+
+    def observe(self, rtt_s: float):
+        if self.srtt is None:
+            self.srtt = rtt_s
+            self.rttvar = rtt_s / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt_s)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt_s
+        self._rto = min(max(self.srtt + 4 * self.rttvar, self.min_s), self.max_s)
+
+    def backoff(self):
+        self._rto = min(self._rto * 2, self.max_s)
+
+
+class RetryPolicy:
+    # Exponential backoff with full jitter between attempts of one command
+    def __init__(self, attempts: int = 3, base_delay_s: float = 0.1, max_delay_s: float = 2.0):
+        self.attempts = attempts
+        self.base_delay_s = base_delay_s
+        self.max_delay_s = max_delay_s
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay_s, self.base_delay_s * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    # Opens after `failure_threshold` consecutive failed attempts; an attempt
+    # that was already in flight when another one succeeded does not count, so
+    # losses inside a pipelined window do not trip it. While open,
+    # commands fail immediately and a background task probes the controller
+    # until it answers again. After `reset_timeout_s` one real command is also
+    # let through as a trial (half-open), in case the probe goes unanswered;
+    # other commands are rejected until the trial succeeds or fails. A trial
+    # that never reports back (cancelled) gives way to a new one after
+    # another reset_timeout_s.
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout_s: float = 10.0,
+                 probe_interval_s: float = 1.0, max_probe_interval_s: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.probe_interval_s = probe_interval_s
+        self.max_probe_interval_s = max_probe_interval_s
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.last_success_at = None
+        self.on_recover = None  # called when the breaker closes again
+        self._probe_task = None
+        self._trial_started_at = None
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            if now - self.opened_at < self.reset_timeout_s:
+                return False
+            self.state = self.HALF_OPEN
+        if self._trial_started_at is not None and now - self._trial_started_at < self.reset_timeout_s:
+            return False
+        self._trial_started_at = now
+        return True
+
+    def record_success(self):
+        self._trial_started_at = None
+        recovered = self.state != self.CLOSED
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.last_success_at = time.monotonic()
+        if recovered:
+            logger.info("circuit closed")
+            if self.on_recover is not None:
+                self.on_recover()
+
+    def record_failure(self, probe=None, started_at: float = None):
+        if started_at is not None and self.last_success_at is not None and started_at < self.last_success_at:
+            return
+        self.failures += 1
+        self._trial_started_at = None
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"circuit opened after {self.failures} failures")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            if probe is not None and (self._probe_task is None or self._probe_task.done()):
+                self._probe_task = asyncio.ensure_future(self._probe_loop(probe))
+
+    async def _probe_loop(self, probe):
+        interval = self.probe_interval_s
+        while self.state != self.CLOSED:
+            await asyncio.sleep(random.uniform(0.5, 1.0) * interval)
+            try:
+                await probe()
+            except Exception:
+                interval = min(interval * 2, self.max_probe_interval_s)
+                continue
+            self.record_success()
+
+    def cancel_probe(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            self._probe_task = None
+
+
+class ControllerStats:
+    def __init__(self):
+        self.requests = 0
+        self.failures = 0
+        self.retries = 0
+        self.rejected = 0
+        self.last_rtt_s = None
+        self.total_rtt_s = 0.0
+
+    @property
+    def mean_rtt_s(self):
+        ok = self.requests - self.failures
+        return self.total_rtt_s / ok if ok else None
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "retries": self.retries,
+            "rejected": self.rejected,
+            "last_rtt_s": self.last_rtt_s,
+            "mean_rtt_s": self.mean_rtt_s,
+        }
+
+
+class ControllerClient:
+    # One bento controller, addressed by IP (optionally "ip:port"). Each client
+    # keeps its own timeout, retry policy, circuit breaker and stats; commands
+    # to different clients can be awaited concurrently on the same loop.
+    # Without an explicit session the client sends through the background
+    # loop's shared CoAP session. At most `max_in_flight` commands are
+    # outstanding at once; further callers wait for a free slot.
+    #
+    # Requests go out non-confirmable by default: this client does its own
+    # timeouts and retries, and aiocoap keeps only one confirmable exchange
+    # per peer in flight (NSTART=1), queueing the rest behind it, including
+    # behind attempts this client has already given up on.
+    def __init__(self, ip: str, session: CoapSession = None, timeout: AdaptiveTimeout = None,
+                 retry: RetryPolicy = None, breaker: CircuitBreaker = None, max_in_flight: int = 8,
+                 confirmable: bool = False):
+        self.ip = ip
+        self.session = session
+        self.timeout = timeout or AdaptiveTimeout()
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.stats = ControllerStats()
+        self.max_in_flight = max_in_flight
+        self.confirmable = confirmable
+        # optional module commands found (un)supported at runtime, e.g. "set_valves"
+        self.capabilities = {}
+        # valve states are unknown again once the box has been unreachable
+        self.valve_shadow = ValveShadow()
+        self.breaker.on_recover = self.valve_shadow.invalidate
+        self._module_queues = {}
+        self._window = asyncio.Semaphore(max_in_flight)
+
+    @property
+    def uri(self) -> str:
+        return f"coap://{self.ip}/controller"
+
+    def _get_session(self) -> CoapSession:
+        if self.session is None:
+            from utils.threading_loop import get_coap_session
+            return get_coap_session()
+        return self.session
+
+    @property
+    def _transport_tuning(self):
+        from aiocoap import Reliable, Unreliable
+        return Reliable if self.confirmable else Unreliable
+
+    def _check_available(self):
+        if not self.breaker.allow():
+            self.stats.rejected += 1
+            raise ControllerUnavailable(f"Controller {self.ip} unavailable (circuit open)")
+
+    async def ping(self):
+        # Any CoAP response, even an error code, proves the controller is up
+        from aiocoap import Message, GET
+        request = Message(code=GET, uri=f"coap://{self.ip}/.well-known/core", transport_tuning=self._transport_tuning)
+        await self._get_session().request(request, self.timeout.current())
+
+    async def observe(self, path: str, query: list = ()):
+        # Starts an Observe subscription on coap://<ip>/<path>; returns the
+        # aiocoap request handle (await .response, then iterate .observation)
+        from aiocoap import Message, GET
+        self._check_available()
+        context = await self._get_session().get_context()
+        uri = f"coap://{self.ip}/{path}"
+        if query:
+            uri += "?" + "&".join(query)
+        return context.request(Message(code=GET, uri=uri, observe=0))
+
+    async def send(self, register: str, value) -> dict:
+        async with self._window:
+            return await self._exchange(register, value)
+
+    async def submit(self, register: str, value) -> asyncio.Future:
+        # Pipelined send: waits only for a free slot in the in-flight window
+        # (backpressure), starts the command and returns a future for its
+        # reply. Replies are matched to their requests by CoAP token.
+        await self._window.acquire()
+        try:
+            task = asyncio.ensure_future(self._exchange(register, value))
+        except BaseException:
+            self._window.release()
+            raise
+        task.add_done_callback(lambda _: self._window.release())
+        return task
+
+    async def send_many(self, commands, return_exceptions: bool = False) -> list:
+        # Sends independent (register, value) commands pipelined, in order of
+        # submission; results come back in the same order
+        futures = [await self.submit(register, value) for register, value in commands]
+        return await asyncio.gather(*futures, return_exceptions=return_exceptions)
+
+    def module_queue(self, module: Module) -> ModuleQueue:
+        queue = self._module_queues.get(module.name)
+        if queue is None:
+            queue = self._module_queues[module.name] = ModuleQueue()
+        return queue
+
+    async def relay(self, module: Module, cmd: str, data: dict) -> dict:
+        # Relays `cmd` to a CAN module through the module's own queue
+        register, value = module.command(cmd, data)
+        async with self.module_queue(module).slot(module.order_key(cmd, data)):
+            return await self.send(register, value)
+
+    async def _exchange(self, register: str, value) -> dict:
+        from aiocoap import Message, POST
+        self._check_available()
+
+        payload = json.dumps({"reg": register, "val": value}).encode('utf-8')
+        logger.debug(f"target ip: {self.ip}")
+        logger.debug(f"payload: {payload}")
+
+        last_error = None
+        for attempt in range(1, self.retry.attempts + 1):
+            if attempt > 1:
+                self.stats.retries += 1
+                await asyncio.sleep(self.retry.delay(attempt - 1))
+                self._check_available()
+
+            request = Message(code=POST, payload=payload, uri=self.uri, no_response=True,
+                              transport_tuning=self._transport_tuning)
+            self.stats.requests += 1
+            start = time.monotonic()
+            try:
+                response = await self._get_session().request(request, self.timeout.current())
+            except Exception as e:
+                self.stats.failures += 1
+                last_error = e
+                if isinstance(e, asyncio.TimeoutError):
+                    self.timeout.backoff()
+                logger.debug(f"attempt {attempt}/{self.retry.attempts} to {self.ip} failed: {e!r}")
+                self.breaker.record_failure(probe=self.ping, started_at=start)
+                continue
+
+            rtt = time.monotonic() - start
+            self.stats.last_rtt_s = rtt
+            self.stats.total_rtt_s += rtt
+            self.timeout.observe(rtt)
+            self.breaker.record_success()
+            return _decode_reply(response)
+
+        raise Exception("CoAP command failed: " + (str(last_error) or type(last_error).__name__))
+
+    async def close(self):
+        self.breaker.cancel_probe()
+        if self.session is not None:
+            await self.session.shutdown()
+
+
+_controllers = {}
+_controllers_lock = threading.Lock()
+
+# Controller client for `ip`, or for the IP set with set_controller_ip()
+def get_controller(ip: str = None) -> ControllerClient:
+    ip = ip or bento_controller_ip
+    if not ip:
         raise Exception("Controller IP not set.")
+    with _controllers_lock:
+        client = _controllers.get(ip)
+        if client is None:
+            client = _controllers[ip] = ControllerClient(ip)
+        return client
+
+def get_controllers() -> list:
+    with _controllers_lock:
+        return list(_controllers.values())
+
+async def close_controllers():
+    with _controllers_lock:
+        clients = list(_controllers.values())
+        _controllers.clear()
+    for client in clients:
+        await client.close()
 
-    timeout_s = 60
+
+# True when both the controller and the relayed module answered OK
+def reply_ok(reply: dict) -> bool:
+    if reply.get("ret") != "OK":
+        return False
+    data = reply.get("data")
+    return not isinstance(data, dict) or data.get("ret", "OK") == "OK"
+
+
+def _decode_reply(response) -> dict:
+    if len(response.payload) > 0:
+        return json.loads(response.payload.decode('utf-8'))
+    else:
+        raise Exception("Empty response payload")
+
+
+async def send_controller_comand(register: str, value, close_connection=False, controller: ControllerClient = None) -> dict:
     logger.debug("send_controller_comand")
+    if controller is None:
+        controller = get_controller()
 
-    payload = json.dumps({"reg": register, "val": value}).encode('utf-8')
-    logger.debug(f"target ip: {bento_controller_ip}")
-    logger.debug(f"payload: {payload}")
+    if not close_connection:
+        return await controller.send(register, value)
 
+    # One-shot context, torn down after the reply (kept for callers that
+    # explicitly want a fresh socket per command)
+    from aiocoap import Context, Message, POST
+    payload = json.dumps({"reg": register, "val": value}).encode('utf-8')
+    request = Message(code=POST, payload=payload, uri=controller.uri, no_response=True)
     context = await Context.create_client_context()
-    request = Message(code=POST, payload=payload, uri=f"coap://{bento_controller_ip}/controller", no_response=True)
-
     try:
-        response = await asyncio.wait_for(context.request(request).response, timeout=timeout_s)
+        response = await asyncio.wait_for(context.request(request).response, timeout=controller.timeout.current())
     except Exception as e:
         raise Exception("CoAP command failed: " + str(e))
     finally:
-        if close_connection:
-            await context.shutdown()
+        await context.shutdown()
 
-    if len(response.payload) > 0:
-        return json.loads(response.payload.decode('utf-8'))
-    else:
-        raise Exception("Empty response payload")
+    return _decode_reply(response)
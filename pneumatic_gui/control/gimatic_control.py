@@ -1,17 +1,12 @@
-from control.coap_client import send_controller_comand
+from control.coap_client import ControllerClient, get_controller
+from control.modules import GIMATIC
 
-async def send_gimatic_cmd(action: str):
-    return await send_controller_comand("RELAY_TO_MODULE_J", {
-        "origin_can_id": 0x0402,
-        "dest_can_bus_id": 0x0320,
-        "cmd": "gimatic",
-        "data": {"action": action, "wait": "no"}
-    }, close_connection=True)
+async def send_gimatic_cmd(action: str, controller: ControllerClient = None):
+    if controller is None:
+        controller = get_controller()
+    return await controller.relay(GIMATIC, "gimatic", {"action": action, "wait": "no"})
 
-async def check_gimatic_status():
-    return await send_controller_comand("RELAY_TO_MODULE_J", {
-        "origin_can_id": 0x0402,
-        "dest_can_bus_id": 0x0320,
-        "cmd": "gimatic",
-        "data": {"action": "GIMATIC_CMD_STATUS"}
-    }, close_connection=True)
\ No newline at end of file
+async def check_gimatic_status(controller: ControllerClient = None):
+    if controller is None:
+        controller = get_controller()
+    return await controller.relay(GIMATIC, "gimatic", {"action": "GIMATIC_CMD_STATUS"})
@@ -0,0 +1,135 @@
+import asyncio
+import math
+import time
+from statistics import NormalDist
+from typing import NamedTuple, Optional
+
+from control.coap_client import ControllerClient
+from control.pneumatic_control import pneumatic_read_valve_state, psi_from_reply
+
+
+class LeakResult(NamedTuple):
+    converged: bool
+    rate_psi_s: float     # pressure loss rate at the start of the test, psi/s
+    ci_low: float         # confidence interval of rate_psi_s
+    ci_high: float
+    tau_s: Optional[float]  # decay time constant (exponential model only)
+    psi: float            # last sample
+    samples: int
+    elapsed_s: float
+    reply: dict           # last p_read reply
+
+
+class LineFit:
+    # Least-squares line y = a + b * x, updated one point at a time with
+    # running means and co-moments (no stored samples, numerically stable)
+    def __init__(self):
+        self.n = 0
+        self.mean_x = 0.0
+        self.mean_y = 0.0
+        self.cxx = 0.0
+        self.cxy = 0.0
+        self.cyy = 0.0
+
+    def add(self, x: float, y: float):
+        self.n += 1
+        dx = x - self.mean_x
+        dy = y - self.mean_y
+        self.mean_x += dx / self.n
+        self.mean_y += dy / self.n
+        self.cxx += dx * (x - self.mean_x)
+        self.cxy += dx * (y - self.mean_y)
+        self.cyy += dy * (y - self.mean_y)
+
+    @property
+    def slope(self) -> float:
+        return self.cxy / self.cxx if self.cxx > 0 else 0.0
+
+    @property
+    def intercept(self) -> float:
+        return self.mean_y - self.slope * self.mean_x
+
+    def slope_se(self) -> float:
+        # standard error of the slope; inf until there are 3 points
+        if self.n < 3 or self.cxx <= 0:
+            return math.inf
+        sse = max(self.cyy - self.slope * self.cxy, 0.0)
+        return math.sqrt(sse / (self.n - 2) / self.cxx)
+
+
+def t_quantile(p: float, df: int) -> float:
+    # Student's t quantile by the Cornish-Fisher expansion around the normal
+    # quantile; within 1 % of the exact value from df = 3
+    z = NormalDist().inv_cdf(p)
+    return (z + (z ** 3 + z) / (4 * df) + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2)
+            + (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * df ** 3))
+
+
+class LeakDetector:
+    # Pressure decay test of a closed channel. p_read is sampled every
+    # interval_s (0: back to back) and a decay model is updated with every
+    # sample:
+    #   baseline_psi given: psi = baseline + A * exp(-t / tau), fitted as a
+    #     line through log(psi - baseline); the leak rate is A / tau, the
+    #     loss rate at the start
+    #   no baseline: psi = p0 - rate * t
+    # The test stops as soon as the `confidence` interval of the rate is
+    # narrower than +-max(rel_ci * rate, abs_ci_psi_s), after at least
+    # min_samples, or after timeout_s with converged=False. The interval of
+    # the exponential model's rate covers the uncertainty of 1 / tau only.
+    def __init__(self, interval_s: float = 0.02, min_samples: int = 8, timeout_s: float = 5.0,
+                 confidence: float = 0.95, rel_ci: float = 0.2, abs_ci_psi_s: float = 0.05):
+        if min_samples < 5:
+            raise ValueError("min_samples must be at least 5")
+        self.interval_s = interval_s
+        self.min_samples = min_samples
+        self.timeout_s = timeout_s
+        self.confidence = confidence
+        self.rel_ci = rel_ci
+        self.abs_ci_psi_s = abs_ci_psi_s
+
+    async def measure(self, channel: int, controller: ControllerClient,
+                      baseline_psi: float = None) -> LeakResult:
+        started = time.monotonic()
+        fit = LineFit()
+        samples = 0
+        while True:
+            sampled_at = time.monotonic()
+            reply = await pneumatic_read_valve_state(channel, controller=controller)
+            psi = psi_from_reply(reply)
+            samples += 1
+            t = sampled_at - started
+            if baseline_psi is None:
+                fit.add(t, psi)
+            elif psi - baseline_psi > 0:
+                # at or below the baseline the log is undefined; such a
+                # sample adds nothing to the fit
+                fit.add(t, math.log(psi - baseline_psi))
+            elapsed = time.monotonic() - started
+            rate, half, tau = self._estimate(fit, baseline_psi)
+            converged = fit.n >= self.min_samples and half <= max(self.rel_ci * abs(rate), self.abs_ci_psi_s)
+            if converged or elapsed >= self.timeout_s:
+                return LeakResult(converged, rate, rate - half, rate + half, tau, psi, samples, elapsed, reply)
+            delay = self.interval_s - (time.monotonic() - sampled_at)
+            await asyncio.sleep(min(max(delay, 0), self.timeout_s - elapsed))
+
+    def _estimate(self, fit: LineFit, baseline_psi: Optional[float]):
+        # (rate psi/s, confidence half-width, tau_s)
+        if fit.n < 3:
+            return 0.0, math.inf, None
+        half = t_quantile(0.5 + self.confidence / 2, fit.n - 2) * fit.slope_se()
+        if baseline_psi is None:
+            return -fit.slope, half, None
+        # log(psi - baseline) = log(A) - t / tau
+        amplitude = math.exp(fit.intercept)
+        tau = -1 / fit.slope if fit.slope < 0 else None
+        return -fit.slope * amplitude, half * amplitude, tau
+
+
+def describe_leak(result: LeakResult) -> str:
+    text = (f"{result.rate_psi_s:.3f} psi/s [{result.ci_low:.3f}, {result.ci_high:.3f}] "
+            f"({result.samples} samples, {result.elapsed_s:.2f} s")
+    if result.tau_s is not None:
+        text += f", tau {result.tau_s:.1f} s"
+    text += ")"
+    return text if result.converged else "not converged: " + text
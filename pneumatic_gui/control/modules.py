@@ -0,0 +1,108 @@
+import asyncio
+import contextlib
+from typing import Dict, Optional, Tuple
+
+# Registry of the CAN modules reachable through the controller's
+# RELAY_TO_MODULE_J register: each module's CAN address and the commands it
+# accepts. ControllerClient.relay() builds payloads from it and runs every
+# command through that module's queue, so traffic to different modules
+# overlaps while traffic to the same module stays ordered.
+
+RELAY_REGISTER = "RELAY_TO_MODULE_J"
+ORIGIN_CAN_ID = 0x0402
+
+
+class CommandSpec:
+    # required: keys the command's data must carry.
+    # order_key: data field naming the resource the command acts on (e.g. the
+    # valve). Commands with the same value never overlap; commands without an
+    # order_key act on the whole module and run alone.
+    def __init__(self, required: Tuple[str, ...] = (), order_key: Optional[str] = None):
+        self.required = required
+        self.order_key = order_key
+
+
+class Module:
+    def __init__(self, name: str, can_id: int, commands: Dict[str, CommandSpec]):
+        self.name = name
+        self.can_id = can_id
+        self.commands = commands
+
+    def command(self, cmd: str, data: dict):
+        spec = self.commands.get(cmd)
+        if spec is None:
+            raise Exception(f"Unknown {self.name} command: {cmd}")
+        missing = [key for key in spec.required if key not in data]
+        if missing:
+            raise Exception(f"{self.name} command {cmd} is missing {', '.join(missing)}")
+        return RELAY_REGISTER, {
+            "origin_can_id": ORIGIN_CAN_ID,
+            "dest_can_bus_id": self.can_id,
+            "cmd": cmd,
+            "data": data
+        }
+
+    def order_key(self, cmd: str, data: dict):
+        spec = self.commands[cmd]
+        return None if spec.order_key is None else data.get(spec.order_key)
+
+
+class ModuleQueue:
+    # Command queue of one module on one controller. Commands are admitted in
+    # FIFO order; those with the same order key run one at a time, and a
+    # command without a key waits for everything admitted before it and holds
+    # back everything after it.
+    def __init__(self):
+        self._admit = asyncio.Lock()
+        self._keys = {}
+        self._active = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.depth = 0
+
+    @contextlib.asynccontextmanager
+    async def slot(self, key=None):
+        self.depth += 1
+        try:
+            if key is None:
+                async with self._admit:
+                    await self._idle.wait()
+                    yield
+            else:
+                async with self._admit:
+                    lock = self._keys.setdefault(key, asyncio.Lock())
+                    self._active += 1
+                    self._idle.clear()
+                try:
+                    async with lock:
+                        yield
+                finally:
+                    self._active -= 1
+                    if not self._active:
+                        self._idle.set()
+        finally:
+            self.depth -= 1
+
+
+PNEUMATIC = Module("pneumatic", 544, {
+    "set_valve": CommandSpec(("valve_n", "open"), order_key="valve_n"),
+    "set_valves": CommandSpec(("valves",)),
+    "p_read": CommandSpec(("valve_n",), order_key="valve_n"),
+})
+
+GIMATIC = Module("gimatic", 0x0320, {
+    "gimatic": CommandSpec(("action",)),
+})
+
+MODULES = {module.name: module for module in (PNEUMATIC, GIMATIC)}
+
+
+def register_module(module: Module):
+    MODULES[module.name] = module
+
+
+def get_module(name: str) -> Module:
+    module = MODULES.get(name)
+    if module is None:
+        raise Exception(f"Unknown module: {name}")
+    return module
@@ -1,17 +1,116 @@
-from control.coap_client import send_controller_comand
-
-async def pneumatic_set_valve(channel_number: int, open_value: bool):
-    return await send_controller_comand("RELAY_TO_MODULE_J", {
-        "origin_can_id": 0x0402,
-        "dest_can_bus_id": 544,
-        "cmd": "set_valve",
-        "data": {"valve_n": channel_number, "open": open_value}
-    }, close_connection=True)
-
-async def pneumatic_read_valve_state(channel_number: int):
-    return await send_controller_comand("RELAY_TO_MODULE_J", {
-        "origin_can_id": 0x0402,
-        "dest_can_bus_id": 544,
-        "cmd": "p_read",
-        "data": {"valve_n": channel_number}
-    }, close_connection=True)
+import asyncio
+from typing import Dict
+
+from control.coap_client import ControllerClient, get_controller, reply_ok
+from control.modules import PNEUMATIC
+
+def set_valve_command(channel_number: int, open_value: bool):
+    return PNEUMATIC.command("set_valve", {"valve_n": channel_number, "open": open_value})
+
+def read_valve_command(channel_number: int):
+    return PNEUMATIC.command("p_read", {"valve_n": channel_number})
+
+def _valves_data(states: Dict[int, bool]) -> dict:
+    return {"valves": [{"valve_n": n, "open": open_value} for n, open_value in states.items()]}
+
+def set_valves_command(states: Dict[int, bool]):
+    return PNEUMATIC.command("set_valves", _valves_data(states))
+
+# Stand-in reply for a set_valve skipped because the valve shadow already
+# shows the requested state
+def _skipped_reply(cmd: str) -> dict:
+    return {"ret": "OK", "cmd": cmd, "data": {"ret": "OK", "cmd": cmd}, "skipped": True}
+
+# Commands that would not change a valve (per the controller's valve shadow)
+# are skipped unless force=True
+async def pneumatic_set_valve(channel_number: int, open_value: bool, controller: ControllerClient = None,
+                              force: bool = False):
+    if controller is None:
+        controller = get_controller()
+    shadow = controller.valve_shadow
+    if not force and shadow.matches(channel_number, open_value):
+        shadow.skipped += 1
+        return _skipped_reply("set_valve")
+
+    try:
+        reply = await controller.relay(PNEUMATIC, "set_valve", {"valve_n": channel_number, "open": open_value})
+    except Exception:
+        shadow.invalidate(channel_number)
+        raise
+    if reply_ok(reply):
+        shadow.update(channel_number, open_value)
+    else:
+        shadow.invalidate(channel_number)
+    return reply
+
+async def pneumatic_read_valve_state(channel_number: int, controller: ControllerClient = None):
+    if controller is None:
+        controller = get_controller()
+    return await controller.relay(PNEUMATIC, "p_read", {"valve_n": channel_number})
+
+def psi_from_reply(reply: dict) -> float:
+    return float(reply["data"]["psi"])
+
+async def pneumatic_read_psi(channel_number: int, controller: ControllerClient = None) -> float:
+    return psi_from_reply(await pneumatic_read_valve_state(channel_number, controller=controller))
+
+# Sets several valves at once, e.g. {1: False, ..., 6: False}. Uses a single
+# set_valves relay when the pneumatic module supports it, otherwise pipelines
+# one set_valve per channel. Valves the shadow already shows in the requested
+# state are skipped unless force=True. Returns {channel: reply} where reply is
+# the per-valve reply dict, or the Exception for a valve that failed.
+async def pneumatic_set_valves(states: Dict[int, bool], controller: ControllerClient = None,
+                               force: bool = False) -> dict:
+    if controller is None:
+        controller = get_controller()
+    shadow = controller.valve_shadow
+    results = {}
+    pending = {}
+    for channel, open_value in states.items():
+        if not force and shadow.matches(channel, open_value):
+            shadow.skipped += 1
+            results[channel] = _skipped_reply("set_valve")
+        else:
+            pending[channel] = open_value
+
+    sent = await _send_valve_states(pending, controller)
+    for channel, reply in sent.items():
+        if isinstance(reply, Exception):
+            shadow.invalidate(channel)
+        else:
+            shadow.update(channel, pending[channel])
+    results.update(sent)
+    return {channel: results[channel] for channel in states}
+
+async def _send_valve_states(states: Dict[int, bool], controller: ControllerClient) -> dict:
+    if not states:
+        return {}
+
+    if controller.capabilities.get("set_valves", True):
+        try:
+            reply = await controller.relay(PNEUMATIC, "set_valves", _valves_data(states))
+        except Exception as e:
+            return {channel: e for channel in states}
+        data = reply.get("data", {})
+        if data.get("data") == "Command not found":
+            controller.capabilities["set_valves"] = False
+        else:
+            controller.capabilities["set_valves"] = True
+            per_valve = {r.get("valve_n"): r for r in data.get("results", [])}
+            results = {}
+            for channel in states:
+                if channel in per_valve:
+                    result = dict(reply, data=per_valve[channel], ret=per_valve[channel].get("ret"))
+                else:
+                    result = reply
+                results[channel] = result if reply_ok(result) else Exception(f"Valve {channel} not set: {result}")
+            return results
+
+    replies = await asyncio.gather(*(controller.relay(PNEUMATIC, "set_valve", {"valve_n": n, "open": v})
+                                     for n, v in states.items()), return_exceptions=True)
+    results = {}
+    for channel, reply in zip(states, replies):
+        if not isinstance(reply, Exception) and not reply_ok(reply):
+            reply = Exception(f"Valve {channel} not set: {reply}")
+        results[channel] = reply
+    return results
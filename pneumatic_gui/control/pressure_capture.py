@@ -0,0 +1,139 @@
+import csv
+import time
+from array import array
+from typing import Iterable, Iterator, List, NamedTuple, Optional
+
+from control.coap_client import ControllerClient
+from control.pressure_stream import PressureSample, PressureStream
+
+
+class PressureBucket(NamedTuple):
+    timestamp: float  # start of the bucket
+    channel: int
+    psi_mean: float
+    psi_min: float
+    psi_max: float
+    samples: int
+
+
+class PressureRingBuffer:
+    # Fixed-size store of (timestamp, channel, psi) samples in preallocated
+    # typed arrays (14 bytes per sample). Once `capacity` samples are held the
+    # oldest are overwritten, so memory stays flat however long a soak run
+    # lasts; `overwritten` counts the samples lost that way. Timestamps are
+    # time.monotonic() values, like PressureSample's.
+    def __init__(self, capacity: int = 65536):
+        self.capacity = capacity
+        self._t = array('d', bytes(8 * capacity))
+        self._psi = array('f', bytes(4 * capacity))
+        self._ch = array('H', bytes(2 * capacity))
+        self._next = 0
+        self._count = 0
+        self.overwritten = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, timestamp: float, channel: int, psi: float):
+        i = self._next
+        self._t[i] = timestamp
+        self._ch[i] = channel
+        self._psi[i] = psi
+        self._next = (i + 1) % self.capacity
+        if self._count < self.capacity:
+            self._count += 1
+        else:
+            self.overwritten += 1
+
+    # Usable directly as a PressureStream callback
+    def add(self, sample: PressureSample):
+        self.append(sample.timestamp, sample.channel, sample.psi)
+
+    def clear(self):
+        self._next = 0
+        self._count = 0
+        self.overwritten = 0
+
+    # Samples oldest first, optionally for one channel and/or from `since` on
+    def samples(self, channel: int = None, since: float = None) -> Iterator[PressureSample]:
+        start = (self._next - self._count) % self.capacity
+        for k in range(self._count):
+            i = (start + k) % self.capacity
+            if channel is not None and self._ch[i] != channel:
+                continue
+            if since is not None and self._t[i] < since:
+                continue
+            yield PressureSample(self._t[i], self._ch[i], self._psi[i])
+
+    def channels(self) -> List[int]:
+        return sorted({ch for ch in self._ch[:self._count]}) if self._count else []
+
+    def oldest_timestamp(self) -> Optional[float]:
+        if not self._count:
+            return None
+        return self._t[(self._next - self._count) % self.capacity]
+
+    # Reduces the samples to one mean/min/max row per channel and bucket_s
+    # interval, oldest first. Buckets start at `origin` (default: the oldest
+    # sample).
+    def downsample(self, bucket_s: float, channel: int = None, since: float = None,
+                   origin: float = None) -> List[PressureBucket]:
+        if origin is None:
+            origin = self.oldest_timestamp() or 0.0
+        buckets = {}
+        for sample in self.samples(channel, since):
+            key = (sample.channel, int((sample.timestamp - origin) // bucket_s))
+            b = buckets.get(key)
+            if b is None:
+                buckets[key] = [sample.psi, sample.psi, sample.psi, 1]
+            else:
+                b[0] += sample.psi
+                b[1] = min(b[1], sample.psi)
+                b[2] = max(b[2], sample.psi)
+                b[3] += 1
+        rows = [PressureBucket(origin + index * bucket_s, ch, total / n, lo, hi, n)
+                for (ch, index), (total, lo, hi, n) in buckets.items()]
+        rows.sort(key=lambda row: (row.timestamp, row.channel))
+        return rows
+
+    # Writes the samples (or, with bucket_s, the downsampled rows) as CSV.
+    # Timestamps are written relative to `origin` (default: the oldest
+    # sample) so files from different runs line up.
+    def export_csv(self, path: str, channel: int = None, bucket_s: float = None, origin: float = None):
+        if origin is None:
+            origin = self.oldest_timestamp() or 0.0
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            if bucket_s is None:
+                writer.writerow(["t_s", "channel", "psi"])
+                for sample in self.samples(channel):
+                    writer.writerow([f"{sample.timestamp - origin:.4f}", sample.channel, f"{sample.psi:.3f}"])
+            else:
+                writer.writerow(["t_s", "channel", "psi_mean", "psi_min", "psi_max", "samples"])
+                for row in self.downsample(bucket_s, channel, origin=origin):
+                    writer.writerow([f"{row.timestamp - origin:.4f}", row.channel, f"{row.psi_mean:.3f}",
+                                     f"{row.psi_min:.3f}", f"{row.psi_max:.3f}", row.samples])
+
+
+class PressureCapture:
+    # Records `channels` into `buffer` for the duration of an async with
+    # block, through a PressureStream (CoAP Observe, else p_read polling
+    # every poll_interval_s).
+    def __init__(self, buffer: PressureRingBuffer, channels: Iterable[int], controller: ControllerClient = None,
+                 poll_interval_s: float = 0.05):
+        self.buffer = buffer
+        self.started_at = None
+        self._stream = PressureStream(channels, controller, callback=buffer.add, poll_interval_s=poll_interval_s,
+                                      max_queued=1)
+
+    @property
+    def mode(self) -> Optional[str]:
+        return self._stream.mode
+
+    async def __aenter__(self):
+        self.started_at = time.monotonic()
+        self._stream.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._stream.stop()
@@ -0,0 +1,140 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Callable, Iterable, NamedTuple, Optional
+
+from control.coap_client import ControllerClient, get_controller
+from control.pneumatic_control import pneumatic_read_psi
+
+logger = logging.getLogger(__name__)
+
+# Observable pressure resource on the controller. One notification carries the
+# latest psi of every subscribed channel: {"psi": {"1": 6.82, "2": 17.91}}
+OBSERVE_PATH = "pressure"
+
+
+class PressureSample(NamedTuple):
+    timestamp: float
+    channel: int
+    psi: float
+
+
+class PressureStream:
+    # Streams psi updates for `channels` as PressureSample values, through an
+    # optional callback and/or by iterating the stream:
+    #
+    #     async with PressureStream([1, 2], controller) as stream:
+    #         async for sample in stream:
+    #             ...
+    #
+    # Subscribes with CoAP Observe when the controller supports it. Otherwise,
+    # or when the observation ends, it falls back to polling p_read every
+    # poll_interval_s. `mode` reports which of the two is active. When the
+    # iterator is not drained fast enough the oldest samples are dropped.
+    def __init__(self, channels: Iterable[int], controller: ControllerClient = None,
+                 callback: Optional[Callable[[PressureSample], None]] = None,
+                 poll_interval_s: float = 0.1, use_observe: bool = True,
+                 subscribe_timeout_s: float = 2.0, max_queued: int = 1024):
+        self.channels = list(channels)
+        self.controller = controller
+        self.callback = callback
+        self.poll_interval_s = poll_interval_s
+        self.use_observe = use_observe
+        self.subscribe_timeout_s = subscribe_timeout_s
+        self.mode = None
+        self._queue = asyncio.Queue(maxsize=max_queued)
+        self._task = None
+        self._request = None
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    def start(self):
+        if self.controller is None:
+            self.controller = get_controller()
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        self._cancel_observation()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _cancel_observation(self):
+        request, self._request = self._request, None
+        if request is not None and not request.observation.cancelled:
+            request.observation.cancel()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> PressureSample:
+        if self._task is None:
+            raise StopAsyncIteration
+        return await self._queue.get()
+
+    def _emit(self, sample: PressureSample):
+        if self._queue.full():
+            self._queue.get_nowait()
+        self._queue.put_nowait(sample)
+        if self.callback is not None:
+            try:
+                self.callback(sample)
+            except Exception:
+                logger.exception("pressure callback failed")
+
+    def _emit_notification(self, payload: bytes):
+        ts = time.monotonic()
+        readings = json.loads(payload.decode('utf-8'))["psi"]
+        for channel in self.channels:
+            psi = readings.get(str(channel))
+            if psi is not None:
+                self._emit(PressureSample(ts, channel, float(psi)))
+
+    async def _run(self):
+        if self.use_observe:
+            try:
+                await self._observe()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._cancel_observation()
+                logger.info(f"pressure observe unavailable on {self.controller.ip} ({e!r}), polling p_read")
+        await self._poll()
+
+    async def _observe(self):
+        query = [f"valve_n={channel}" for channel in self.channels]
+        self._request = await self.controller.observe(OBSERVE_PATH, query)
+        first = await asyncio.wait_for(self._request.response, timeout=self.subscribe_timeout_s)
+        if not first.code.is_successful():
+            raise Exception(f"subscription rejected: {first.code}")
+        if first.opt.observe is None:
+            raise Exception("resource is not observable")
+        self.mode = "observe"
+        self._emit_notification(first.payload)
+        async for notification in self._request.observation:
+            self._emit_notification(notification.payload)
+        raise Exception("observation ended")
+
+    async def _poll(self):
+        self.mode = "poll"
+        while True:
+            started = time.monotonic()
+            for channel in self.channels:
+                try:
+                    psi = await pneumatic_read_psi(channel, controller=self.controller)
+                except Exception as e:
+                    logger.debug(f"p_read of valve {channel} failed: {e}")
+                    continue
+                self._emit(PressureSample(time.monotonic(), channel, psi))
+            await asyncio.sleep(max(0.0, self.poll_interval_s - (time.monotonic() - started)))
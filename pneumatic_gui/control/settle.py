@@ -0,0 +1,68 @@
+import asyncio
+import time
+from typing import NamedTuple, Optional
+
+from control.coap_client import ControllerClient
+from control.pneumatic_control import pneumatic_read_valve_state, psi_from_reply
+
+
+class SettleResult(NamedTuple):
+    settled: bool
+    elapsed_s: float
+    psi: float
+    reply: dict  # last p_read reply
+    samples: int
+
+
+class SettleDetector:
+    # Waits for a channel's pressure to stop moving instead of sleeping a
+    # fixed time. p_read is sampled every interval_s; the pressure counts as
+    # settled once the last `window` samples all lie within band_psi of each
+    # other. With min_change_psi set (e.g. after opening a valve) it must
+    # also have moved that far from start_psi, so a valve that has not
+    # started to fill yet does not look settled. Gives up after timeout_s and
+    # returns the last sample with settled=False.
+    def __init__(self, band_psi: float = 0.2, window: int = 4, interval_s: float = 0.05,
+                 timeout_s: float = 2.0, min_change_psi: Optional[float] = None):
+        self.band_psi = band_psi
+        self.window = window
+        self.interval_s = interval_s
+        self.timeout_s = timeout_s
+        self.min_change_psi = min_change_psi
+
+    async def wait(self, channel: int, controller: ControllerClient, start_psi: float = None) -> SettleResult:
+        started = time.monotonic()
+        recent = []
+        samples = 0
+        while True:
+            sampled_at = time.monotonic()
+            reply = await pneumatic_read_valve_state(channel, controller=controller)
+            psi = psi_from_reply(reply)
+            samples += 1
+            recent = (recent + [psi])[-self.window:]
+            elapsed = time.monotonic() - started
+            if self._stable(recent, start_psi):
+                return SettleResult(True, elapsed, psi, reply, samples)
+            if elapsed >= self.timeout_s:
+                return SettleResult(False, elapsed, psi, reply, samples)
+            delay = self.interval_s - (time.monotonic() - sampled_at)
+            await asyncio.sleep(min(max(delay, 0), self.timeout_s - elapsed))
+
+    def _stable(self, recent, start_psi) -> bool:
+        if len(recent) < self.window or max(recent) - min(recent) > self.band_psi:
+            return False
+        if self.min_change_psi is not None and start_psi is not None:
+            return abs(recent[-1] - start_psi) >= self.min_change_psi
+        return True
+
+
+# Defaults for the QC valve test; the timeouts bound the worst case near the
+# fixed delays they replace
+OPEN_SETTLE = SettleDetector(timeout_s=2.0, min_change_psi=1.0)
+CLOSE_SETTLE = SettleDetector(timeout_s=0.5)
+
+
+def describe_settle(result: SettleResult) -> str:
+    if result.settled:
+        return f"{result.elapsed_s:.2f} s ({result.psi:.2f} psi, {result.samples} samples)"
+    return f"not settled after {result.elapsed_s:.2f} s ({result.psi:.2f} psi, {result.samples} samples)"
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import threading
+from typing import Callable, Iterable, Optional
+
+from control.coap_client import get_controller
+from control.pneumatic_control import pneumatic_set_valve
+from utils.task_scheduler import schedule_coro, Priority
+
+logger = logging.getLogger(__name__)
+
+# on_done(open_value, error) for the command that was actually sent; error is
+# None on success. Called on the background loop thread.
+DoneCallback = Callable[[bool, Optional[Exception]], None]
+
+
+class ValveCommandCoalescer:
+    # Sits between GUI clicks and pneumatic_set_valve. Only the latest
+    # requested state of each (controller, channel) is kept: a click that
+    # arrives while an earlier one is still waiting replaces it, and one
+    # sender task per channel sends whatever is latest once the previous
+    # round trip is done, so commands to a valve can never overtake each
+    # other. Opens are held for debounce_s to absorb double clicks; closes go
+    # out immediately in the EMERGENCY lane. A close that supersedes a
+    # still-waiting open hands the channel to a new EMERGENCY sender; the
+    # COMMAND-lane sender stands down at its next look at the queue. An open
+    # already on the wire stays ahead of the close in the module's queue.
+    def __init__(self, debounce_s: float = 0.05):
+        self.debounce_s = debounce_s
+        self.superseded = 0
+        self.sent = 0
+        self._lock = threading.Lock()
+        self._latest = {}  # (ip, channel) -> (open_value, on_done)
+        self._senders = {}  # (ip, channel) -> token of the sender task that owns it
+
+    # Safe to call from the Tk thread; returns at once
+    def submit(self, ip: str, channel: int, open_value: bool, on_done: DoneCallback = None):
+        key = (ip, channel)
+        with self._lock:
+            if key in self._latest:
+                self.superseded += 1
+            self._latest[key] = (open_value, on_done)
+            sender = self._senders.get(key)
+            if sender is not None and (open_value or sender[1] == Priority.EMERGENCY):
+                return
+            priority = Priority.COMMAND if open_value else Priority.EMERGENCY
+            token = (object(), priority)
+            self._senders[key] = token
+        schedule_coro(self._drain(key, token), priority, f"valve {channel}")
+
+    # Forget pending (not yet sent) commands, e.g. before an "all valves"
+    # command that replaces them
+    def discard(self, ip: str, channels: Iterable[int]):
+        with self._lock:
+            for channel in channels:
+                if self._latest.pop((ip, channel), None) is not None:
+                    self.superseded += 1
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._latest)
+
+    async def _drain(self, key, token):
+        try:
+            with self._lock:
+                first = self._latest.get(key)
+            if first is not None and first[0]:
+                await asyncio.sleep(self.debounce_s)
+            while True:
+                request = self._next_request(key, token)
+                if request is None:
+                    return
+                await self._send(key, *request)
+        except BaseException:
+            with self._lock:
+                if self._senders.get(key) is token:
+                    del self._senders[key]
+            raise
+
+    # The latest request for `key`, or None when this sender is done: nothing
+    # left (the channel is released) or the channel was handed over to an
+    # EMERGENCY sender
+    def _next_request(self, key, token):
+        with self._lock:
+            if self._senders.get(key) is not token:
+                return None
+            request = self._latest.pop(key, None)
+            if request is None:
+                del self._senders[key]
+            return request
+
+    async def _send(self, key, open_value: bool, on_done: Optional[DoneCallback]):
+        ip, channel = key
+        error = None
+        try:
+            await pneumatic_set_valve(channel, open_value, controller=get_controller(ip))
+        except Exception as e:
+            error = e
+        self.sent += 1
+        if on_done is not None:
+            try:
+                on_done(open_value, error)
+            except Exception:
+                logger.exception("Valve command callback failed")
@@ -0,0 +1,37 @@
+import time
+from typing import Optional
+
+
+class ValveShadow:
+    # Last commanded open/closed state of each valve on one controller,
+    # written through on every acknowledged set_valve / set_valves. The
+    # controller has no command that reports valve state (p_read only returns
+    # psi), so the shadow is never reconciled with the hardware: an entry is
+    # trusted for ttl_s seconds only, and invalidate() forgets one channel or,
+    # with no argument, all of them (e.g. after a reconnect).
+    def __init__(self, ttl_s: float = 60.0):
+        self.ttl_s = ttl_s
+        self.skipped = 0
+        self._states = {}  # channel -> (open_value, updated_at)
+
+    def get(self, channel: int) -> Optional[bool]:
+        entry = self._states.get(channel)
+        if entry is None:
+            return None
+        open_value, updated_at = entry
+        if time.monotonic() - updated_at > self.ttl_s:
+            del self._states[channel]
+            return None
+        return open_value
+
+    def matches(self, channel: int, open_value: bool) -> bool:
+        return self.get(channel) == bool(open_value)
+
+    def update(self, channel: int, open_value: bool):
+        self._states[channel] = (bool(open_value), time.monotonic())
+
+    def invalidate(self, channel: int = None):
+        if channel is None:
+            self._states.clear()
+        else:
+            self._states.pop(channel, None)
@@ -1,16 +1,38 @@
+import asyncio
+import logging
 import tkinter as tk
 from tkinter import ttk, simpledialog
-from control.pneumatic_control import pneumatic_set_valve, pneumatic_read_valve_state
+from control.pneumatic_control import pneumatic_set_valves
 from control.gimatic_control import send_gimatic_cmd, check_gimatic_status
-from utils.ip_utils import get_ip_controller
-from utils.task_scheduler import schedule_coro
+from control.coap_client import get_controller, get_controller_ip
+from control.pressure_capture import PressureRingBuffer
+from control.valve_coalescer import ValveCommandCoalescer
+from testplan.plan import load_plan, compile_plan
+from testplan.engine import run_plan
+from testplan.parallel import run_parallel_valve_test, parse_groups
+from utils.ip_utils import discover_ip_controller
+from utils.report_sink import ReportSink
+from utils.reports import report_filename, report_timestamp, write_report
+from utils.task_scheduler import schedule_coro, Priority
+from utils.threading_loop import warm_up_network
+from gui.ui_bus import UIUpdateBus
+
+logger = logging.getLogger(__name__)
 
 class PneumaticControlGUI:
     def __init__(self):
         self.root = tk.Tk()
         self.root.title("Pneumatic Control GUI")
         self.root.resizable(False, False)
+        self._sequence_handle = None
+        self._gimatic_handle = None
+        self.valve_commands = ValveCommandCoalescer()
+        self.ui = UIUpdateBus(self.root)
         self._build_widgets()
+        self.ui.start()
+        # The network stack loads on the background loop once the window is up
+        self.root.after(100, lambda: schedule_coro(warm_up_network(), Priority.READ, "network warm-up"))
+        self.root.after(150, lambda: schedule_coro(self._restore_cached_ip(), Priority.READ, "cached IP"))
         self.root.mainloop()
 
     def _build_widgets(self):
@@ -22,7 +44,7 @@ class PneumaticControlGUI:
 
         self.status_canvas = tk.Canvas(self.root, width=20, height=20, highlightthickness=0)
         self.status_canvas.pack()
-        self._update_status("grey")
+        self._status_oval = self.status_canvas.create_oval(2, 2, 18, 18, fill="grey", outline="grey")
 
         self.message_label = tk.Label(self.root, text="", font=("Arial", 10), fg="red")
         self.message_label.pack(pady=(0, 10))
@@ -39,8 +61,25 @@ class PneumaticControlGUI:
         self._build_auto_tab()
 
     def _update_status(self, color):
-        self.status_canvas.delete("all")
-        self.status_canvas.create_oval(2, 2, 18, 18, fill=color, outline=color)
+        self.status_canvas.itemconfig(self._status_oval, fill=color, outline=color)
+
+    def _set_message(self, text):
+        self.message_label.config(text=text)
+
+    def _set_ip(self, ip):
+        self.ip_entry.delete(0, tk.END)
+        self.ip_entry.insert(0, ip)
+
+    # Widget updates go through the UI bus, from any thread; they are applied
+    # on the next frame, latest value per widget
+    def _post_status(self, color):
+        self.ui.post("status", self._update_status, color)
+
+    def _post_message(self, text):
+        self.ui.post("message", self._set_message, text)
+
+    def _post_ip(self, ip):
+        self.ui.post("ip", self._set_ip, ip)
 
     def _build_manual_tab(self):
         tk.Button(self.manual_tab, text="Fetch IP Address", command=self.fetch_ip).pack(pady=5)
@@ -49,71 +88,249 @@ class PneumaticControlGUI:
         for i in range(6):
             tk.Button(frame, text=f"Open {i+1}", command=lambda i=i: self.control_valve(i+1, True)).grid(row=0, column=i)
             tk.Button(frame, text=f"Close {i+1}", command=lambda i=i: self.control_valve(i+1, False)).grid(row=1, column=i)
+        tk.Button(frame, text="Open All", command=lambda: self.control_all_valves(True)).grid(row=0, column=6)
+        tk.Button(frame, text="Close All", command=lambda: self.control_all_valves(False)).grid(row=1, column=6)
 
         tk.Button(self.manual_tab, text="Gimatic Open", command=lambda: self.run_gimatic_cmd("GIMATIC_CMD_OPEN")).pack(pady=5)
         tk.Button(self.manual_tab, text="Gimatic Close", command=lambda: self.run_gimatic_cmd("GIMATIC_CMD_CLOSE")).pack(pady=5)
         tk.Button(self.manual_tab, text="Gimatic Status", command=self.run_gimatic_status_check).pack(pady=5)
 
     def _build_auto_tab(self):
+        mode_frame = tk.Frame(self.auto_tab)
+        mode_frame.pack(pady=(10, 0))
+        self.test_mode = tk.StringVar(value="serial")
+        tk.Radiobutton(mode_frame, text="Serial", variable=self.test_mode, value="serial").grid(row=0, column=0)
+        tk.Radiobutton(mode_frame, text="Parallel", variable=self.test_mode, value="parallel").grid(row=0, column=1)
+        # Channels that may be tested together, e.g. "1-3;4-6"
+        tk.Label(mode_frame, text="Channel groups:").grid(row=1, column=0)
+        self.groups_entry = tk.Entry(mode_frame, width=12)
+        self.groups_entry.insert(0, "1-6")
+        self.groups_entry.grid(row=1, column=1)
         tk.Button(self.auto_tab, text="Start Valve Test", command=self.start_sequence).pack(pady=10)
+        tk.Button(self.auto_tab, text="Start Leak Test", command=lambda: self.start_sequence("leak_test")).pack(pady=10)
+        tk.Button(self.auto_tab, text="Stop Valve Test", command=self.stop_sequence).pack(pady=10)
         tk.Button(self.auto_tab, text="Start Gimatic Test", command=self.start_gimatic_test).pack(pady=10)
 
-    def fetch_ip(self):
+    # Preselects the last box's IP when it is still cached and answers; no USB
+    async def _restore_cached_ip(self):
         from control.coap_client import set_controller_ip
-        ip = get_ip_controller()
-        if ip:
+        ip = (await discover_ip_controller(attempts=0)).ip
+        if ip and not get_controller_ip():
             set_controller_ip(ip)
-            self.ip_entry.delete(0, tk.END)
-            self.ip_entry.insert(0, ip)
-            self._update_status("green")
-            self.message_label.config(text="IP fetched successfully")
-        else:
-            self._update_status("red")
-            self.message_label.config(text="Failed to fetch IP")
+            self._post_ip(ip)
+            self._post_message(f"Using cached controller IP {ip}")
+
+    def fetch_ip(self):
+        from control.coap_client import set_controller_ip
+
+        # The USB query runs on the background loop; the window stays live.
+        # An explicit fetch always asks the box and refreshes the IP cache.
+        async def task():
+            ip = (await discover_ip_controller(refresh=True, attempts=1)).ip
+            if ip:
+                set_controller_ip(ip)
+                self._post_ip(ip)
+                self._post_status("green")
+                self._post_message("IP fetched successfully")
+            else:
+                self._post_status("red")
+                self._post_message("Failed to fetch IP")
+
+        self._post_status("orange")
+        schedule_coro(task(), Priority.READ, "fetch IP")
 
     def control_valve(self, channel, open_valve):
-        self._update_status("orange")
+        self._post_status("orange")
+        # Resolve the target now so a later IP change cannot redirect this command
+        ip = get_controller_ip()
+        # Rapid clicks on one valve collapse to the latest state; only the
+        # command that is actually sent reports back
+        def on_done(opened, error):
+            if error is None:
+                self._post_status("green")
+                self._post_message(f"Valve {channel} {'opened' if opened else 'closed'}")
+            else:
+                self._post_status("red")
+                self._post_message(f"Failed to {'open' if opened else 'close'} valve {channel}")
+        self.valve_commands.submit(ip, channel, open_valve, on_done)
+
+    def control_all_valves(self, open_valve):
+        self._post_status("orange")
+        ip = get_controller_ip()
+        self.valve_commands.discard(ip, range(1, 7))
         async def task():
             try:
-                await pneumatic_set_valve(channel, open_valve)
-                self.root.after(0, lambda: self._update_status("green"))
-                self.root.after(0, lambda: self.message_label.config(text=f"Valve {channel} {'opened' if open_valve else 'closed'}"))
-            except:
-                self.root.after(0, lambda: self._update_status("red"))
-                self.root.after(0, lambda: self.message_label.config(text=f"Failed to {'open' if open_valve else 'close'} valve {channel}"))
-        schedule_coro(task())
+                results = await pneumatic_set_valves({i: open_valve for i in range(1, 7)}, controller=get_controller(ip))
+            except Exception:
+                results = {i: None for i in range(1, 7)}
+            failed = [str(ch) for ch, r in results.items() if r is None or isinstance(r, Exception)]
+            if failed:
+                self._post_status("red")
+                self._post_message(f"Failed to {'open' if open_valve else 'close'} valves {', '.join(failed)}")
+            else:
+                self._post_status("green")
+                self._post_message(f"All valves {'opened' if open_valve else 'closed'}")
+        schedule_coro(task(), Priority.COMMAND if open_valve else Priority.EMERGENCY, "all valves")
 
     def run_gimatic_cmd(self, action):
-        self._update_status("orange")
+        self._post_status("orange")
+        ip = get_controller_ip()
         async def task():
             try:
-                await send_gimatic_cmd(action)
-                self.root.after(0, lambda: self._update_status("green"))
-                self.root.after(0, lambda: self.message_label.config(text=f"Gimatic {action.split('_')[-1].capitalize()} command sent"))
+                await send_gimatic_cmd(action, controller=get_controller(ip))
+                self._post_status("green")
+                self._post_message(f"Gimatic {action.split('_')[-1].capitalize()} command sent")
             except Exception as e:
-                self.root.after(0, lambda: self._update_status("red"))
-                exc = e
-                self.root.after(0, lambda: self.message_label.config(text=f"Gimatic command failed: {exc}"))
-        schedule_coro(task())
+                self._post_status("red")
+                self._post_message(f"Gimatic command failed: {e}")
+        schedule_coro(task(), Priority.COMMAND, action)
 
     def run_gimatic_status_check(self):
-        self._update_status("orange")
+        self._post_status("orange")
+        ip = get_controller_ip()
         async def task():
             try:
-                ret = await check_gimatic_status()
-                self.root.after(0, lambda: self._update_status("green"))
-                self.root.after(0, lambda: self.message_label.config(text=f"Gimatic status: {ret}"))
+                ret = await check_gimatic_status(controller=get_controller(ip))
+                self._post_status("green")
+                self._post_message(f"Gimatic status: {ret}")
             except Exception as e:
-                self.root.after(0, lambda: self._update_status("red"))
-                self.root.after(0, lambda: self.message_label.config(text=f"Gimatic status check failed: {e}"))
-        schedule_coro(task())
+                self._post_status("red")
+                self._post_message(f"Gimatic status check failed: {e}")
+        schedule_coro(task(), Priority.READ, "gimatic status")
+
+    # Valve test by default; the Serial/Parallel mode applies to it only.
+    # The leak test runs through here too, so Stop Valve Test stops it as well.
+    def start_sequence(self, plan_name: str = "valve_test"):
+        if self._sequence_handle is not None and not self._sequence_handle.done():
+            self._post_message("Valve test already running")
+            return
+        try:
+            plan = compile_plan(load_plan(plan_name))
+            parallel = plan_name == "valve_test" and self.test_mode.get() == "parallel"
+            groups = parse_groups(self.groups_entry.get()) if parallel else None
+        except Exception as e:
+            self._post_status("red")
+            self._post_message(f"Valve test plan error: {e}")
+            return
+        self._post_message("Starting test...")
+        self._post_status("orange")
 
-    def start_sequence(self):
-        # Placeholder for valve test sequence
-        self.message_label.config(text="Valve test started (not yet implemented)")
-        self._update_status("orange")
+        async def sequence_task():
+            from control.coap_client import set_controller_ip
+            report_lines = []
+            timestamp = report_timestamp()
+            # Streamed as the test runs; moved next to the report once it is saved
+            sink = ReportSink(report_filename(timestamp, plan.name, ".jsonl"))
+            sink.record("start", plan=plan.name, mode=self.test_mode.get(), groups=groups)
+
+            def report(line, ok=True, **fields):
+                report_lines.append(line)
+                sink.line(line, ok, **fields)
+
+            def on_step(line, ok):
+                self._post_message(line)
+                self._post_status("green" if ok else "red")
+
+            try:
+                found = await discover_ip_controller()
+                ip = found.ip
+                if found.cached:
+                    report(f"IP Fetch - Cached IP answered: {ip}", ip=ip, cached=True)
+                elif ip:
+                    report(f"IP Fetch - Success on attempt {found.attempts}: {ip}", ip=ip, attempts=found.attempts)
+                else:
+                    report(f"IP Fetch - Failed after {found.attempts} attempts", False, attempts=found.attempts)
+                    self._post_status("red")
+                    self._post_message("Failed to fetch IP.")
+                    return
+
+                set_controller_ip(ip)
+                self._post_ip(ip)
+                self._post_status("green")
+
+                pressure = PressureRingBuffer()
+                try:
+                    if groups is None:
+                        result = await run_plan(plan, get_controller(ip), on_step=on_step, capture=pressure,
+                                                sink=sink)
+                    else:
+                        result = await run_parallel_valve_test(get_controller(ip), groups, on_step=on_step,
+                                                               capture=pressure, sink=sink)
+                except asyncio.CancelledError:
+                    # Stopped by the operator: don't leave any valve open
+                    sink.line("Valve test stopped by operator", False)
+                    await pneumatic_set_valves({i: False for i in range(1, 7)}, controller=get_controller(ip),
+                                               force=True)
+                    self._post_status("orange")
+                    self._post_message("Valve test stopped, all valves closed")
+                    raise
+                except Exception as e:
+                    error = str(e) or repr(e)
+                    sink.line(f"Valve test error: {error}", False)
+                    sink.record("end", ip=ip, passed=False, error=error)
+                    self._post_status("red")
+                    self._post_message(f"Valve test error: {error}")
+                    try:
+                        await pneumatic_set_valves({i: False for i in range(1, 7)}, controller=get_controller(ip),
+                                                   force=True)
+                    except Exception:
+                        logger.exception("Failed to close the valves after a test error")
+                    return
+                sink.record("end", ip=ip, passed=result.passed)
+            finally:
+                await sink.aclose()
+            report_lines += result.report_lines
+            self._post_status("green" if result.passed else "red")
+            # keyed by run: the bus keeps only the latest post per key
+            self.ui.post(("save_report", sink.path), self._save_report, timestamp, report_lines, pressure, sink.path)
+
+        self._sequence_handle = schedule_coro(sequence_task(), Priority.TEST, plan.name)
+
+    # Runs on the Tk thread (through the UI bus) once a test has finished
+    def _save_report(self, timestamp, report_lines, pressure=None, records=None):
+        name = simpledialog.askstring("Report Name", "Enter test report name:", parent=self.root)
+        full_name = write_report(report_lines, timestamp, name, pressure=pressure, records=records)
+        self._post_message(f"Test complete. Report saved: {full_name}")
+
+    def stop_sequence(self):
+        if self._sequence_handle is not None and not self._sequence_handle.done():
+            self._sequence_handle.cancel()
 
     def start_gimatic_test(self):
-        # Placeholder for gimatic test sequence
-        self.message_label.config(text="Gimatic test started (not yet implemented)")
-        self._update_status("orange")
+        if self._gimatic_handle is not None and not self._gimatic_handle.done():
+            self._post_message("Gimatic test already running")
+            return
+        try:
+            plan = compile_plan(load_plan("gimatic_test"))
+        except Exception as e:
+            self._post_status("red")
+            self._post_message(f"Gimatic test plan error: {e}")
+            return
+        self._post_message("Gimatic test started")
+        self._post_status("orange")
+        ip = get_controller_ip()
+        timestamp = report_timestamp()
+
+        async def gimatic_task():
+            def on_step(line, ok):
+                self._post_message(line)
+                self._post_status("green" if ok else "red")
+
+            sink = ReportSink(report_filename(timestamp, plan.name, ".jsonl"))
+            sink.record("start", plan=plan.name, ip=ip)
+            try:
+                result = await run_plan(plan, get_controller(ip), on_step=on_step, sink=sink)
+                sink.record("end", ip=ip, passed=result.passed)
+            except Exception as e:
+                error = str(e) or repr(e)
+                sink.record("end", ip=ip, passed=False, error=error)
+                self._post_status("red")
+                self._post_message(f"Gimatic test error: {error}")
+                return
+            finally:
+                await sink.aclose()
+            self._post_status("green" if result.passed else "red")
+            self.ui.post(("save_report", sink.path), self._save_report, timestamp, result.report_lines, None,
+                         sink.path)
+
+        self._gimatic_handle = schedule_coro(gimatic_task(), Priority.TEST, "gimatic test")
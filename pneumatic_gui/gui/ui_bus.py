@@ -0,0 +1,51 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class UIUpdateBus:
+    # Carries UI state changes from the asyncio thread to the Tk thread.
+    # post() may be called from any thread and only records the change; the
+    # Tk thread applies everything recorded once per frame. Changes are keyed
+    # by widget, so if a key is posted several times within a frame only the
+    # latest value is applied.
+    def __init__(self, root, fps: int = 30):
+        self.root = root
+        self.interval_ms = max(1, int(1000 / fps))
+        self.posted = 0
+        self.applied = 0
+        self._lock = threading.Lock()
+        self._pending = {}  # key -> (fn, args)
+        self._after_id = None
+
+    def post(self, key, fn, *args):
+        with self._lock:
+            # re-insert so keys are applied in the order of their latest post
+            self._pending.pop(key, None)
+            self._pending[key] = (fn, args)
+            self.posted += 1
+
+    def start(self):
+        if self._after_id is None:
+            self._after_id = self.root.after(self.interval_ms, self._frame)
+
+    def stop(self):
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+            self._after_id = None
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for fn, args in pending.values():
+            try:
+                fn(*args)
+            except Exception:
+                logger.exception("UI update failed")
+            self.applied += 1
+
+    def _frame(self):
+        # schedule the next frame first: an update may block in a modal dialog
+        self._after_id = self.root.after(self.interval_ms, self._frame)
+        self.flush()
@@ -0,0 +1,414 @@
+# Local stand-in for a bento controller, for load and latency testing without
+# hardware. Speaks CoAP over UDP (encoded with aiocoap's message codec) and
+# implements:
+#
+#   POST /controller      RELAY_TO_MODULE_J for set_valve / set_valves / p_read
+#                         (module 544) and gimatic (module 0x0320)
+#   GET  /pressure        observable psi of the valves in ?valve_n=..
+#   GET  /.well-known/core
+#
+# Datagrams are handled at the UDP level so packet loss is real loss: the
+# client's CoAP layer has to retransmit, exactly as it would on the bench.
+#
+#   cd pneumatic_gui && python -m sim.bento_sim --port 5683 \
+#       --latency 544=0.02 --latency 0x0320=0.05 --loss 0.01
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import time
+from typing import Dict, Optional
+
+from aiocoap import Message
+from aiocoap.numbers.codes import Code
+from aiocoap.numbers.types import Type
+
+logger = logging.getLogger(__name__)
+
+PNEUMATIC_CAN_ID = 544
+GIMATIC_CAN_ID = 0x0320
+
+
+class ValveModel:
+    # First-order pressure model of one valve. Open: psi rises toward
+    # supply_psi with time constant fill_tau_s. Closed: psi leaks back toward
+    # rest_psi with time constant leak_tau_s. A stuck valve ignores set_valve.
+    def __init__(self, rest_psi: float = 7.0, supply_psi: float = 35.0, fill_tau_s: float = 0.15,
+                 leak_tau_s: float = 20.0, noise_psi: float = 0.02, stuck: bool = False):
+        self.rest_psi = rest_psi
+        self.supply_psi = supply_psi
+        self.fill_tau_s = fill_tau_s
+        self.leak_tau_s = leak_tau_s
+        self.noise_psi = noise_psi
+        self.stuck = stuck
+        self.open = False
+        self._psi0 = rest_psi
+        self._t0 = time.monotonic()
+
+    def _psi_at(self, t: float) -> float:
+        if self.open:
+            target, tau = self.supply_psi, self.fill_tau_s
+        else:
+            target, tau = self.rest_psi, self.leak_tau_s
+        return target + (self._psi0 - target) * math.exp(-(t - self._t0) / tau)
+
+    def set_open(self, open_value: bool):
+        if self.stuck:
+            return
+        now = time.monotonic()
+        self._psi0 = self._psi_at(now)
+        self._t0 = now
+        self.open = open_value
+
+    def read_psi(self) -> float:
+        return self._psi_at(time.monotonic()) + random.gauss(0, self.noise_psi)
+
+
+class ModuleSim:
+    # A CAN module behind the controller's J-interface relay. Each relayed
+    # command takes `latency_s` (+- jitter_s) of module time; at most
+    # `concurrency` commands are serviced at once.
+    def __init__(self, can_id: int, latency_s: float = 0.01, jitter_s: float = 0.0, concurrency: int = 1):
+        self.can_id = can_id
+        self.latency_s = latency_s
+        self.jitter_s = jitter_s
+        self._busy = asyncio.Semaphore(concurrency)
+        self.commands = 0
+
+    async def service(self, cmd: str, data: dict) -> dict:
+        async with self._busy:
+            self.commands += 1
+            delay = self.latency_s + random.uniform(-self.jitter_s, self.jitter_s)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            return self.handle(cmd, data)
+
+    def handle(self, cmd: str, data: dict) -> dict:
+        return {"ret": "NOK", "data": "Command not found", "cmd": cmd}
+
+
+class PneumaticModuleSim(ModuleSim):
+    # batch: whether the multi-valve set_valves command is implemented.
+    # crosstalk: fraction of every other valve's pressure above rest that
+    # leaks into each channel's reading (0 = pneumatically independent).
+    def __init__(self, valves: Dict[int, ValveModel] = None, batch: bool = True, crosstalk: float = 0.0,
+                 **kwargs):
+        super().__init__(PNEUMATIC_CAN_ID, **kwargs)
+        self.valves = valves or {n: ValveModel() for n in range(1, 7)}
+        self.batch = batch
+        self.crosstalk = crosstalk
+
+    def read_psi(self, channel: int) -> float:
+        psi = self.valves[channel].read_psi()
+        if self.crosstalk:
+            psi += self.crosstalk * sum(max(0.0, v.read_psi() - v.rest_psi)
+                                        for n, v in self.valves.items() if n != channel)
+        return psi
+
+    def handle(self, cmd: str, data: dict) -> dict:
+        if cmd == "set_valves" and self.batch:
+            results = []
+            for entry in data.get("valves", []):
+                valve = self.valves.get(entry.get("valve_n"))
+                if valve is None:
+                    results.append({"valve_n": entry.get("valve_n"), "ret": "NOK", "data": "Invalid valve"})
+                else:
+                    valve.set_open(bool(entry["open"]))
+                    results.append({"valve_n": entry["valve_n"], "ret": "OK"})
+            ret = "OK" if all(r["ret"] == "OK" for r in results) else "NOK"
+            return {"ret": ret, "results": results, "cmd": cmd}
+        valve = self.valves.get(data.get("valve_n"))
+        if cmd == "set_valve" and valve is not None:
+            valve.set_open(bool(data["open"]))
+            return {"ret": "OK", "cmd": cmd}
+        if cmd == "p_read" and valve is not None:
+            return {"ret": "OK", "psi": self.read_psi(data["valve_n"]), "cmd": cmd}
+        if cmd in ("set_valve", "p_read"):
+            return {"ret": "NOK", "data": "Invalid valve", "cmd": cmd}
+        return super().handle(cmd, data)
+
+
+class GimaticModuleSim(ModuleSim):
+    def __init__(self, **kwargs):
+        super().__init__(GIMATIC_CAN_ID, **kwargs)
+        self.state = "closed"
+
+    def handle(self, cmd: str, data: dict) -> dict:
+        if cmd != "gimatic":
+            return super().handle(cmd, data)
+        action = data.get("action")
+        if action == "GIMATIC_CMD_OPEN":
+            self.state = "open"
+        elif action == "GIMATIC_CMD_CLOSE":
+            self.state = "closed"
+        elif action != "GIMATIC_CMD_STATUS":
+            return {"ret": "NOK", "data": "Unknown action", "cmd": cmd}
+        return {"ret": "OK", "state": self.state, "cmd": cmd}
+
+
+class _Observer:
+    def __init__(self, remote, token: bytes, channels: list):
+        self.remote = remote
+        self.token = token
+        self.channels = channels
+        self.last_mid = None
+        self.sent = 0
+
+
+class BentoControllerSim(asyncio.DatagramProtocol):
+    # loss: probability of dropping each datagram, in either direction.
+    # net_latency_s: one-way network delay added to every reply.
+    def __init__(self, modules: Dict[int, ModuleSim] = None, loss: float = 0.0,
+                 net_latency_s: float = 0.0, notify_interval_s: float = 0.02):
+        self.modules = modules or {
+            PNEUMATIC_CAN_ID: PneumaticModuleSim(),
+            GIMATIC_CAN_ID: GimaticModuleSim(),
+        }
+        self.pneumatic = self.modules.get(PNEUMATIC_CAN_ID) or PneumaticModuleSim()
+        self.loss = loss
+        self.net_latency_s = net_latency_s
+        self.notify_interval_s = notify_interval_s
+        self.stats = {"received": 0, "dropped_in": 0, "dropped_out": 0, "duplicates": 0}
+        self.transport = None
+        self._mid = random.randrange(0x10000)
+        self._replies = {}  # (remote, mid) -> encoded reply, or None while in progress
+        self._observers = []
+        self._notify_task = None
+        self._tasks = set()
+        # (uri path, method) -> async handler(request, remote) returning
+        # (code, payload, observe)
+        self._routes = {
+            (("controller",), Code.POST): self._controller_resource,
+            (("pressure",), Code.GET): self._pressure,
+            ((".well-known", "core"), Code.GET): self._core_resource,
+        }
+
+    # --- lifecycle ---
+
+    async def start(self, host: str = "127.0.0.1", port: int = 5683):
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(lambda: self, local_addr=(host, port))
+        self._notify_task = asyncio.ensure_future(self._notify_loop())
+        return self
+
+    async def stop(self):
+        if self._notify_task is not None:
+            self._notify_task.cancel()
+        for task in list(self._tasks):
+            task.cancel()
+        if self.transport is not None:
+            self.transport.close()
+            await asyncio.sleep(0)  # let the socket actually close
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    # --- datagram handling ---
+
+    def _next_mid(self) -> int:
+        self._mid = (self._mid + 1) & 0xFFFF
+        return self._mid
+
+    def _send(self, data: bytes, remote):
+        if random.random() < self.loss:
+            self.stats["dropped_out"] += 1
+            return
+        self.transport.sendto(data, remote)
+
+    def datagram_received(self, data: bytes, remote):
+        if random.random() < self.loss:
+            self.stats["dropped_in"] += 1
+            return
+        self.stats["received"] += 1
+        try:
+            request = Message.decode(data, remote)
+        except Exception:
+            logger.debug("undecodable datagram from %s", remote)
+            return
+        if request.mtype == Type.RST or request.code == Code.EMPTY:
+            self._empty_received(request, remote)
+        elif not self._resend_reply(request, remote):
+            key = (remote, request.mid)
+            self._replies[key] = None
+            if len(self._replies) > 4096:
+                for old in list(self._replies)[:1024]:
+                    del self._replies[old]
+            task = asyncio.ensure_future(self._respond(request, remote, key))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _empty_received(self, request: Message, remote):
+        if request.mtype == Type.RST:
+            self._observers = [o for o in self._observers if not (o.remote == remote and o.last_mid == request.mid)]
+        elif request.mtype == Type.CON:
+            self._reply_empty(request, remote, Type.RST)  # CoAP ping
+
+    # A retransmitted request gets the reply already sent, or none while the
+    # first copy is still being served
+    def _resend_reply(self, request: Message, remote) -> bool:
+        key = (remote, request.mid)
+        if key not in self._replies:
+            return False
+        self.stats["duplicates"] += 1
+        if self._replies[key] is not None:
+            self._send(self._replies[key], remote)
+        return True
+
+    def _reply_empty(self, request: Message, remote, mtype):
+        reply = Message(code=Code.EMPTY)
+        reply.mtype = mtype
+        reply.mid = request.mid
+        self._send(reply.encode(), remote)
+
+    async def _respond(self, request: Message, remote, key):
+        code, payload, observe = await self._dispatch(request, remote)
+        reply = Message(code=code, payload=payload)
+        if request.mtype == Type.CON:
+            reply.mtype = Type.ACK
+            reply.mid = request.mid
+        else:
+            reply.mtype = Type.NON
+            reply.mid = self._next_mid()
+        reply.token = request.token
+        if observe is not None:
+            reply.opt.observe = observe
+        encoded = reply.encode()
+        self._replies[key] = encoded
+        if self.net_latency_s > 0:
+            await asyncio.sleep(self.net_latency_s)
+        self._send(encoded, remote)
+
+    async def _dispatch(self, request: Message, remote):
+        handler = self._routes.get((tuple(request.opt.uri_path), request.code))
+        if handler is None:
+            return Code.NOT_FOUND, b'', None
+        return await handler(request, remote)
+
+    async def _controller_resource(self, request: Message, remote):
+        return Code.CHANGED, await self._controller(request.payload), None
+
+    async def _core_resource(self, request: Message, remote):
+        return Code.CONTENT, b'</controller>,</pressure>;obs', None
+
+    async def _controller(self, payload: bytes) -> bytes:
+        body = json.loads(payload.decode('utf-8'))
+        if body.get("reg") != "RELAY_TO_MODULE_J":
+            return json.dumps({"ret": "NOK", "data": "Register not supported"}).encode('utf-8')
+        val = body["val"]
+        module = self.modules.get(val["dest_can_bus_id"])
+        if module is None:
+            data = {"ret": "NOK", "data": "Module not found", "cmd": val["cmd"]}
+        else:
+            data = await module.service(val["cmd"], val.get("data", {}))
+        reply = {
+            "dest_can_bus_id": val["origin_can_id"],
+            "origin_can_id": val["dest_can_bus_id"],
+            "cmd": val["cmd"],
+            "data": data,
+            "ret": data["ret"],
+        }
+        return json.dumps(reply).encode('utf-8')
+
+    # --- observe ---
+
+    def _pressure_payload(self, channels: list) -> bytes:
+        psi = {str(n): self.pneumatic.read_psi(n) for n in channels if n in self.pneumatic.valves}
+        return json.dumps({"psi": psi}).encode('utf-8')
+
+    async def _pressure(self, request: Message, remote):
+        channels = [int(q.split("=", 1)[1]) for q in request.opt.uri_query if q.startswith("valve_n=")]
+        channels = channels or sorted(self.pneumatic.valves)
+        self._observers = [o for o in self._observers if not (o.remote == remote and o.token == request.token)]
+        if request.opt.observe == 0:
+            self._observers.append(_Observer(remote, request.token, channels))
+            return Code.CONTENT, self._pressure_payload(channels), self._observe_seq()
+        return Code.CONTENT, self._pressure_payload(channels), None
+
+    def _observe_seq(self) -> int:
+        return int(time.monotonic() * 1000) & 0xFFFFFF
+
+    async def _notify_loop(self):
+        while True:
+            await asyncio.sleep(self.notify_interval_s)
+            for observer in list(self._observers):
+                observer.sent += 1
+                notification = Message(code=Code.CONTENT, payload=self._pressure_payload(observer.channels))
+                # every few notifications is confirmable, so a client that has
+                # lost interest answers with RST and gets removed
+                notification.mtype = Type.CON if observer.sent % 10 == 0 else Type.NON
+                notification.mid = observer.last_mid = self._next_mid()
+                notification.token = observer.token
+                notification.opt.observe = self._observe_seq()
+                self._send(notification.encode(), observer.remote)
+
+
+def _parse_module_setting(text: str):
+    module, _, value = text.partition("=")
+    return int(module, 0), float(value)
+
+
+def build_simulator(latency: Optional[dict] = None, jitter_s: float = 0.0, concurrency: int = 1,
+                    loss: float = 0.0, net_latency_s: float = 0.0, stuck=(),
+                    notify_interval_s: float = 0.02, batch: bool = True, crosstalk: float = 0.0,
+                    leak_tau: Optional[dict] = None) -> BentoControllerSim:
+    # leak_tau: {valve: seconds} overrides the closed-valve leak time constant
+    latency = latency or {}
+    valves = {n: ValveModel(stuck=n in stuck) for n in range(1, 7)}
+    for n, tau in (leak_tau or {}).items():
+        valves[n].leak_tau_s = tau
+    modules = {
+        PNEUMATIC_CAN_ID: PneumaticModuleSim(valves, batch=batch, crosstalk=crosstalk,
+                                             latency_s=latency.get(PNEUMATIC_CAN_ID, 0.01),
+                                             jitter_s=jitter_s, concurrency=concurrency),
+        GIMATIC_CAN_ID: GimaticModuleSim(latency_s=latency.get(GIMATIC_CAN_ID, 0.01),
+                                         jitter_s=jitter_s, concurrency=concurrency),
+    }
+    return BentoControllerSim(modules, loss=loss, net_latency_s=net_latency_s,
+                              notify_interval_s=notify_interval_s)
+
+
+async def _serve(args):
+    sim = build_simulator(latency=dict(args.latency), jitter_s=args.jitter, concurrency=args.concurrency,
+                          loss=args.loss, net_latency_s=args.net_latency, stuck=set(args.stuck),
+                          batch=not args.no_batch, crosstalk=args.crosstalk, leak_tau=dict(args.leak_tau))
+    await sim.start(args.host, args.port)
+    print(f"bento controller simulator on coap://{args.host}:{args.port}/controller")
+    try:
+        while True:
+            await asyncio.sleep(10)
+            logger.info("stats %s, module commands %s", sim.stats,
+                        {hex(m.can_id): m.commands for m in sim.modules.values()})
+    finally:
+        await sim.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bento controller CoAP simulator")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5683)
+    parser.add_argument("--latency", type=_parse_module_setting, action="append", default=[],
+                        metavar="CAN_ID=SECONDS", help="module service time, e.g. 544=0.02 or 0x0320=0.05")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+- seconds added to module latency")
+    parser.add_argument("--concurrency", type=int, default=1, help="commands a module services at once")
+    parser.add_argument("--net-latency", type=float, default=0.0, help="one-way network delay in seconds")
+    parser.add_argument("--loss", type=float, default=0.0, help="datagram loss probability")
+    parser.add_argument("--stuck", type=int, action="append", default=[], metavar="VALVE",
+                        help="valve number that ignores set_valve")
+    parser.add_argument("--no-batch", action="store_true", help="reject the multi-valve set_valves command")
+    parser.add_argument("--crosstalk", type=float, default=0.0,
+                        help="fraction of the other valves' pressure seen on each channel")
+    parser.add_argument("--leak-tau", type=_parse_module_setting, action="append", default=[], metavar="VALVE=S",
+                        help="leak time constant of a closed valve in seconds (default 20)")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
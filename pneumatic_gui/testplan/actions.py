@@ -0,0 +1,101 @@
+import asyncio
+
+from control.coap_client import reply_ok
+from control.gimatic_control import send_gimatic_cmd, check_gimatic_status
+from control.pneumatic_control import pneumatic_set_valve, pneumatic_set_valves, pneumatic_read_valve_state, psi_from_reply
+from control.leak_test import LeakDetector, describe_leak
+from control.settle import SettleDetector, describe_settle
+
+# Step actions for test plans. Each is `async def (ctx, args, step) -> dict`;
+# the returned dict is the step's result, which limits, report templates and
+# "${step.key}" references of later steps read from. ctx is the running
+# testplan.engine.PlanRun (ctx.controller is the ControllerClient).
+
+ACTIONS = {}
+
+
+def action(name: str):
+    def register(fn):
+        ACTIONS[name] = fn
+        return fn
+    return register
+
+
+@action("set_valve")
+async def set_valve(ctx, args, step):
+    reply = await pneumatic_set_valve(args["channel"], args["open"], controller=ctx.controller,
+                                      force=args.get("force", False))
+    return {"reply": reply, "ok": reply_ok(reply)}
+
+
+@action("set_valves")
+async def set_valves(ctx, args, step):
+    channels = args["channels"]
+    results = await pneumatic_set_valves({channel: args["open"] for channel in channels}, controller=ctx.controller,
+                                         force=args.get("force", False))
+    errors = {channel: r for channel, r in results.items() if isinstance(r, Exception)}
+    if errors:
+        raise Exception("; ".join(f"valve {channel}: {e}" for channel, e in errors.items()))
+    failed = [channel for channel, r in results.items() if not reply_ok(r)]
+    return {"results": results, "failed": failed, "ok": not failed}
+
+
+@action("read_pressure")
+async def read_pressure(ctx, args, step):
+    reply = await pneumatic_read_valve_state(args["channel"], controller=ctx.controller)
+    return {"reply": reply, "psi": psi_from_reply(reply), "ok": reply_ok(reply)}
+
+
+@action("wait_settle")
+async def wait_settle(ctx, args, step):
+    detector = SettleDetector(**(step.settle or {}))
+    result = await detector.wait(args["channel"], ctx.controller, start_psi=args.get("start_psi"))
+    return {
+        "settled": result.settled,
+        "settle_s": result.elapsed_s,
+        "psi": result.psi,
+        "reply": result.reply,
+        "samples": result.samples,
+        "summary": describe_settle(result),
+    }
+
+
+@action("leak_decay")
+async def leak_decay(ctx, args, step):
+    detector = LeakDetector(**(step.leak or {}))
+    result = await detector.measure(args["channel"], ctx.controller, baseline_psi=args.get("baseline_psi"))
+    return {
+        "converged": result.converged,
+        "leak_rate": result.rate_psi_s,
+        "ci_low": result.ci_low,
+        "ci_high": result.ci_high,
+        "tau_s": result.tau_s,
+        "psi": result.psi,
+        "leak_s": result.elapsed_s,
+        "samples": result.samples,
+        "reply": result.reply,
+        "summary": describe_leak(result),
+    }
+
+
+@action("delta")
+async def delta(ctx, args, step):
+    return {"delta": float(args["to"]) - float(args["from"])}
+
+
+@action("sleep")
+async def sleep(ctx, args, step):
+    await asyncio.sleep(float(args["seconds"]))
+    return {}
+
+
+@action("gimatic")
+async def gimatic(ctx, args, step):
+    reply = await send_gimatic_cmd(args["action"], controller=ctx.controller)
+    return {"reply": reply, "ok": reply_ok(reply)}
+
+
+@action("gimatic_status")
+async def gimatic_status(ctx, args, step):
+    reply = await check_gimatic_status(controller=ctx.controller)
+    return {"reply": reply, "ok": reply_ok(reply)}
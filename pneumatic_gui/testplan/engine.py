@@ -0,0 +1,216 @@
+import asyncio
+import contextlib
+import logging
+import re
+import time
+from typing import Callable, Dict, List, Optional
+
+from control.coap_client import ControllerClient
+from control.pressure_capture import PressureCapture, PressureRingBuffer
+from testplan.actions import ACTIONS
+from testplan.plan import CompiledPlan, Step, PlanError, REF
+from utils.report_sink import ReportSink
+
+logger = logging.getLogger(__name__)
+
+_FIELD = re.compile(r"\{(\w+)(:[^{}]*)?\}")
+
+PASSED = "passed"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+class StepResult:
+    def __init__(self, status: str, value: dict = None, error: str = None, attempts: int = 0,
+                 started_at: float = None, elapsed_s: float = 0.0):
+        self.status = status
+        self.value = value or {}
+        self.error = error
+        self.attempts = attempts
+        self.started_at = started_at
+        self.elapsed_s = elapsed_s
+
+    def as_dict(self) -> dict:
+        return {"status": self.status, "error": self.error, "attempts": self.attempts, "elapsed_s": self.elapsed_s}
+
+
+class PlanResult:
+    def __init__(self, name: str, steps: Dict[str, StepResult], report_lines: List[str], elapsed_s: float):
+        self.name = name
+        self.steps = steps
+        self.report_lines = report_lines
+        self.elapsed_s = elapsed_s
+
+    @property
+    def passed(self) -> bool:
+        return all(result.status == PASSED for result in self.steps.values())
+
+    def summary(self) -> str:
+        n_passed = sum(result.status == PASSED for result in self.steps.values())
+        return (f"Plan {self.name}: {'PASS' if self.passed else 'FAIL'} "
+                f"({n_passed}/{len(self.steps)} steps passed, {self.elapsed_s:.2f} s)")
+
+
+def format_report(template: str, value: dict) -> str:
+    # "{key}" / "{key:.2f}" from the step result; unknown keys become "n/a"
+    def field(m):
+        if m.group(1) not in value:
+            return "n/a"
+        v = value[m.group(1)]
+        try:
+            return format(v, m.group(2)[1:]) if m.group(2) else str(v)
+        except (TypeError, ValueError):
+            return str(v)
+    return _FIELD.sub(field, template)
+
+
+def check_limits(step: Step, value: dict) -> Optional[str]:
+    for key, limit in step.limits.items():
+        if key not in value:
+            return f"{key} missing from result"
+        v = value[key]
+        try:
+            if "min" in limit and v < limit["min"]:
+                return f"{key}={v} below min {limit['min']}"
+            if "max" in limit and v > limit["max"]:
+                return f"{key}={v} above max {limit['max']}"
+        except TypeError:
+            # e.g. psi None from an NOK reply: the step fails, the plan goes on
+            return f"{key}={v} not comparable"
+        if "equals" in limit and v != limit["equals"]:
+            return f"{key}={v}, expected {limit['equals']}"
+        if "in" in limit and v not in limit["in"]:
+            return f"{key}={v}, expected one of {limit['in']}"
+    return None
+
+
+class PlanRun:
+    # One execution of a compiled plan. Every step gets a task on the running
+    # loop as soon as the run starts; it waits for the steps it depends on, so
+    # steps without a path between them in the graph run concurrently. With a
+    # sink, every finished or skipped step is streamed to it as a record.
+    def __init__(self, plan: CompiledPlan, controller: ControllerClient,
+                 on_step: Optional[Callable[[str, bool], None]] = None, max_parallel: int = None,
+                 sink: Optional[ReportSink] = None):
+        self.plan = plan
+        self.controller = controller
+        self.on_step = on_step
+        self.sink = sink
+        self.results: Dict[str, StepResult] = {}
+        self.report_lines: List[str] = []
+        self._done = {step_id: asyncio.Event() for step_id in plan.steps}
+        self._slots = asyncio.Semaphore(max_parallel) if max_parallel else None
+
+    def _line(self, line: str, ok: bool):
+        for part in line.split("\n"):
+            self.report_lines.append(part)
+            if self.on_step is not None:
+                self.on_step(part, ok)
+
+    def _record(self, step: Step, result: StepResult, line: Optional[str]):
+        if self.sink is None:
+            return
+        # the foreach channel covers steps without a channel arg (rise_N)
+        channel = step.bindings.get("channel", step.args.get("channel"))
+        self.sink.record("step", plan=self.plan.name, step=step.id, action=step.action, status=result.status,
+                         channel=channel if isinstance(channel, int) else None, psi=result.value.get("psi"),
+                         attempts=result.attempts, latency_s=result.elapsed_s, error=result.error,
+                         value=result.value, line=line, ok=result.status == PASSED)
+
+    def _resolve(self, value):
+        # "${step.key}" -> that step's result value
+        if isinstance(value, str):
+            whole = REF.fullmatch(value)
+            if whole:
+                return self._lookup(whole.group(1), whole.group(2))
+            return REF.sub(lambda m: str(self._lookup(m.group(1), m.group(2))), value)
+        if isinstance(value, list):
+            return [self._resolve(v) for v in value]
+        if isinstance(value, dict):
+            return {k: self._resolve(v) for k, v in value.items()}
+        return value
+
+    def _lookup(self, step_id: str, path: str):
+        value = self.results[step_id].value
+        for key in path.split("."):
+            if not isinstance(value, dict) or key not in value:
+                raise Exception(f"{step_id} has no result {path}")
+            value = value[key]
+        return value
+
+    async def _run_step(self, step: Step):
+        try:
+            for dep in step.waits_for():
+                await self._done[dep].wait()
+            not_passed = [dep for dep in step.depends_on if self.results[dep].status != PASSED]
+            if not_passed:
+                self.results[step.id] = StepResult(SKIPPED, error=f"{', '.join(not_passed)} did not pass")
+                self._record(step, self.results[step.id], None)
+                return
+            async with self._slots if self._slots is not None else contextlib.nullcontext():
+                self.results[step.id] = await self._attempt(step)
+            result = self.results[step.id]
+            template = step.report if result.status == PASSED else step.report_fail
+            if template is None and result.status == FAILED:
+                template = f"{step.id} - Failed: {{error}}"
+            line = None
+            if template is not None:
+                line = format_report(template, {**result.value, "error": result.error,
+                                                "attempts": result.attempts, "elapsed_s": result.elapsed_s})
+                self._line(line, result.status == PASSED)
+            self._record(step, result, line)
+        finally:
+            self._done[step.id].set()
+
+    async def _attempt(self, step: Step) -> StepResult:
+        started = time.monotonic()
+        error = None
+        for attempt in range(1, step.retries + 2):
+            try:
+                value = await ACTIONS[step.action](self, self._resolve(step.args), step)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = str(e) or repr(e)
+                logger.debug(f"step {step.id} attempt {attempt} failed: {error}")
+                if attempt <= step.retries:
+                    await asyncio.sleep(step.retry_delay_s)
+                continue
+            limit_error = check_limits(step, value)
+            status = FAILED if limit_error else PASSED
+            return StepResult(status, value, limit_error, attempt, started, time.monotonic() - started)
+        return StepResult(FAILED, None, error, step.retries + 1, started, time.monotonic() - started)
+
+    async def run(self, summary: bool = True) -> PlanResult:
+        started = time.monotonic()
+        tasks = [asyncio.ensure_future(self._run_step(self.plan.steps[step_id])) for step_id in self.plan.order]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        result = PlanResult(self.plan.name, {step_id: self.results[step_id] for step_id in self.plan.steps},
+                            self.report_lines, time.monotonic() - started)
+        if summary:
+            self._line(result.summary(), result.passed)
+        if self.sink is not None:
+            self.sink.record("summary", plan=self.plan.name, passed=result.passed, elapsed_s=result.elapsed_s,
+                             steps={step_id: step.status for step_id, step in result.steps.items()},
+                             line=result.summary() if summary else None, ok=result.passed)
+        return result
+
+
+# Runs a compiled plan against `controller`. With `capture` set, the pressure
+# of the plan's "channels" parameter is recorded into it while the plan runs.
+# summary=False leaves the PASS/FAIL summary line out of the report. With
+# `sink` set, step records are streamed to it while the plan runs.
+async def run_plan(plan: CompiledPlan, controller: ControllerClient,
+                   on_step: Optional[Callable[[str, bool], None]] = None,
+                   capture: Optional[PressureRingBuffer] = None, max_parallel: int = None,
+                   summary: bool = True, sink: Optional[ReportSink] = None) -> PlanResult:
+    if capture is not None and "channels" not in plan.params:
+        raise PlanError(f"Plan {plan.name} has no channels to capture")
+    recording = contextlib.nullcontext() if capture is None else \
+        PressureCapture(capture, plan.params["channels"], controller)
+    async with recording:
+        return await PlanRun(plan, controller, on_step, max_parallel, sink).run(summary)
@@ -0,0 +1,165 @@
+import time
+from typing import Callable, Dict, List, Optional
+
+from control.coap_client import ControllerClient
+from control.pneumatic_control import pneumatic_set_valves
+from control.pressure_capture import PressureCapture, PressureRingBuffer
+from testplan.engine import PlanResult, run_plan
+from testplan.plan import PlanError, compile_plan, load_plan
+from utils.report_sink import ReportSink
+
+# Parallel valve test. Channels are tested in groups, one group after the
+# other; the channels of a group are tested at the same time. Before a group
+# runs in parallel its first channel is tested alone as a probe while the
+# pressure of the others is recorded: if any of them rises by more than
+# crosstalk_psi while the probe valve is open, the channels are not
+# pneumatically independent and the rest of the group falls back to serial.
+# Only the probe is driven alone: coupling between two of the other channels
+# of a group is not detected, so list channels that may share a manifold
+# first in their group, or in groups of their own.
+# Every channel keeps its own steps, settle times and timing line in the
+# report; with a sink, the step, timing and group records are streamed to it
+# as they happen.
+
+CHANNEL_STEPS = ("read_closed", "open", "settle_open", "rise", "close", "settle_closed")
+CHANNELS = range(1, 7)
+
+
+def parse_groups(text: str) -> List[List[int]]:
+    # "1-3;4,5,6" -> [[1, 2, 3], [4, 5, 6]]
+    groups = []
+    for part in text.split(";"):
+        channels = []
+        for item in part.replace(" ", "").split(","):
+            if not item:
+                continue
+            try:
+                if "-" in item:
+                    first, last = item.split("-", 1)
+                    channels += range(int(first), int(last) + 1)
+                else:
+                    channels.append(int(item))
+            except ValueError:
+                raise PlanError(f"Bad channel {item!r} in groups: {text}")
+        if channels:
+            groups.append(channels)
+    seen = [channel for group in groups for channel in group]
+    bad = [channel for channel in seen if channel not in CHANNELS]
+    if bad:
+        raise PlanError(f"Channel(s) {', '.join(map(str, bad))} outside {CHANNELS[0]}-{CHANNELS[-1]} in groups: {text}")
+    if len(seen) != len(set(seen)):
+        raise PlanError(f"Channel listed twice in groups: {text}")
+    if not groups:
+        raise PlanError("No channels in groups")
+    return groups
+
+
+def channel_timing(result: PlanResult, channel: int) -> Optional[dict]:
+    steps = [result.steps.get(f"{name}_{channel}") for name in CHANNEL_STEPS]
+    ran = [step for step in steps if step is not None and step.started_at is not None]
+    if not ran:
+        return None
+    timing = {name: step.elapsed_s for name, step in zip(CHANNEL_STEPS, steps)
+              if step is not None and step.started_at is not None}
+    timing["total"] = max(s.started_at + s.elapsed_s for s in ran) - min(s.started_at for s in ran)
+    return timing
+
+
+def crosstalk_rises(capture: PressureRingBuffer, result: PlanResult, probe: int, others: List[int]) -> Dict[int, float]:
+    # Rise of each other channel while the probe valve was open, relative to
+    # its pressure before the probe opened
+    opened = result.steps.get(f"open_{probe}")
+    closed = result.steps.get(f"close_{probe}")
+    if opened is None or opened.started_at is None:
+        return {}
+    open_at = opened.started_at
+    if closed is not None and closed.started_at is not None:
+        close_at = closed.started_at + closed.elapsed_s
+    else:
+        close_at = time.monotonic()
+    rises = {}
+    for channel in others:
+        before = [s.psi for s in capture.samples(channel) if s.timestamp < open_at]
+        during = [s.psi for s in capture.samples(channel, since=open_at) if s.timestamp <= close_at]
+        if before and during:
+            rises[channel] = max(during) - before[-1]
+    return rises
+
+
+class ParallelValveTestResult:
+    def __init__(self):
+        self.report_lines: List[str] = []
+        self.plan_results: List[PlanResult] = []
+        self.modes: Dict[int, str] = {}  # channel -> "probe" / "parallel" / "serial"
+        self.timings: Dict[int, dict] = {}
+        self.elapsed_s = 0.0
+
+    @property
+    def passed(self) -> bool:
+        return bool(self.plan_results) and all(result.passed for result in self.plan_results)
+
+
+async def run_parallel_valve_test(controller: ControllerClient, groups: List[List[int]],
+                                  on_step: Optional[Callable[[str, bool], None]] = None,
+                                  capture: Optional[PressureRingBuffer] = None,
+                                  crosstalk_psi: float = 0.5, params: dict = None,
+                                  sink: Optional[ReportSink] = None) -> ParallelValveTestResult:
+    started = time.monotonic()
+    out = ParallelValveTestResult()
+    plan_source = load_plan("valve_test")
+    buffer = capture if capture is not None else PressureRingBuffer()
+    channels = [channel for group in groups for channel in group]
+
+    def line(text, ok=True, kind="line", **fields):
+        out.report_lines.append(text)
+        if on_step is not None:
+            on_step(text, ok)
+        if sink is not None:
+            sink.record(kind, line=text, ok=ok, **fields)
+
+    async def run(group_channels, serial, mode):
+        plan = compile_plan(plan_source, {**(params or {}), "channels": group_channels, "serial": serial})
+        result = await run_plan(plan, controller, on_step=on_step, summary=False, sink=sink)
+        out.report_lines += result.report_lines
+        out.plan_results.append(result)
+        for channel in group_channels:
+            out.modes[channel] = mode
+            timing = channel_timing(result, channel)
+            if timing is not None:
+                out.timings[channel] = timing
+                line(f"Valve {channel} Timing ({mode}): {timing['total']:.2f} s, settle opened "
+                     f"{timing.get('settle_open', 0):.2f} s, settle closed {timing.get('settle_closed', 0):.2f} s",
+                     kind="timing", channel=channel, mode=mode, timing=timing)
+        return result
+
+    # Every valve starts closed, so no channel of a later group skews a probe
+    results = await pneumatic_set_valves({channel: False for channel in channels}, controller=controller)
+    for channel, result in results.items():
+        if isinstance(result, Exception):
+            line(f"Initial Close Valve {channel} - Failed: {result}", False, channel=channel)
+
+    async with PressureCapture(buffer, channels, controller):
+        for index, group in enumerate(groups, 1):
+            line(f"Group {index} Channels {group}")
+            if len(group) == 1:
+                await run(group, True, "serial")
+                continue
+            probe, others = group[0], group[1:]
+            probe_result = await run([probe], True, "probe")
+            rises = crosstalk_rises(buffer, probe_result, probe, others)
+            coupled = {channel: rise for channel, rise in rises.items() if rise > crosstalk_psi}
+            if coupled:
+                detail = ", ".join(f"valve {channel} +{rise:.2f} psi" for channel, rise in coupled.items())
+                line(f"Cross-talk detected opening valve {probe}: {detail} - testing group serially")
+                await run(others, True, "serial")
+            elif len(rises) < len(others):
+                line(f"Cross-talk check incomplete for valve {probe} - testing group serially")
+                await run(others, True, "serial")
+            else:
+                line(f"Cross-talk check valve {probe}: max rise {max(rises.values()):.2f} psi - testing in parallel")
+                await run(others, False, "parallel")
+
+    out.elapsed_s = time.monotonic() - started
+    line(f"Parallel Valve Test: {'PASS' if out.passed else 'FAIL'} ({out.elapsed_s:.2f} s)", out.passed,
+         kind="summary", plan="parallel_valve_test", passed=out.passed, elapsed_s=out.elapsed_s, modes=out.modes)
+    return out
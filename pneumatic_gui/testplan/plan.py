@@ -0,0 +1,237 @@
+import copy
+import json
+import os
+import re
+from typing import Dict, List
+
+# Declarative test plans. A plan is a JSON (or, with PyYAML installed, YAML)
+# document:
+#
+#   {
+#     "name": "valve_test",
+#     "params": {"channels": [1, 2, 3]},
+#     "steps": [
+#       {"id": "close_all", "action": "set_valves", "args": {"channels": "$channels", "open": false}},
+#       {"foreach": {"channel": "$channels"}, "serial": true, "steps": [
+#         {"id": "read_{channel}", "action": "read_pressure", "args": {"channel": "{channel}"},
+#          "after": ["close_all"], "retries": 1, "limits": {"psi": {"max": 10}},
+#          "report": "Valve {channel}: {psi:.2f} psi"}
+#       ]}
+#     ]
+#   }
+#
+# Step fields:
+#   id, action          unique step name; action from testplan.actions.ACTIONS
+#   args                action arguments
+#   depends_on          steps that must pass before this one runs (else it
+#                       is skipped)
+#   after               steps that must finish, pass or fail, before this one
+#                       runs (e.g. closing a valve even when a reading failed)
+#   retries, retry_delay_s
+#                       extra attempts when the action raises
+#   settle              SettleDetector settings for wait_settle steps
+#   leak                LeakDetector settings for leak_decay steps
+#   limits              {value_key: {"min": x, "max": y, "equals": v, "in": [...]}}
+#                       checked against the action's result; any miss fails
+#                       the step
+#   report, report_fail report line templates for a pass / a failure, filled
+#                       from the action's result plus {error}
+#
+# "$name" (a whole string) is replaced by plan parameter `name`. A foreach
+# group repeats its steps for each value, replacing "{var}" in every string;
+# with "serial": true (or a parameter that is true) each repetition starts
+# after the previous one finished. "${step.key}" in args is replaced at run time by `key` of that
+# step's result and implicitly orders the step after it.
+
+PLANS_DIR = os.path.join(os.path.dirname(__file__), "plans")
+
+STEP_FIELDS = {"id", "action", "args", "depends_on", "after", "retries", "retry_delay_s", "settle", "leak",
+               "limits", "report", "report_fail"}
+LIMIT_OPS = {"min", "max", "equals", "in"}
+
+_VAR = re.compile(r"(?<!\$)\{(\w+)\}")
+REF = re.compile(r"\$\{(\w+)\.([\w.]+)\}")
+
+
+class PlanError(Exception):
+    pass
+
+
+class Step:
+    def __init__(self, spec: dict):
+        self.id = spec["id"]
+        self.action = spec["action"]
+        self.args = spec.get("args", {})
+        self.depends_on = list(spec.get("depends_on", []))
+        self.after = list(spec.get("after", []))
+        self.retries = int(spec.get("retries", 0))
+        self.retry_delay_s = float(spec.get("retry_delay_s", 0.1))
+        self.settle = spec.get("settle")
+        self.leak = spec.get("leak")
+        self.limits = spec.get("limits", {})
+        self.report = spec.get("report")
+        self.report_fail = spec.get("report_fail")
+        # foreach variables this step was expanded with, e.g. {"channel": 3}
+        self.bindings = spec.get("bindings", {})
+        # steps whose results args refer to; filled in by compile_plan
+        self.refs = set()
+
+    def waits_for(self) -> set:
+        return set(self.depends_on) | set(self.after) | self.refs
+
+
+class CompiledPlan:
+    # steps in plan order; order is a topological order of the graph
+    def __init__(self, name: str, params: dict, steps: Dict[str, Step], order: List[str]):
+        self.name = name
+        self.params = params
+        self.steps = steps
+        self.order = order
+
+
+def load_plan(source: str) -> dict:
+    # A path, or the name of a plan in PLANS_DIR (e.g. "valve_test")
+    path = source
+    if not os.path.exists(path):
+        for ext in (".json", ".yaml", ".yml"):
+            candidate = os.path.join(PLANS_DIR, source + ext)
+            if os.path.exists(candidate):
+                path = candidate
+                break
+        else:
+            raise PlanError(f"Test plan not found: {source}")
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise PlanError("PyYAML is required for YAML test plans")
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def list_plans() -> List[str]:
+    return sorted(os.path.splitext(name)[0] for name in os.listdir(PLANS_DIR)
+                  if name.endswith((".json", ".yaml", ".yml")))
+
+
+def _substitute(value, params: dict, vars: dict):
+    if isinstance(value, str):
+        if value.startswith("$") and not value.startswith("${"):
+            name = value[1:]
+            if name not in params:
+                raise PlanError(f"Unknown plan parameter: {value}")
+            return copy.deepcopy(params[name])
+        whole = _VAR.fullmatch(value)
+        if whole and whole.group(1) in vars:
+            return vars[whole.group(1)]
+        return _VAR.sub(lambda m: str(vars[m.group(1)]) if m.group(1) in vars else m.group(0), value)
+    if isinstance(value, list):
+        return [_substitute(v, params, vars) for v in value]
+    if isinstance(value, dict):
+        return {k: _substitute(v, params, vars) for k, v in value.items()}
+    return value
+
+
+def _expand(entries: list, params: dict, vars: dict) -> List[dict]:
+    specs = []
+    for entry in entries:
+        if "foreach" not in entry:
+            unknown = set(entry) - STEP_FIELDS
+            if unknown:
+                raise PlanError(f"Unknown field(s) in step {entry.get('id')}: {', '.join(sorted(unknown))}")
+            spec = _substitute(entry, params, vars)
+            spec["bindings"] = dict(vars)
+            specs.append(spec)
+            continue
+        (var, values), = entry["foreach"].items()
+        values = _substitute(values, params, vars)
+        previous = []
+        for value in values:
+            group = _expand(entry["steps"], params, {**vars, var: value})
+            if _substitute(entry.get("serial", False), params, vars):
+                for spec in group:
+                    spec["after"] = list(spec.get("after", [])) + [s["id"] for s in previous]
+            previous = group
+            specs += group
+    return specs
+
+
+def _collect_refs(value, refs: set):
+    if isinstance(value, str):
+        refs.update(m.group(1) for m in REF.finditer(value))
+    elif isinstance(value, list):
+        for v in value:
+            _collect_refs(v, refs)
+    elif isinstance(value, dict):
+        for v in value.values():
+            _collect_refs(v, refs)
+
+
+def _build_step(spec: dict, steps: Dict[str, Step]) -> Step:
+    # One expanded step spec -> Step, validated on its own
+    from testplan.actions import ACTIONS
+
+    if "id" not in spec or "action" not in spec:
+        raise PlanError(f"Step needs an id and an action: {spec}")
+    if spec["id"] in steps:
+        raise PlanError(f"Duplicate step id: {spec['id']}")
+    if "." in spec["id"]:
+        raise PlanError(f"Step ids may not contain '.': {spec['id']}")
+    if spec["action"] not in ACTIONS:
+        raise PlanError(f"Unknown action in step {spec['id']}: {spec['action']}")
+    step = Step(spec)
+    _collect_refs(step.args, step.refs)
+    _check_settings(step)
+    return step
+
+
+def _check_settings(step: Step):
+    # limits and detector settings, so a bad plan fails before it runs
+    from control.leak_test import LeakDetector
+    from control.settle import SettleDetector
+
+    for key, limit in step.limits.items():
+        if not isinstance(limit, dict) or not set(limit) <= LIMIT_OPS:
+            raise PlanError(f"Bad limit for {key} in step {step.id}: {limit}")
+    if step.settle is not None:
+        try:
+            SettleDetector(**step.settle)
+        except TypeError as e:
+            raise PlanError(f"Bad settle criteria in step {step.id}: {e}")
+    if step.leak is not None:
+        try:
+            LeakDetector(**step.leak)
+        except (TypeError, ValueError) as e:
+            raise PlanError(f"Bad leak test settings in step {step.id}: {e}")
+
+
+def _step_order(steps: Dict[str, Step]) -> List[str]:
+    # Topological order of the step graph (Kahn's algorithm, keeping plan
+    # order among ready steps); every waited-for step must exist
+    for step in steps.values():
+        missing = step.waits_for() - set(steps)
+        if missing:
+            raise PlanError(f"Step {step.id} waits for unknown step(s): {', '.join(sorted(missing))}")
+
+    waiting = {step_id: set(step.waits_for()) for step_id, step in steps.items()}
+    order = []
+    while waiting:
+        ready = [step_id for step_id, deps in waiting.items() if not deps]
+        if not ready:
+            raise PlanError(f"Dependency cycle between steps: {', '.join(sorted(waiting))}")
+        for step_id in ready:
+            del waiting[step_id]
+            order.append(step_id)
+        for deps in waiting.values():
+            deps.difference_update(ready)
+    return order
+
+
+def compile_plan(plan: dict, params: dict = None) -> CompiledPlan:
+    params = {**plan.get("params", {}), **(params or {})}
+    steps = {}
+    for spec in _expand(plan.get("steps", []), params, {}):
+        step = _build_step(spec, steps)
+        steps[step.id] = step
+    return CompiledPlan(plan.get("name", "plan"), params, steps, _step_order(steps))
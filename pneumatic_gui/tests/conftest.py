@@ -0,0 +1,37 @@
+import asyncio
+import os
+import socket
+import sys
+
+import pytest
+
+# The package runs from pneumatic_gui/ with imports rooted there
+# (from control.x import ...), like cli.py and main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _free_udp_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def with_simulator():
+    # with_simulator(test, **build_simulator kwargs) runs `await test(sim,
+    # controller)` against a fresh simulator on a free local port
+    from control.coap_client import CoapSession, ControllerClient
+    from sim.bento_sim import build_simulator
+
+    def run(test, **sim_kwargs):
+        async def main():
+            port = _free_udp_port()
+            sim = await build_simulator(**sim_kwargs).start("127.0.0.1", port)
+            session = CoapSession()
+            try:
+                return await test(sim, ControllerClient(f"127.0.0.1:{port}", session=session))
+            finally:
+                await session.shutdown()
+                await sim.stop()
+        return asyncio.run(main())
+    return run
@@ -0,0 +1,74 @@
+import asyncio
+import json
+
+from aiocoap import Message
+from aiocoap.numbers.codes import Code
+from aiocoap.numbers.types import Type
+
+from sim.bento_sim import PNEUMATIC_CAN_ID
+
+
+class _Client(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.replies = asyncio.Queue()
+
+    def datagram_received(self, data, addr):
+        self.replies.put_nowait(Message.decode(data))
+
+
+def request(code, path, mid: int, payload: bytes = b'', mtype=Type.CON) -> bytes:
+    message = Message(code=code, payload=payload)
+    message.opt.uri_path = path
+    message.mtype = mtype
+    message.mid = mid
+    message.token = mid.to_bytes(2, "big")
+    return message.encode()
+
+
+async def exchange(controller, *datagrams):
+    host, port = controller.ip.split(":")
+    loop = asyncio.get_running_loop()
+    transport, client = await loop.create_datagram_endpoint(_Client, remote_addr=(host, int(port)))
+    try:
+        replies = []
+        for data in datagrams:
+            transport.sendto(data)
+            replies.append(await asyncio.wait_for(client.replies.get(), 2))
+        return replies
+    finally:
+        transport.close()
+
+
+def p_read(channel: int) -> bytes:
+    return json.dumps({"reg": "RELAY_TO_MODULE_J", "val": {
+        "dest_can_bus_id": PNEUMATIC_CAN_ID, "origin_can_id": 1, "cmd": "p_read", "data": {"valve_n": channel}}}).encode()
+
+
+def test_resources_and_methods_are_routed(with_simulator):
+    async def test(sim, controller):
+        return await exchange(controller,
+                              request(Code.POST, ("controller",), 1, p_read(2)),
+                              request(Code.GET, ("pressure",), 2),
+                              request(Code.GET, (".well-known", "core"), 3),
+                              request(Code.GET, ("controller",), 4),
+                              request(Code.EMPTY, (), 5))
+
+    controller, pressure, core, wrong_method, ping = with_simulator(test)
+    assert controller.code == Code.CHANGED and controller.mtype == Type.ACK
+    assert json.loads(controller.payload)["data"]["cmd"] == "p_read"
+    assert pressure.code == Code.CONTENT and set(json.loads(pressure.payload)["psi"]) == {"1", "2", "3", "4", "5", "6"}
+    assert core.payload == b'</controller>,</pressure>;obs'
+    assert wrong_method.code == Code.NOT_FOUND
+    assert ping.mtype == Type.RST and ping.mid == 5
+
+
+def test_retransmitted_request_gets_the_same_reply_once_served(with_simulator):
+    async def test(sim, controller):
+        data = request(Code.POST, ("controller",), 7, p_read(1))
+        first, again = await exchange(controller, data, data)
+        return sim, first, again
+
+    sim, first, again = with_simulator(test)
+    assert again.payload == first.payload and again.mid == first.mid == 7
+    assert sim.stats["duplicates"] == 1
+    assert sim.modules[PNEUMATIC_CAN_ID].commands == 1
@@ -0,0 +1,62 @@
+import time
+
+from control.coap_client import CircuitBreaker
+
+
+def _open_breaker(**kwargs) -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_threshold=3, **kwargs)
+    for _ in range(3):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    return breaker
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout_s=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+
+
+def test_late_failure_of_an_attempt_started_before_a_success_does_not_count():
+    breaker = CircuitBreaker(failure_threshold=1)
+    started = time.monotonic()
+    breaker.record_success()
+    breaker.record_failure(started_at=started)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_admits_a_single_trial():
+    breaker = _open_breaker(reset_timeout_s=0.05)
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # the rest of the burst waits for the trial's outcome
+    assert not any(breaker.allow() for _ in range(10))
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert all(breaker.allow() for _ in range(10))
+
+
+def test_failed_trial_opens_the_breaker_again():
+    breaker = _open_breaker(reset_timeout_s=0.05)
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+
+
+def test_trial_that_never_reports_back_expires():
+    breaker = _open_breaker(reset_timeout_s=0.05)
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert not breaker.allow()
@@ -0,0 +1,54 @@
+import argparse
+import asyncio
+
+import cli
+from testplan.plan import PlanError
+
+
+def cli_args(*boxes, **options) -> argparse.Namespace:
+    defaults = dict(plan="valve_test", param=[], mode="serial", groups="1-6", crosstalk_psi=0.5, format="json",
+                    serial_port="/dev/null", ip_cache="unused.json", no_ip_cache=False, report_dir=".",
+                    no_report=True, no_trace=True, verbose=False)
+    return argparse.Namespace(boxes=list(boxes), **{**defaults, **options})
+
+
+def test_plan_error_in_one_box_waits_for_the_others(monkeypatch, capsys):
+    finished = []
+
+    async def run_box(ip, name, args, session, timestamp, out):
+        if ip == "bad":
+            raise PlanError("bad plan")
+        await asyncio.sleep(0.05)
+        finished.append(ip)
+        return {"box": ip, "passed": True}
+
+    monkeypatch.setattr(cli, "run_box", run_box)
+    assert asyncio.run(cli.main(cli_args(("bad", None), ("good", None)))) == cli.EXIT_ERROR
+    assert finished == ["good"]
+    assert "error: bad plan" in capsys.readouterr().err
+
+
+def test_parallel_mode_checks_params_before_any_box_starts(monkeypatch):
+    started = []
+
+    async def run_box(ip, name, args, session, timestamp, out):
+        started.append(ip)
+
+    monkeypatch.setattr(cli, "run_box", run_box)
+    monkeypatch.setattr(cli, "load_plan", lambda name: {"steps": [
+        {"foreach": {"channel": "$channels"}, "steps": [
+            {"id": "rise_{channel}", "action": "delta", "args": {"from": 0, "to": 1}, "limits": {"delta": "$limit"}},
+        ]},
+    ]})
+    args = cli_args(("box", None), mode="parallel", param=[("limit", "high")])
+    assert asyncio.run(cli.main(args)) == cli.EXIT_ERROR
+    assert started == []
+
+
+def test_boxes_run_against_the_simulator(with_simulator, tmp_path):
+    async def test(sim, controller):
+        return await cli.main(cli_args((controller.ip, "box"), no_report=False, report_dir=str(tmp_path),
+                                       param=[("channels", [1, 2])]))
+
+    assert with_simulator(test) == cli.EXIT_PASS
+    assert sorted(p.suffix for p in tmp_path.iterdir()) == [".jsonl", ".txt"]
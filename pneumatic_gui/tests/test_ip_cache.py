@@ -0,0 +1,78 @@
+import asyncio
+import json
+
+import pytest
+
+from utils import ip_utils
+from utils.ip_cache import IpCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return IpCache(str(tmp_path / "ip-cache.json"), ttl_s=60)
+
+
+def test_put_and_get(cache):
+    cache.put("/dev/ttyUSB0", "172.16.50.74")
+    entry = IpCache(cache.path).get("/dev/ttyUSB0")
+    assert entry.ip == "172.16.50.74"
+    assert 0 <= entry.age_s < 5
+    cache.forget("/dev/ttyUSB0")
+    assert cache.get("/dev/ttyUSB0") is None
+
+
+def test_expired_entry_is_a_miss(cache):
+    cache.put("port", "10.0.0.5")
+    assert IpCache(cache.path, ttl_s=0).get("port") is None
+
+
+@pytest.mark.parametrize("entry", [
+    {"ip": "10.0.0.5"},
+    {"found_at": 1.0},
+    {"ip": None, "found_at": 1e12},
+    {"ip": "10.0.0.5", "found_at": "yesterday"},
+    "10.0.0.5",
+    ["10.0.0.5"],
+])
+def test_malformed_entry_is_a_miss(cache, entry):
+    with open(cache.path, "w") as f:
+        json.dump({"port": entry}, f)
+    assert cache.get("port") is None
+
+
+def test_unreadable_file_is_a_miss(cache):
+    with open(cache.path, "w") as f:
+        f.write("{not json")
+    assert cache.get("port") is None
+    cache.put("port", "10.0.0.5")
+    assert cache.get("port").ip == "10.0.0.5"
+
+
+def test_discovery_uses_a_cached_ip_that_answers(with_simulator, cache, monkeypatch):
+    usb_queries = []
+
+    async def get_ip_controller(serial_port):
+        usb_queries.append(serial_port)
+        return "10.9.9.9"
+
+    monkeypatch.setattr(ip_utils, "get_ip_controller", get_ip_controller)
+
+    async def test(sim, controller):
+        cache.put("/dev/pty-test", controller.ip)
+        hit = await ip_utils.discover_ip_controller("/dev/pty-test", cache, controller.session)
+        # a controller that no longer answers falls back to USB
+        cache.put("/dev/pty-test", "127.0.0.1:9")
+        miss = await ip_utils.discover_ip_controller("/dev/pty-test", cache, controller.session,
+                                                     ping_timeout_s=0.2)
+        return controller.ip, hit, miss
+
+    ip, hit, miss = with_simulator(test)
+    assert hit == (ip, True, 0)
+    assert miss == ("10.9.9.9", False, 1)
+    assert usb_queries == ["/dev/pty-test"]
+    assert cache.get("/dev/pty-test").ip == "10.9.9.9"
+
+
+def test_discovery_without_usb_attempts_only_checks_the_cache(cache):
+    found = asyncio.run(ip_utils.discover_ip_controller("/dev/pty-test", cache, attempts=0))
+    assert found == (None, False, 0)
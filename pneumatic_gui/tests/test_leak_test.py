@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from control.leak_test import LeakDetector, LineFit, t_quantile
+from control.pneumatic_control import pneumatic_set_valve
+
+
+@pytest.mark.parametrize("p, df, expected", [
+    (0.975, 3, 3.182),
+    (0.975, 5, 2.571),
+    (0.975, 10, 2.228),
+    (0.975, 30, 2.042),
+    (0.95, 8, 1.860),
+    (0.995, 20, 2.845),
+])
+def test_t_quantile_matches_table(p, df, expected):
+    assert t_quantile(p, df) == pytest.approx(expected, rel=0.01)
+
+
+def test_line_fit():
+    fit = LineFit()
+    for x in range(10):
+        fit.add(x, 3.0 - 0.5 * x)
+    assert fit.slope == pytest.approx(-0.5)
+    assert fit.intercept == pytest.approx(3.0)
+    assert fit.slope_se() == pytest.approx(0.0, abs=1e-9)
+
+
+def test_min_samples_below_five_is_rejected():
+    with pytest.raises(ValueError):
+        LeakDetector(min_samples=4)
+
+
+async def _pressurize_and_close(controller, channel: int = 1):
+    await pneumatic_set_valve(channel, True, controller=controller, force=True)
+    await asyncio.sleep(0.6)    # ~4 fill time constants
+    await pneumatic_set_valve(channel, False, controller=controller, force=True)
+
+
+def test_stops_early_on_clean_linear_decay(with_simulator):
+    # tau 20 s: over a fraction of a second the leak is a straight line at
+    # about (35 - 7) / 20 = 1.4 psi/s
+    async def test(sim, controller):
+        await _pressurize_and_close(controller)
+        return await LeakDetector(timeout_s=5.0).measure(1, controller)
+
+    result = with_simulator(test, leak_tau={1: 20.0})
+    assert result.converged
+    assert result.elapsed_s < 2.0
+    assert result.rate_psi_s == pytest.approx(1.4, rel=0.3)
+    assert result.ci_low <= result.rate_psi_s <= result.ci_high
+
+
+def test_fits_the_exponential_decay_time_constant(with_simulator):
+    async def test(sim, controller):
+        await _pressurize_and_close(controller)
+        return await LeakDetector(timeout_s=5.0).measure(1, controller, baseline_psi=7.0)
+
+    result = with_simulator(test, leak_tau={1: 2.0})
+    assert result.converged
+    assert result.tau_s == pytest.approx(2.0, rel=0.3)
+
+
+def test_keeps_sampling_on_noisy_data(with_simulator):
+    # a valve at rest under 1 psi of noise: the rate never gets tight enough
+    async def test(sim, controller):
+        sim.pneumatic.valves[1].noise_psi = 1.0
+        return await LeakDetector(timeout_s=0.5).measure(1, controller)
+
+    result = with_simulator(test)
+    assert not result.converged
+    assert result.samples > LeakDetector().min_samples
+    assert result.elapsed_s >= 0.5
@@ -0,0 +1,39 @@
+import pytest
+
+from testplan.parallel import parse_groups, run_parallel_valve_test
+from testplan.plan import PlanError
+
+
+def test_parse_groups():
+    assert parse_groups("1-3;4,5,6") == [[1, 2, 3], [4, 5, 6]]
+    assert parse_groups(" 2 ; ;5-6") == [[2], [5, 6]]
+
+
+@pytest.mark.parametrize("text, error", [
+    ("0-2", "outside 1-6"),
+    ("1-3;7", "outside 1-6"),
+    ("1,x", "Bad channel"),
+    ("1-3;3", "listed twice"),
+    (";", "No channels"),
+])
+def test_bad_groups_are_rejected(text, error):
+    with pytest.raises(PlanError, match=error):
+        parse_groups(text)
+
+
+def test_independent_channels_run_in_parallel(with_simulator):
+    async def test(sim, controller):
+        return await run_parallel_valve_test(controller, [[1, 2, 3]], params={"min_rise_psi": 1.0})
+
+    run = with_simulator(test)
+    assert run.passed
+    assert run.modes == {1: "probe", 2: "parallel", 3: "parallel"}
+
+
+def test_cross_talk_falls_back_to_serial(with_simulator):
+    async def test(sim, controller):
+        return await run_parallel_valve_test(controller, [[1, 2, 3]], crosstalk_psi=0.5)
+
+    run = with_simulator(test, crosstalk=0.2)
+    assert run.modes == {1: "probe", 2: "serial", 3: "serial"}
+    assert any(line.startswith("Cross-talk detected opening valve 1") for line in run.report_lines)
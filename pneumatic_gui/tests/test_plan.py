@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+
+from testplan import actions
+from testplan.engine import FAILED, PASSED, SKIPPED, PlanRun, check_limits
+from testplan.plan import PlanError, Step, compile_plan, load_plan
+from utils.report_sink import ReportSink, read_records
+
+
+def step(**limits) -> Step:
+    return Step({"id": "s", "action": "sleep", "limits": limits})
+
+
+def test_foreach_expands_steps_per_value():
+    plan = compile_plan({"params": {"channels": [1, 2]}, "steps": [
+        {"id": "close_all", "action": "sleep", "args": {"seconds": 0}},
+        {"foreach": {"channel": "$channels"}, "steps": [
+            {"id": "read_{channel}", "action": "read_pressure", "args": {"channel": "{channel}"},
+             "after": ["close_all"]},
+        ]},
+    ]})
+    assert plan.order == ["close_all", "read_1", "read_2"]
+    # a whole-string "{var}" keeps the value's type
+    assert plan.steps["read_2"].args == {"channel": 2}
+    assert plan.steps["read_2"].after == ["close_all"]
+
+
+def test_serial_foreach_runs_each_repetition_after_the_previous():
+    plan = compile_plan({"steps": [
+        {"foreach": {"channel": [1, 2, 3]}, "serial": True, "steps": [
+            {"id": "open_{channel}", "action": "sleep", "args": {"seconds": 0}},
+            {"id": "close_{channel}", "action": "sleep", "args": {"seconds": 0}, "after": ["open_{channel}"]},
+        ]},
+    ]})
+    assert set(plan.steps["open_2"].after) == {"open_1", "close_1"}
+    assert set(plan.steps["close_3"].after) == {"open_3", "open_2", "close_2"}
+    assert plan.order.index("close_1") < plan.order.index("open_2")
+
+
+def test_step_reference_orders_the_step():
+    plan = compile_plan({"steps": [
+        {"id": "rise", "action": "delta", "args": {"from": "${closed.psi}", "to": "${opened.psi}"}},
+        {"id": "closed", "action": "read_pressure", "args": {"channel": 1}},
+        {"id": "opened", "action": "read_pressure", "args": {"channel": 1}},
+    ]})
+    assert plan.steps["rise"].refs == {"closed", "opened"}
+    assert plan.order == ["closed", "opened", "rise"]
+
+
+def test_dependency_cycle_is_rejected():
+    with pytest.raises(PlanError, match="Dependency cycle between steps: a, b"):
+        compile_plan({"steps": [
+            {"id": "a", "action": "sleep", "after": ["b"]},
+            {"id": "b", "action": "sleep", "depends_on": ["a"]},
+            {"id": "c", "action": "sleep"},
+        ]})
+
+
+@pytest.mark.parametrize("steps, error", [
+    ([{"id": "a", "action": "sleep", "after": ["x"]}], "waits for unknown step"),
+    ([{"id": "a", "action": "sleep"}, {"id": "a", "action": "sleep"}], "Duplicate step id"),
+    ([{"id": "a", "action": "fly"}], "Unknown action"),
+    ([{"id": "a", "action": "sleep", "timeout": 1}], "Unknown field"),
+    ([{"id": "a", "action": "sleep", "limits": {"psi": {"below": 1}}}], "Bad limit"),
+])
+def test_bad_plans_are_rejected(steps, error):
+    with pytest.raises(PlanError, match=error):
+        compile_plan({"steps": steps})
+
+
+def test_shipped_plans_compile():
+    for name in ("valve_test", "leak_test", "gimatic_test"):
+        assert compile_plan(load_plan(name)).order
+
+
+def test_check_limits():
+    assert check_limits(step(psi={"min": 1, "max": 5}), {"psi": 3}) is None
+    assert check_limits(step(psi={"min": 1}), {"psi": 0.5}) == "psi=0.5 below min 1"
+    assert check_limits(step(psi={"max": 5}), {"psi": 6}) == "psi=6 above max 5"
+    assert check_limits(step(ok={"equals": True}), {"ok": False}) == "ok=False, expected True"
+    assert check_limits(step(ret={"in": ["OK"]}), {"ret": "NOK"}) == "ret=NOK, expected one of ['OK']"
+    assert check_limits(step(psi={"max": 5}), {}) == "psi missing from result"
+
+
+def test_check_limits_fails_a_value_that_cannot_be_compared():
+    assert check_limits(step(psi={"min": 1}), {"psi": None}) == "psi=None not comparable"
+    assert check_limits(step(psi={"max": 1}), {"psi": "n/a"}) == "psi=n/a not comparable"
+
+
+def test_nok_reading_fails_its_step_not_the_plan(monkeypatch):
+    # read_pressure returns psi None for an NOK reply
+    async def read_pressure(ctx, args, step):
+        return {"psi": None, "ok": False}
+
+    monkeypatch.setitem(actions.ACTIONS, "read_pressure", read_pressure)
+    plan = compile_plan({"steps": [
+        {"id": "read", "action": "read_pressure", "args": {"channel": 1}, "limits": {"psi": {"min": 1}}},
+        {"id": "then", "action": "sleep", "args": {"seconds": 0}, "depends_on": ["read"]},
+        {"id": "anyway", "action": "sleep", "args": {"seconds": 0}, "after": ["read"]},
+    ]})
+    result = asyncio.run(PlanRun(plan, controller=None).run())
+    assert result.steps["read"].status == FAILED
+    assert result.steps["read"].error == "psi=None not comparable"
+    assert result.steps["then"].status == SKIPPED
+    assert result.steps["anyway"].status == PASSED
+
+
+def test_step_records_carry_the_foreach_channel(tmp_path):
+    plan = compile_plan({"steps": [
+        {"foreach": {"channel": [1, 2]}, "steps": [
+            {"id": "rise_{channel}", "action": "delta", "args": {"from": 1, "to": 3}},
+        ]},
+        {"id": "pause", "action": "sleep", "args": {"seconds": 0}},
+    ]})
+    path = str(tmp_path / "run.jsonl")
+
+    async def main():
+        sink = ReportSink(path)
+        await PlanRun(plan, controller=None, sink=sink).run()
+        await sink.aclose()
+
+    asyncio.run(main())
+    channels = {r["step"]: r["channel"] for r in read_records(path) if r["kind"] == "step"}
+    assert channels == {"rise_1": 1, "rise_2": 2, "pause": None}
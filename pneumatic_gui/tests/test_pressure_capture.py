@@ -0,0 +1,48 @@
+import pytest
+
+from control.pressure_capture import PressureRingBuffer
+from control.pressure_stream import PressureSample
+
+
+def filled(capacity: int, count: int) -> PressureRingBuffer:
+    # sample k: t=k, channel 1 or 2 alternating, psi=10+k
+    buffer = PressureRingBuffer(capacity)
+    for k in range(count):
+        buffer.append(float(k), 1 + k % 2, 10.0 + k)
+    return buffer
+
+
+def test_samples_are_packed_in_typed_arrays():
+    buffer = PressureRingBuffer(8)
+    assert [(a.typecode, a.itemsize) for a in (buffer._t, buffer._psi, buffer._ch)] == [("d", 8), ("f", 4), ("H", 2)]
+    assert sum(len(a) * a.itemsize for a in (buffer._t, buffer._psi, buffer._ch)) == 8 * 14
+    buffer.append(1.25, 3, 17.91)
+    sample, = buffer.samples()
+    # psi is stored as float32
+    assert sample == PressureSample(1.25, 3, pytest.approx(17.91, abs=1e-5))
+
+
+def test_wraparound_overwrites_the_oldest_samples():
+    buffer = filled(4, 6)
+    assert len(buffer) == 4
+    assert buffer.overwritten == 2
+    assert buffer.oldest_timestamp() == 2.0
+    assert [(s.timestamp, s.channel, s.psi) for s in buffer.samples()] == [
+        (2.0, 1, 12.0), (3.0, 2, 13.0), (4.0, 1, 14.0), (5.0, 2, 15.0)]
+    assert buffer.channels() == [1, 2]
+
+
+def test_snapshot_filters_keep_time_order_across_the_wrap():
+    buffer = filled(5, 13)
+    assert [s.timestamp for s in buffer.samples()] == [8.0, 9.0, 10.0, 11.0, 12.0]
+    assert [s.timestamp for s in buffer.samples(channel=1)] == [8.0, 10.0, 12.0]
+    assert [s.timestamp for s in buffer.samples(since=10.5)] == [11.0, 12.0]
+    buffer.clear()
+    assert len(buffer) == 0 and list(buffer.samples()) == [] and buffer.oldest_timestamp() is None
+
+
+def test_downsample_buckets_per_channel():
+    buffer = filled(16, 8)
+    rows = buffer.downsample(4.0, channel=2)
+    assert [(r.timestamp, r.channel, r.psi_mean, r.psi_min, r.psi_max, r.samples) for r in rows] == [
+        (0.0, 2, 12.0, 11.0, 13.0, 2), (4.0, 2, 16.0, 15.0, 17.0, 2)]
@@ -0,0 +1,68 @@
+import asyncio
+
+from aiocoap.numbers.codes import Code
+
+from control.pressure_stream import PressureStream
+
+
+async def _collect(stream: PressureStream, n: int) -> list:
+    samples = []
+    async for sample in stream:
+        samples.append(sample)
+        if len(samples) == n:
+            return samples
+
+
+def test_observe_streams_notifications(with_simulator):
+    async def test(sim, controller):
+        async with PressureStream([1, 2], controller) as stream:
+            samples = await asyncio.wait_for(_collect(stream, 20), 5)
+            return stream.mode, samples, len(sim._observers)
+
+    mode, samples, observers = with_simulator(test, notify_interval_s=0.01)
+    assert mode == "observe"
+    assert observers == 1
+    assert {s.channel for s in samples} == {1, 2}
+    assert all(s.psi > 0 for s in samples)
+
+
+def test_polls_when_observe_is_off(with_simulator):
+    async def test(sim, controller):
+        async with PressureStream([1, 2], controller, poll_interval_s=0.01, use_observe=False) as stream:
+            samples = await asyncio.wait_for(_collect(stream, 6), 5)
+            return stream.mode, samples, len(sim._observers)
+
+    mode, samples, observers = with_simulator(test)
+    assert mode == "poll"
+    assert observers == 0
+    assert [s.channel for s in samples] == [1, 2, 1, 2, 1, 2]
+
+
+def test_falls_back_to_polling_when_the_resource_is_missing(with_simulator):
+    async def test(sim, controller):
+        # a controller firmware without the observable pressure resource
+        del sim._routes[("pressure",), Code.GET]
+        async with PressureStream([3], controller, poll_interval_s=0.01) as stream:
+            samples = await asyncio.wait_for(_collect(stream, 3), 5)
+            return stream.mode, samples
+
+    mode, samples = with_simulator(test)
+    assert mode == "poll"
+    assert [s.channel for s in samples] == [3, 3, 3]
+
+
+def test_slow_reader_gets_the_newest_samples(with_simulator):
+    for use_observe in (True, False):
+        async def test(sim, controller):
+            seen = []
+            stream = PressureStream([1, 2], controller, callback=seen.append, poll_interval_s=0.01,
+                                    use_observe=use_observe, max_queued=5)
+            async with stream:
+                while len(seen) < 20:
+                    await asyncio.sleep(0.05)
+            return seen, [stream._queue.get_nowait() for _ in range(stream._queue.qsize())]
+
+        seen, drained = with_simulator(test, notify_interval_s=0.01)
+        assert len(drained) == 5
+        # the oldest samples were dropped
+        assert drained == seen[-5:]
@@ -0,0 +1,45 @@
+import os
+
+from testplan.engine import run_plan
+from testplan.plan import compile_plan, load_plan
+from utils.report_index import ReportIndex, parse_line
+from utils.report_sink import ReportSink
+from utils.reports import report_filename
+
+
+def _record_plan_run(with_simulator, directory, box: str, **sim_kwargs) -> str:
+    # valve_test on channels 1 and 2, streamed to a .jsonl like the GUI and CLI do
+    path = os.path.join(directory, report_filename("20250610_143943", box, ".jsonl"))
+
+    async def test(sim, controller):
+        plan = compile_plan(load_plan("valve_test"), {"channels": [1, 2], "serial": False})
+        sink = ReportSink(path)
+        try:
+            await run_plan(plan, controller, sink=sink)
+        finally:
+            await sink.aclose()
+
+    with_simulator(test, **sim_kwargs)
+    return path
+
+
+def test_plan_records_are_indexed_per_channel(with_simulator, tmp_path):
+    path = _record_plan_run(with_simulator, str(tmp_path), "boxB", stuck={2})
+    with ReportIndex(str(tmp_path / "index.sqlite")) as index:
+        assert index.index_file(path)
+        rows = index.db.execute("SELECT step, channel, status, value FROM readings").fetchall()
+
+    steps = {(step, channel): (status, value) for step, channel, status, value in rows}
+    for step in ("read_closed", "settle_open", "read_open", "rise", "settle_closed"):
+        assert {channel for s, channel in steps if s == step} == {1, 2}, step
+    assert all(channel is not None for step, channel in steps if step != "initial_close")
+    # the stuck valve's rise failed, and is found under its channel
+    assert steps[("rise", 1)][0] == "passed"
+    assert steps[("rise", 2)][0] == "failed"
+    assert steps[("rise", 2)][1] < 1.0
+
+
+def test_text_and_record_lines_agree():
+    fields = parse_line("Read Pressure Opened Valve 3: {'ret': 'OK', 'data': {'psi': 17.91, 'ret': 'OK'}}")
+    assert (fields["step"], fields["channel"], fields["psi"], fields["status"]) == ("read_open", 3, 17.91, "passed")
+
@@ -0,0 +1,132 @@
+import asyncio
+import os
+import select
+import threading
+import time
+import tty
+
+import pytest
+
+from utils.serial_transport import SerialTransport
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "openpty"), reason="needs a pty pair")
+
+
+class FakeConsole:
+    # Controller USB console on the master side of a pty pair: answers
+    # "<command>\n" with "echo <command>\nok\n\n". `replies` overrides the
+    # answer of a command (b"" for none).
+    def __init__(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.path = os.ttyname(self.slave)
+        self.replies = {}
+        self.received = []
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        buffer = b""
+        while not self._closed.is_set():
+            if not select.select([self.master], [], [], 0.05)[0]:
+                continue
+            try:
+                data = os.read(self.master, 1024)
+            except OSError:
+                return
+            if not data:
+                return
+            buffer += data
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                command = line.decode()
+                self.received.append(command)
+                time.sleep(0.01)
+                reply = self.replies.get(command, f"echo {command}\nok\n\n".encode())
+                if reply:
+                    os.write(self.master, reply)
+
+    def close(self):
+        # the master fd only hangs up the pty once no read is blocked on it
+        self._closed.set()
+        self._thread.join()
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+@pytest.fixture
+def console():
+    console = FakeConsole()
+    yield console
+    console.close()
+
+
+def test_pipelined_commands_are_matched_in_order(console):
+    async def main():
+        transport = SerialTransport(console.path, timeout_s=2.0, max_in_flight=3)
+        try:
+            return await asyncio.gather(*(transport.command(f"c{i}") for i in range(10))), transport.opened
+        finally:
+            await transport.close()
+
+    replies, opened = asyncio.run(main())
+    assert replies == [[f"echo c{i}", "ok"] for i in range(10)]
+    assert opened == 1
+
+
+def test_timeout_drops_partial_output_and_recovers(console):
+    # "stall" leaves half a response in the buffer and nothing more
+    console.replies["stall"] = b"half a resp"
+
+    async def main():
+        transport = SerialTransport(console.path, timeout_s=0.3)
+        try:
+            with pytest.raises(Exception, match="No response to 'stall'"):
+                await transport.command("stall")
+            return await transport.command("next")
+        finally:
+            await transport.close()
+
+    assert asyncio.run(main()) == ["echo next", "ok"]
+
+
+def test_reopens_after_io_error(tmp_path):
+    # the port is a symlink, like /dev/serial/by-id/..., moved to a new pty
+    # when the "adapter" is replugged
+    link = str(tmp_path / "ttyUSB")
+    first = FakeConsole()
+    os.symlink(first.path, link)
+    second = None
+
+    async def main():
+        nonlocal second
+        transport = SerialTransport(link, timeout_s=1.0)
+        try:
+            assert await transport.command("a") == ["echo a", "ok"]
+            first.close()
+            for _ in range(50):
+                if not transport.is_open:
+                    break
+                await asyncio.sleep(0.02)
+            assert not transport.is_open
+            second = FakeConsole()
+            os.replace(_symlink(second.path, tmp_path), link)
+            return await transport.command("b"), transport.opened
+        finally:
+            await transport.close()
+
+    try:
+        assert asyncio.run(main()) == (["echo b", "ok"], 2)
+    finally:
+        if second is not None:
+            second.close()
+
+
+def _symlink(target: str, directory) -> str:
+    path = str(directory / "ttyUSB.new")
+    os.symlink(target, path)
+    return path
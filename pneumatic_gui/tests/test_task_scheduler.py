@@ -0,0 +1,107 @@
+import asyncio
+
+from utils.task_scheduler import Priority, TaskScheduler
+
+
+async def _until(condition):
+    while not condition():
+        await asyncio.sleep(0.001)
+
+
+def run(test, **kwargs):
+    async def main():
+        return await test(TaskScheduler(asyncio.get_running_loop(), **kwargs))
+    return asyncio.run(main())
+
+
+def test_at_most_max_concurrency_tasks_run_at_once():
+    running = []
+    peak = []
+
+    async def work():
+        running.append(1)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.pop()
+
+    async def test(scheduler):
+        handles = [scheduler.submit(work(), Priority.READ) for _ in range(10)]
+        await asyncio.gather(*(asyncio.wrap_future(h.future) for h in handles))
+        return scheduler.metrics()
+
+    metrics = run(test)
+    assert metrics["max_concurrency"] == 4
+    assert max(peak) == 4
+    assert metrics["lanes"]["READ"]["completed"] == 10
+
+
+def test_queued_work_starts_by_lane_then_fifo():
+    started = []
+
+    async def work(name, event):
+        started.append(name)
+        await event.wait()
+
+    async def test(scheduler):
+        event = asyncio.Event()
+        blocker = scheduler.submit(work("blocker", event), Priority.TEST)
+        await _until(lambda: started)
+        handles = [scheduler.submit(work(name, event), priority) for name, priority in [
+            ("test", Priority.TEST), ("read", Priority.READ), ("command 1", Priority.COMMAND),
+            ("command 2", Priority.COMMAND)]]
+        await asyncio.sleep(0.01)
+        assert started == ["blocker"]
+        event.set()
+        await asyncio.gather(*(asyncio.wrap_future(h.future) for h in [blocker] + handles))
+
+    run(test, max_concurrency=1)
+    assert started == ["blocker", "command 1", "command 2", "read", "test"]
+
+
+def test_emergency_starts_over_the_limit_ahead_of_queued_work():
+    started = []
+
+    async def work(name, event):
+        started.append(name)
+        await event.wait()
+
+    async def test(scheduler):
+        event = asyncio.Event()
+        scheduler.submit(work("test", event), Priority.TEST)
+        scheduler.submit(work("read", event), Priority.READ)
+        emergency = scheduler.submit(work("close", event), Priority.EMERGENCY)
+        await _until(lambda: "close" in started)
+        metrics = scheduler.metrics()
+        event.set()
+        await asyncio.wrap_future(emergency.future)
+        return metrics
+
+    metrics = run(test, max_concurrency=1)
+    assert started[:2] == ["test", "close"]
+    assert metrics["running"] == 2
+    assert metrics["lanes"]["READ"]["queued"] == 1
+
+
+def test_cancel_drops_queued_work():
+    started = []
+
+    async def work(name, event):
+        started.append(name)
+        await event.wait()
+
+    async def test(scheduler):
+        event = asyncio.Event()
+        blocker = scheduler.submit(work("blocker", event), Priority.TEST)
+        queued = scheduler.submit(work("queued", event), Priority.READ)
+        await _until(lambda: started)
+        queued.cancel()
+        await asyncio.sleep(0.01)
+        event.set()
+        await asyncio.wrap_future(blocker.future)
+        await asyncio.sleep(0.01)
+        return queued, scheduler.metrics()
+
+    queued, metrics = run(test, max_concurrency=1)
+    assert queued.future.cancelled()
+    assert started == ["blocker"]
+    assert metrics["lanes"]["READ"]["cancelled"] == 1 and metrics["lanes"]["READ"]["queued"] == 0
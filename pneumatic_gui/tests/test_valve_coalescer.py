@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from control import valve_coalescer
+from control.valve_coalescer import ValveCommandCoalescer
+from utils.task_scheduler import Priority
+
+
+@pytest.fixture
+def lanes(monkeypatch):
+    # runs scheduled senders as plain tasks and records (lane, open_value)
+    # for every command sent
+    tasks = {}
+    sent = []
+
+    def schedule_coro(coro, priority, name=None):
+        task = asyncio.ensure_future(coro)
+        tasks[task] = priority
+
+    async def pneumatic_set_valve(channel, open_value, controller=None):
+        sent.append((tasks[asyncio.current_task()], open_value))
+        await asyncio.sleep(0.01)
+
+    monkeypatch.setattr(valve_coalescer, "schedule_coro", schedule_coro)
+    monkeypatch.setattr(valve_coalescer, "pneumatic_set_valve", pneumatic_set_valve)
+    monkeypatch.setattr(valve_coalescer, "get_controller", lambda ip: None)
+    return tasks, sent
+
+
+async def _settle(tasks):
+    while not all(task.done() for task in tasks):
+        await asyncio.sleep(0.01)
+
+
+def test_close_superseding_a_queued_open_goes_out_in_the_emergency_lane(lanes):
+    tasks, sent = lanes
+
+    async def main():
+        coalescer = ValveCommandCoalescer(debounce_s=0.05)
+        coalescer.submit("ip", 1, True)
+        coalescer.submit("ip", 1, False)
+        await _settle(tasks)
+        return coalescer
+
+    coalescer = asyncio.run(main())
+    assert sent == [(Priority.EMERGENCY, False)]
+    assert sorted(tasks.values()) == [Priority.EMERGENCY, Priority.COMMAND]
+    assert coalescer.superseded == 1
+    assert not coalescer._senders
+
+
+def test_commands_to_a_valve_are_sent_in_order_by_one_sender(lanes):
+    tasks, sent = lanes
+
+    async def main():
+        coalescer = ValveCommandCoalescer(debounce_s=0.0)
+        coalescer.submit("ip", 1, False)
+        await asyncio.sleep(0)          # the close is on the wire
+        coalescer.submit("ip", 1, True)
+        coalescer.submit("ip", 1, False)
+        coalescer.submit("ip", 1, True)
+        await _settle(tasks)
+
+    asyncio.run(main())
+    # one EMERGENCY sender; the opens in between collapse into the latest
+    assert list(tasks.values()) == [Priority.EMERGENCY]
+    assert sent == [(Priority.EMERGENCY, False), (Priority.EMERGENCY, True)]
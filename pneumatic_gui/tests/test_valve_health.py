@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from utils.report_index import ReportIndex
+from utils.valve_health import LEAK, MISSING, SLOW, STUCK, HealthLimits, ValveRuns, analyze, load_runs
+
+
+def reply(psi: float) -> str:
+    return str({"ret": "OK", "data": {"psi": psi, "ret": "OK"}})
+
+
+def write_report(directory, timestamp: str, lines: list) -> str:
+    path = str(directory / f"bento-elec-{timestamp}_kkk.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+
+def build_index(tmp_path) -> ReportIndex:
+    # 1 June: every valve opens (valve 1 through the settle step);
+    # 2 June: valve 2 stuck at 17.91 psi, valve 3 never read open
+    healthy = write_report(tmp_path, "20250601_090000", [
+        f"Read Pressure Closed Valve 1: {reply(7.0)}",
+        "Settle Opened Valve 1: settled in 0.40 s (21.00 psi, band 0.20 psi)",
+        f"Read Pressure Closed Valve 2: {reply(7.1)}",
+        f"Read Pressure Opened Valve 2: {reply(20.0)}",
+        f"Read Pressure Closed Valve 3: {reply(7.2)}",
+        f"Read Pressure Opened Valve 3: {reply(20.1)}",
+    ])
+    faulty = write_report(tmp_path, "20250602_090000", [
+        f"Read Pressure Closed Valve 1: {reply(7.0)}",
+        f"Read Pressure Opened Valve 1: {reply(19.5)}",
+        f"Read Pressure Closed Valve 2: {reply(17.91)}",
+        f"Read Pressure Opened Valve 2: {reply(17.91)}",
+        f"Read Pressure Closed Valve 3: {reply(7.0)}",
+    ])
+    index = ReportIndex(str(tmp_path / "index.sqlite"))
+    # indexed newest first: runs come back in timestamp order regardless
+    assert index.index_file(faulty) and index.index_file(healthy)
+    return index
+
+
+def test_load_runs_scatters_readings_per_run_and_channel(tmp_path):
+    with build_index(tmp_path) as index:
+        runs = load_runs(index)
+    assert len(runs) == 2
+    assert list(runs.channels) == [1, 2, 3]
+    assert list(runs.timestamps) == ["20250601_090000", "20250602_090000"]
+    assert list(runs.boxes) == ["kkk", "kkk"]
+    # the settled pressure stands in for the open read
+    assert runs.open[0, 0] == 21.0 and runs.settle_s[0, 0] == 0.4
+    assert np.isnan(runs.open[1, 2]) and runs.closed[1, 2] == 7.0
+
+
+def test_stuck_and_missing_valves_are_flagged(tmp_path):
+    with build_index(tmp_path) as index:
+        health = analyze(load_runs(index))
+    assert health.reasons.tolist() == [[0, 0, 0], [0, STUCK, MISSING]]
+    assert health.passed.tolist() == [[True, True, True], [True, False, False]]
+
+    summary = {row["channel"]: row for row in health.channel_summary()}
+    assert (summary[1]["runs"], summary[1]["passed"], summary[1]["pass_rate"]) == (2, 2, 1.0)
+    assert summary[1]["median_delta_psi"] == 13.25
+    assert (summary[2]["passed"], summary[2]["stuck"], summary[2]["min_delta_psi"]) == (1, 1, 0.0)
+    assert (summary[3]["passed"], summary[3]["missing"]) == (1, 1)
+    assert summary[3]["median_delta_psi"] == pytest.approx(12.9)
+
+    failures = [(f["timestamp"], f["channel"], f["reasons"]) for f in health.failures()]
+    assert failures == [("20250602_090000", 2, "stuck"), ("20250602_090000", 3, "missing")]
+
+
+def test_tighter_limits_flag_slow_settling(tmp_path):
+    with build_index(tmp_path) as index:
+        health = analyze(load_runs(index), HealthLimits(max_settle_s=0.3, min_settle_rate=40))
+    assert health.reasons[0, 0] == SLOW
+
+
+def test_leak_rate_from_the_leak_step_or_the_closed_settle():
+    runs = ValveRuns([1, 2], closed=[[7.0, 7.0]], open=[[20.0, 20.0]], closed_after=[[18.0, 18.0]],
+                     close_settle_s=[[4.0, 4.0]], leak_rate=[[np.nan, 0.1]])
+    health = analyze(runs, HealthLimits(max_leak_rate=0.3))
+    assert health.leak_rate.tolist() == [[0.5, 0.1]]
+    assert health.reasons.tolist() == [[LEAK, 0]]
+    assert health.channel_summary()[0]["leak"] == 1
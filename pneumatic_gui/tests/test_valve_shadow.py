@@ -0,0 +1,55 @@
+from control import valve_shadow
+from control.pneumatic_control import pneumatic_read_valve_state, pneumatic_set_valve, pneumatic_set_valves
+from control.valve_shadow import ValveShadow
+from sim.bento_sim import PNEUMATIC_CAN_ID
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(valve_shadow.time, "monotonic", lambda: now[0])
+    shadow = ValveShadow(ttl_s=5)
+    shadow.update(1, True)
+    assert shadow.matches(1, True)
+    now[0] += 6
+    assert shadow.get(1) is None
+    assert not shadow.matches(1, True)
+
+
+def test_invalidate_forgets_one_channel_or_all():
+    shadow = ValveShadow()
+    shadow.update(1, True)
+    shadow.update(2, False)
+    shadow.invalidate(1)
+    assert shadow.get(1) is None and shadow.get(2) is False
+    shadow.invalidate()
+    assert shadow.get(2) is None
+
+
+def test_repeated_set_valve_is_skipped_until_forced(with_simulator):
+    async def test(sim, controller):
+        module = sim.modules[PNEUMATIC_CAN_ID]
+        await pneumatic_set_valve(1, True, controller=controller)
+        reply = await pneumatic_set_valve(1, True, controller=controller)
+        assert reply["skipped"] and controller.valve_shadow.skipped == 1
+        assert module.commands == 1
+        await pneumatic_set_valve(1, True, controller=controller, force=True)
+        assert module.commands == 2
+
+        results = await pneumatic_set_valves({1: True, 2: True}, controller=controller)
+        assert results[1]["skipped"] and not results[2].get("skipped")
+        assert controller.valve_shadow.get(2) is True
+
+    with_simulator(test)
+
+
+def test_p_read_does_not_touch_the_shadow(with_simulator):
+    # p_read replies carry psi only, so the shadow stays write-through
+    async def test(sim, controller):
+        reply = await pneumatic_read_valve_state(3, controller=controller)
+        assert "psi" in reply["data"]
+        assert controller.valve_shadow.get(3) is None
+        await pneumatic_set_valve(3, False, controller=controller)
+        await pneumatic_read_valve_state(3, controller=controller)
+        assert controller.valve_shadow.get(3) is False
+
+    with_simulator(test)
@@ -0,0 +1,93 @@
+import json
+import logging
+import os
+import time
+from typing import NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# Controller IPs found over USB, saved to disk so the next test run on the
+# same box can skip the serial query:
+#
+#   {"/dev/ttyUSB0#A10KXY3Z": {"ip": "172.16.50.74", "found_at": 1718001234.5}}
+#
+# The key is the serial port plus the USB serial number of the adapter when
+# the OS reports one (box_key), so plugging the next box into the same port
+# does not hit the previous box's entry. Ports without one (ptys, some
+# adapters) are keyed by the port alone; there the TTL and the liveness check
+# in ip_utils.discover_ip_controller are the only guard.
+
+DEFAULT_CACHE = "bento-ip-cache.json"
+DEFAULT_TTL_S = 8 * 3600     # a working shift; DHCP leases run longer
+
+
+class CachedIp(NamedTuple):
+    ip: str
+    found_at: float
+    age_s: float
+
+
+def box_key(serial_port: str) -> str:
+    try:
+        from serial.tools.list_ports import comports
+        for info in comports():
+            if info.device == serial_port and info.serial_number:
+                return f"{serial_port}#{info.serial_number}"
+    except Exception:
+        logger.debug("Could not list serial ports", exc_info=True)
+    return serial_port
+
+
+class IpCache:
+    def __init__(self, path: str = DEFAULT_CACHE, ttl_s: float = DEFAULT_TTL_S):
+        self.path = path
+        self.ttl_s = ttl_s
+
+    # The entry for `key` if it is younger than the TTL; a malformed entry
+    # is a miss, like an unreadable file
+    def get(self, key: str) -> Optional[CachedIp]:
+        entry = self._load().get(key)
+        try:
+            ip, found_at = entry["ip"], float(entry["found_at"])
+        except (KeyError, TypeError, ValueError):
+            if entry is not None:
+                logger.warning("Ignoring malformed IP cache entry for %s: %r", key, entry)
+            return None
+        if not isinstance(ip, str) or not ip:
+            logger.warning("Ignoring malformed IP cache entry for %s: %r", key, entry)
+            return None
+        age = time.time() - found_at
+        if not 0 <= age < self.ttl_s:
+            return None
+        return CachedIp(ip, found_at, age)
+
+    def put(self, key: str, ip: str):
+        entries = self._load()
+        entries[key] = {"ip": ip, "found_at": time.time()}
+        self._save(entries)
+
+    def forget(self, key: str):
+        entries = self._load()
+        if entries.pop(key, None) is not None:
+            self._save(entries)
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                entries = json.load(f)
+            return entries if isinstance(entries, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable IP cache %s: %s", self.path, e)
+            return {}
+
+    def _save(self, entries: dict):
+        # write then rename, so a crash never leaves a half-written cache
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(entries, f, indent=1)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning("Could not save IP cache %s: %s", self.path, e)
@@ -1,14 +1,69 @@
-from typing import Optional
+import asyncio
+import logging
+from typing import List, NamedTuple, Optional
 
-def send_usb_command_retrieve_response(serial_port: str, command: str):
-    # Mocked response for now
-    return [" DHCP    preferred       1       172.16.50.74/255.255.255.0"]
+from control.coap_client import ControllerClient
+from utils.ip_cache import IpCache, box_key
+from utils.serial_transport import get_serial_transport
 
-def get_ip_controller(serial_port: str = "/dev/ttyUSB0") -> Optional[str]:
-    lines = send_usb_command_retrieve_response(serial_port, "net ipv4")
+logger = logging.getLogger(__name__)
+
+DEFAULT_SERIAL_PORT = "/dev/ttyUSB0"
+
+# Sends a console command over the controller's USB port; [] when the port
+# cannot be opened or does not answer
+async def send_usb_command_retrieve_response(serial_port: str, command: str) -> List[str]:
+    try:
+        return await get_serial_transport(serial_port).command(command)
+    except Exception as e:
+        logger.warning("USB command %r on %s failed: %s", command, serial_port, e)
+        return []
+
+# The DHCP address from the "net ipv4" output, e.g.
+#   DHCP    preferred       1       172.16.50.74/255.255.255.0
+def parse_ipv4(lines: List[str]) -> Optional[str]:
     for line in lines:
         if "DHCP" in line and "preferred" in line:
             parts = line.split()
             if len(parts) > 3:
                 return parts[3].split('/')[0]
     return None
+
+async def get_ip_controller(serial_port: str = DEFAULT_SERIAL_PORT) -> Optional[str]:
+    return parse_ipv4(await send_usb_command_retrieve_response(serial_port, "net ipv4"))
+
+
+class IpDiscovery(NamedTuple):
+    ip: Optional[str]
+    cached: bool        # answered from the cache, no USB query
+    attempts: int       # USB queries made
+
+
+# Controller IP for the box on `serial_port`. A cached IP younger than the
+# cache TTL is used when the controller answers a CoAP ping within
+# ping_timeout_s; otherwise (or with refresh=True) the IP is queried over
+# USB, up to `attempts` times (0: cache only), and the cache updated.
+# `session` is the CoapSession for the ping (default: the background loop's).
+async def discover_ip_controller(serial_port: str = DEFAULT_SERIAL_PORT, cache: IpCache = None,
+                                 session=None, refresh: bool = False, attempts: int = 3,
+                                 retry_s: float = 0.5, ping_timeout_s: float = 1.0) -> IpDiscovery:
+    cache = cache or IpCache()
+    # comports() walks sysfs / the registry
+    key = await asyncio.get_running_loop().run_in_executor(None, box_key, serial_port)
+    cached = None if refresh else cache.get(key)
+    if cached is not None:
+        try:
+            await asyncio.wait_for(ControllerClient(cached.ip, session=session).ping(), ping_timeout_s)
+            logger.debug("Cached controller IP %s for %s (%.0f s old)", cached.ip, key, cached.age_s)
+            return IpDiscovery(cached.ip, True, 0)
+        except Exception as e:
+            logger.info("Cached controller IP %s for %s did not answer: %s", cached.ip, key, str(e) or repr(e))
+            cache.forget(key)
+    for attempt in range(1, attempts + 1):
+        ip = await get_ip_controller(serial_port)
+        if ip:
+            cache.put(key, ip)
+            return IpDiscovery(ip, False, attempt)
+        if attempt < attempts:
+            await asyncio.sleep(retry_s)
+    return IpDiscovery(None, False, attempts)
@@ -0,0 +1,453 @@
+import argparse
+import ast
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import time
+from typing import Iterator, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# Local SQLite index over the test reports in a working directory:
+#
+#   bento-elec-<ts>_<name>.txt       GUI / CLI valve and gimatic tests
+#   bento-elec-<ts>_<name>.jsonl     the same runs' streamed step records
+#   auto_test_report_<ts>.txt        qc.py
+#   trial_auto_test_report_<ts>.txt  trial.py
+#
+# Every report line that names a valve becomes a row of `readings`, keyed by
+# run timestamp, box name, channel and step, with the psi taken out of the
+# controller reply and `value` holding the step's own number (pressure rise,
+# settle time, leak rate in psi/s). Files are indexed incrementally: a file whose size and
+# modification time did not change since it was indexed is skipped, a file
+# that changed is indexed again. When a run has both a .txt and a .jsonl,
+# only the richer .jsonl is indexed.
+#
+#   cd pneumatic_gui && python -m utils.report_index index ..
+#   cd pneumatic_gui && python -m utils.report_index psi --channel 3 --box kkk
+#   cd pneumatic_gui && python -m utils.report_index psi --channel 3 --step read_open --format csv
+#   cd pneumatic_gui && python -m utils.report_index reports --box kkk
+
+DEFAULT_DB = "bento-reports.sqlite"
+
+_FILENAME = re.compile(r"^(?P<kind>bento-elec|auto_test_report|trial_auto_test_report)-?_?"
+                       r"(?P<ts>\d{8}_\d{6})(?:_(?P<box>.+?))?\.(?P<ext>txt|jsonl)$")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    kind TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    box TEXT,
+    ip TEXT,
+    passed INTEGER,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    indexed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS readings (
+    report_id INTEGER NOT NULL REFERENCES reports(id) ON DELETE CASCADE,
+    line_no INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    box TEXT,
+    channel INTEGER,
+    step TEXT,
+    status TEXT,
+    psi REAL,
+    value REAL,
+    attempt INTEGER,
+    latency_s REAL,
+    text TEXT
+);
+-- psi history lookups are answered from these (partial, covering) indexes
+-- alone, in timestamp order, without touching the table
+CREATE INDEX IF NOT EXISTS readings_psi ON readings
+    (channel, timestamp, report_id, line_no, box, step, status, psi, value, attempt) WHERE psi IS NOT NULL;
+CREATE INDEX IF NOT EXISTS readings_box_psi ON readings
+    (box, channel, timestamp, report_id, line_no, step, status, psi, value, attempt) WHERE psi IS NOT NULL;
+CREATE INDEX IF NOT EXISTS readings_report ON readings (report_id);
+CREATE INDEX IF NOT EXISTS reports_box ON reports (box, timestamp);
+"""
+
+PASSED = "passed"
+FAILED = "failed"
+
+# (pattern, step, status) for the report lines of every script that has
+# written reports. Named groups: channel, attempt, reply (a reply dict repr),
+# psi, value, error, ip. A status of None is taken from the reply's "ret".
+_LINES = [
+    (r"IP Fetch - Success on attempt (?P<attempt>\d+): (?P<ip>\S+)", "ip_fetch", PASSED),
+    (r"IP Fetch - Failed after (?P<attempt>\d+) attempts", "ip_fetch", FAILED),
+    (r"Initial Close Valve (?P<channel>\d+) - Success", "initial_close", PASSED),
+    (r"Initial Close Valve (?P<channel>\d+) - Failed: (?P<error>.*)", "initial_close", FAILED),
+    (r"Initial Close Valves - Success", "initial_close", PASSED),
+    (r"Initial Close Valves - Failed: (?P<error>.*)", "initial_close", FAILED),
+    (r"Read Pressure Closed Valve (?P<channel>\d+): (?P<reply>\{.*\})", "read_closed", None),
+    (r"Read Pressure Opened Valve (?P<channel>\d+): (?P<reply>\{.*\})", "read_open", None),
+    (r"Open Valve (?P<channel>\d+) - Success", "open", PASSED),
+    (r"Close Valve (?P<channel>\d+) - Success", "close", PASSED),
+    (r"Close Valve (?P<channel>\d+) - Failed: (?P<error>.*)", "close", FAILED),
+    (r"Valve (?P<channel>\d+) Sequence Failed: (?P<error>.*)", "sequence", FAILED),
+    (r"Settle Opened Valve (?P<channel>\d+): (?P<error>not settled)?.*?(?P<value>[\d.]+) s "
+     r"\((?P<psi>-?[\d.]+) psi.*", "settle_open", None),
+    (r"Settle Closed Valve (?P<channel>\d+): (?P<error>not settled)?.*?(?P<value>[\d.]+) s "
+     r"\((?P<psi>-?[\d.]+) psi.*", "settle_closed", None),
+    (r"Pressure Rise Valve (?P<channel>\d+): (?P<value>-?[\d.]+) psi - PASS", "rise", PASSED),
+    (r"Pressure Rise Valve (?P<channel>\d+): (?P<value>-?[\d.]+) psi - FAIL(?P<error>.*)", "rise", FAILED),
+    (r"Valve (?P<channel>\d+) Timing \(\w+\): (?P<value>[\d.]+) s", "timing", PASSED),
+    (r"Leak Valve (?P<channel>\d+): .*?(?P<value>-?[\d.]+) psi/s .* - PASS", "leak", PASSED),
+    (r"Leak Valve (?P<channel>\d+): .*?(?P<value>-?[\d.]+) psi/s .* - FAIL(?P<error>.*)", "leak", FAILED),
+    # qc.py
+    (r"Step: Open Valve (?P<channel>\d+) - Success on attempt (?P<attempt>\d+), State: (?P<reply>\{.*\})", "open", None),
+    (r"Step: Close Valve (?P<channel>\d+) - Success on attempt (?P<attempt>\d+), State: (?P<reply>\{.*\})", "close", None),
+    (r"Step: Open Valve (?P<channel>\d+) - Failed after (?P<attempt>\d+) attempts", "open", FAILED),
+    (r"Step: Close Valve (?P<channel>\d+) - Failed after (?P<attempt>\d+) attempts", "close", FAILED),
+    # trial.py
+    (r"Valve (?P<channel>\d+) - Pre-open pressure: (?P<reply>\{.*\})", "pre_open", None),
+    (r"Valve (?P<channel>\d+) - Post-open pressure: (?P<reply>\{.*\})", "post_open", None),
+    (r"Valve (?P<channel>\d+) - State after open: (?P<reply>\{.*\})", "read_open", None),
+    (r"Valve (?P<channel>\d+) - Closed", "close", PASSED),
+    # gimatic test
+    (r"Gimatic Status (?P<step>\w+): (?P<reply>\{.*\})", "gimatic_status", None),
+    (r"Gimatic Status (?P<step>\w+) - Failed: (?P<error>.*)", "gimatic_status", FAILED),
+    (r"Gimatic (?P<step>Open|Close) - Success", "gimatic", PASSED),
+    (r"Gimatic (?P<step>Open|Close) - Failed: (?P<error>.*)", "gimatic", FAILED),
+]
+_LINES = [(re.compile(pattern), step, status) for pattern, step, status in _LINES]
+_SUMMARY = re.compile(r"(?:Plan \w+|Parallel Valve Test): (PASS|FAIL)")
+_STEP_CHANNEL = re.compile(r"_(\d+)$")
+# Plan runs have no separate read after opening a valve: the settled open
+# pressure is that reading. It is indexed under both names, so read_open
+# covers old and new runs in either format.
+_STEP_ALIASES = {"settle_open": "read_open"}
+
+
+class Reading(NamedTuple):
+    timestamp: str
+    box: Optional[str]
+    channel: Optional[int]
+    step: Optional[str]
+    status: Optional[str]
+    psi: Optional[float]
+    value: Optional[float]
+    attempt: Optional[int]
+    path: str
+
+
+def parse_filename(path: str) -> Optional[dict]:
+    m = _FILENAME.match(os.path.basename(path))
+    if m is None:
+        return None
+    kind = "trial" if m.group("kind") == "trial_auto_test_report" else m.group("kind")
+    return {"kind": kind, "timestamp": m.group("ts"), "box": m.group("box"), "ext": m.group("ext")}
+
+
+# Replies were written as dict reprs; psi and "ret" are read with regular
+# expressions, ast.literal_eval is only needed when they don't match
+_REPLY_PSI = re.compile(r"'psi': (-?\d+(?:\.\d+)?(?:e-?\d+)?)[,}]")
+_REPLY_RET = re.compile(r"'ret': '(\w+)'")
+
+
+def _reply(text: str) -> Optional[dict]:
+    try:
+        reply = ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return None
+    return reply if isinstance(reply, dict) else None
+
+
+def _reply_psi(text: str) -> Optional[float]:
+    m = _REPLY_PSI.search(text)
+    if m:
+        return float(m.group(1))
+    data = (_reply(text) or {}).get("data")
+    if isinstance(data, dict) and isinstance(data.get("psi"), (int, float)):
+        return float(data["psi"])
+    return None
+
+
+def _reply_status(text: str) -> str:
+    # OK only when the reply and the module's data both say OK
+    rets = _REPLY_RET.findall(text)
+    return PASSED if rets and all(ret == "OK" for ret in rets) else FAILED
+
+
+def parse_line(line: str) -> Optional[dict]:
+    # One report line -> reading fields, or None for lines that are not readings
+    for pattern, step, status in _LINES:
+        m = pattern.fullmatch(line)
+        if m is None:
+            continue
+        fields = m.groupdict()
+        reply = fields.get("reply")
+        if status is None:
+            status = FAILED if fields.get("error") else _reply_status(reply) if reply else PASSED
+        if fields.get("step"):
+            step = f"{step}_{fields['step'].lower()}"
+        return {
+            "channel": int(fields["channel"]) if fields.get("channel") else None,
+            "step": step,
+            "status": status,
+            "psi": float(fields["psi"]) if fields.get("psi") else _reply_psi(reply) if reply else None,
+            "value": float(fields["value"]) if fields.get("value") else None,
+            "attempt": int(fields["attempt"]) if fields.get("attempt") else None,
+            "ip": fields.get("ip"),
+        }
+    return None
+
+
+def parse_text_report(path: str) -> Iterator[tuple]:
+    # (line_no, line, fields or None) for every line of a .txt report
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.rstrip("\n")
+            if line:
+                yield line_no, line, parse_line(line)
+
+
+def parse_record_report(path: str) -> Iterator[tuple]:
+    # Same for a ReportSink .jsonl file; step records are taken as they are,
+    # other records with a report line go through parse_line
+    from utils.report_sink import read_records
+
+    for record in read_records(path):
+        line = record.get("line")
+        if record.get("kind") == "step":
+            step_id = record.get("step") or ""
+            step = _STEP_CHANNEL.sub("", step_id)
+            channel = record.get("channel")
+            if channel is None:
+                # steps without a channel arg (rise_2 works on other steps'
+                # results) carry the channel in their id only
+                suffix = _STEP_CHANNEL.search(step_id)
+                channel = int(suffix.group(1)) if suffix else None
+            value = record.get("value") or {}
+            number = next((value[key] for key in ("delta", "settle_s", "leak_rate")
+                           if isinstance(value.get(key), (int, float))), None)
+            yield record["seq"], line, {
+                "channel": channel,
+                "step": step,
+                "status": record.get("status"),
+                "psi": record.get("psi"),
+                "value": number,
+                "attempt": record.get("attempts"),
+                "latency_s": record.get("latency_s"),
+                "t": record.get("t"),
+            }
+        elif line is not None:
+            yield record["seq"], line, parse_line(str(line))
+        elif record.get("ip"):
+            yield record["seq"], None, {"ip": record["ip"]}
+
+
+class ReportIndex:
+    def __init__(self, path: str = DEFAULT_DB):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        # one transaction per file; WAL keeps those commits from each waiting on a sync
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.executescript(_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def index_file(self, path: str, force: bool = False, commit: bool = True) -> Optional[int]:
+        # Returns the number of readings indexed, or None when the file was
+        # skipped (not a report, or unchanged since it was indexed). With
+        # commit=False the caller commits, so many files share a transaction.
+        info = parse_filename(path)
+        if info is None:
+            return None
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        row = self.db.execute("SELECT id, size, mtime FROM reports WHERE path = ?", (path,)).fetchone()
+        if row is not None and not force and row[1] == stat.st_size and row[2] == stat.st_mtime:
+            return None
+
+        parse = parse_record_report if info["ext"] == "jsonl" else parse_text_report
+        rows = []
+        ip = None
+        passed = None
+        for line_no, line, fields in parse(path):
+            if line is not None:
+                summary = _SUMMARY.match(str(line))
+                if summary:
+                    passed = summary.group(1) == "PASS"
+            if fields is None:
+                continue
+            ip = ip or fields.get("ip")
+            if "step" not in fields:
+                continue
+            rows.append((line_no, info["timestamp"], info["box"], fields["channel"], fields["step"],
+                         fields["status"], fields["psi"], fields["value"], fields["attempt"],
+                         fields.get("latency_s"), line))
+        have = {(r[3], r[4]) for r in rows}
+        rows += [r[:4] + (_STEP_ALIASES[r[4]], r[5], r[6], None) + r[8:] for r in list(rows)
+                 if r[4] in _STEP_ALIASES and r[6] is not None and (r[3], _STEP_ALIASES[r[4]]) not in have]
+
+        if row is not None:
+            self.db.execute("DELETE FROM reports WHERE id = ?", (row[0],))
+        report_id = self.db.execute(
+            "INSERT INTO reports (path, kind, timestamp, box, ip, passed, size, mtime, indexed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, info["kind"], info["timestamp"], info["box"], ip, passed, stat.st_size, stat.st_mtime,
+             time.time())).lastrowid
+        self.db.executemany(
+            "INSERT INTO readings (report_id, line_no, timestamp, box, channel, step, status, psi, value, "
+            "attempt, latency_s, text) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(report_id,) + r for r in rows])
+        if commit:
+            self.db.commit()
+        return len(rows)
+
+    def index_directory(self, directory: str = ".", recursive: bool = False, force: bool = False,
+                        batch: int = 500) -> dict:
+        # Commits every `batch` indexed files
+        counts = {"indexed": 0, "skipped": 0, "readings": 0, "failed": 0}
+        paths = []
+        for root, dirs, files in os.walk(directory):
+            paths += [os.path.join(root, name) for name in files if parse_filename(name) is not None]
+            if not recursive:
+                break
+        runs_with_records = {p[:-len(".jsonl")] for p in paths if p.endswith(".jsonl")}
+        for path in sorted(paths):
+            if path.endswith(".txt") and path[:-len(".txt")] in runs_with_records:
+                counts["skipped"] += 1
+                continue
+            try:
+                n = self.index_file(path, force, commit=False)
+            except Exception:
+                logger.exception(f"Failed to index {path}")
+                counts["failed"] += 1
+                continue
+            if n is None:
+                counts["skipped"] += 1
+            else:
+                counts["indexed"] += 1
+                counts["readings"] += n
+                if counts["indexed"] % batch == 0:
+                    self.db.commit()
+        self.db.commit()
+        return counts
+
+    def psi_history(self, channel: int, box: str = None, step: str = None, since: str = None,
+                    until: str = None, limit: int = None) -> List[Reading]:
+        # Readings with a psi value for one valve, oldest first. since/until
+        # compare against the YYYYMMDD_HHMMSS run timestamp, so a prefix such
+        # as "20250606" works.
+        sql = ("SELECT r.timestamp, r.box, r.channel, r.step, r.status, r.psi, r.value, r.attempt, p.path "
+               "FROM readings r JOIN reports p ON p.id = r.report_id "
+               "WHERE r.channel = ? AND r.psi IS NOT NULL")
+        args = [channel]
+        if box is not None:
+            sql += " AND r.box = ?"
+            args.append(box)
+        if step is not None:
+            sql += " AND r.step = ?"
+            args.append(step)
+        if since is not None:
+            sql += " AND r.timestamp >= ?"
+            args.append(since)
+        if until is not None:
+            sql += " AND r.timestamp < ?"
+            args.append(until + "~")
+        sql += " ORDER BY r.timestamp, r.report_id, r.line_no"
+        if limit is not None:
+            sql += " LIMIT ?"
+            args.append(limit)
+        return [Reading(*row) for row in self.db.execute(sql, args)]
+
+    def readings(self, steps: List[str], box: str = None, since: str = None, until: str = None) -> list:
+        # (report_id, timestamp, box, channel, step, psi, value) rows of the
+        # given steps for bulk analysis, each report's lines in order; step is
+        # returned as its position in `steps`
+        marks = ", ".join("?" * len(steps))
+        sql = ("SELECT report_id, timestamp, box, channel, "
+               f"CASE step {' '.join('WHEN ? THEN %d' % i for i in range(len(steps)))} END, psi, value "
+               f"FROM readings WHERE channel IS NOT NULL AND step IN ({marks})")
+        args = list(steps) * 2
+        if box is not None:
+            sql += " AND box = ?"
+            args.append(box)
+        if since is not None:
+            sql += " AND timestamp >= ?"
+            args.append(since)
+        if until is not None:
+            sql += " AND timestamp < ?"
+            args.append(until + "~")
+        return self.db.execute(sql + " ORDER BY rowid", args).fetchall()
+
+    def reports(self, box: str = None) -> List[dict]:
+        sql = "SELECT path, kind, timestamp, box, ip, passed FROM reports"
+        args = []
+        if box is not None:
+            sql += " WHERE box = ?"
+            args.append(box)
+        sql += " ORDER BY timestamp"
+        keys = ("path", "kind", "timestamp", "box", "ip", "passed")
+        return [dict(zip(keys, row)) for row in self.db.execute(sql, args)]
+
+
+def _print_rows(rows: List[dict], fmt: str):
+    if fmt == "json":
+        print(json.dumps(rows, indent=2))
+    elif fmt == "csv":
+        import csv
+        writer = csv.DictWriter(sys.stdout, fieldnames=list(rows[0]) if rows else [])
+        writer.writeheader()
+        writer.writerows(rows)
+    else:
+        for row in rows:
+            print("  ".join("-" if v is None else f"{v:.3f}" if isinstance(v, float) else str(v)
+                            for v in row.values()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index and query historical test reports")
+    parser.add_argument("--db", default=DEFAULT_DB, help=f"index database (default: {DEFAULT_DB})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    index = commands.add_parser("index", help="index new and changed reports")
+    index.add_argument("directories", nargs="*", default=["."])
+    index.add_argument("-r", "--recursive", action="store_true")
+    index.add_argument("--force", action="store_true", help="index unchanged files again")
+    psi = commands.add_parser("psi", help="psi history of one valve")
+    psi.add_argument("--channel", type=int, required=True)
+    psi.add_argument("--box")
+    psi.add_argument("--step", help="e.g. read_closed, read_open, settle_open")
+    psi.add_argument("--since", help="YYYYMMDD[_HHMMSS]")
+    psi.add_argument("--until", help="YYYYMMDD[_HHMMSS]")
+    psi.add_argument("--limit", type=int)
+    psi.add_argument("--format", choices=("text", "csv", "json"), default="text")
+    listing = commands.add_parser("reports", help="list indexed reports")
+    listing.add_argument("--box")
+    listing.add_argument("--format", choices=("text", "csv", "json"), default="text")
+    args = parser.parse_args()
+
+    with ReportIndex(args.db) as store:
+        if args.command == "index":
+            for directory in args.directories:
+                started = time.monotonic()
+                counts = store.index_directory(directory, args.recursive, args.force)
+                print(f"{directory}: {counts['indexed']} indexed ({counts['readings']} readings), "
+                      f"{counts['skipped']} skipped, {counts['failed']} failed "
+                      f"in {time.monotonic() - started:.2f} s")
+        elif args.command == "psi":
+            started = time.monotonic()
+            rows = [r._asdict() for r in store.psi_history(args.channel, args.box, args.step, args.since,
+                                                          args.until, args.limit)]
+            _print_rows(rows, args.format)
+            print(f"{len(rows)} readings in {(time.monotonic() - started) * 1e3:.1f} ms", file=sys.stderr)
+        else:
+            _print_rows(store.reports(args.box), args.format)
@@ -0,0 +1,111 @@
+import asyncio
+import itertools
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+from typing import Iterable, Iterator, List
+
+logger = logging.getLogger(__name__)
+
+# Streaming test report. Every record is one JSON object per line, written as
+# it happens, so a crashed or killed run keeps everything up to its last step:
+#
+#   {"seq": 3, "t": 1718001234.52, "kind": "step", "plan": "valve_test",
+#    "step": "settle_open_1", "action": "wait_settle", "status": "passed",
+#    "channel": 1, "psi": 14.31, "attempts": 1, "latency_s": 0.412,
+#    "value": {...}, "line": "Settle Opened Valve 1: ...", "ok": true}
+#
+# kinds: "start" (run header), "line" (free report text), "step" (one per
+# plan step, including skipped ones), "timing", "summary" and "end". Records
+# with a "line" carry the text of the operator report, so render_text() turns
+# a record file back into the bento-elec-*.txt format:
+#
+#   cd pneumatic_gui && python -m utils.report_sink bento-elec-20240610_101500_box17.jsonl
+#
+# record() only queues the record; a writer thread does the file I/O so the
+# event loop never waits for the disk.
+
+_CLOSE = object()
+
+
+class ReportSink:
+    def __init__(self, path: str, flush_every: int = 64):
+        self.path = path
+        self.flush_every = flush_every
+        self.written = 0
+        self._seq = itertools.count(1)
+        self._queue = queue.Queue()
+        self._file = open(path, "a", encoding="utf-8")
+        self._thread = threading.Thread(target=self._writer, name="report-sink", daemon=True)
+        self._thread.start()
+
+    def record(self, kind: str, **fields):
+        # Thread-safe; returns without touching the file
+        self._queue.put({"seq": next(self._seq), "t": time.time(), "kind": kind, **fields})
+
+    def line(self, line: str, ok: bool = True, **fields):
+        self.record("line", line=line, ok=ok, **fields)
+
+    def _writer(self):
+        pending = 0
+        while True:
+            item = self._queue.get()
+            if item is _CLOSE:
+                break
+            try:
+                self._file.write(json.dumps(item, default=str) + "\n")
+                self.written += 1
+                pending += 1
+                # batch the flush when records queue up faster than the disk
+                if pending >= self.flush_every or self._queue.empty():
+                    self._file.flush()
+                    pending = 0
+            except Exception:
+                logger.exception(f"Failed to write report record to {self.path}")
+        self._file.flush()
+        self._file.close()
+
+    def close(self):
+        # Blocks until every queued record is on disk
+        if self._thread.is_alive():
+            self._queue.put(_CLOSE)
+            self._thread.join()
+
+    async def aclose(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_records(path: str) -> Iterator[dict]:
+    # A run that crashed mid-write may leave a truncated last line
+    with open(path, encoding="utf-8") as f:
+        for number, text in enumerate(f, 1):
+            if not text.strip():
+                continue
+            try:
+                yield json.loads(text)
+            except ValueError:
+                logger.warning(f"{path}:{number}: skipping unreadable record")
+
+
+def render_text(records: Iterable[dict]) -> List[str]:
+    # The operator report: the text lines of the records, in order
+    lines = []
+    for record in records:
+        if record.get("line") is not None:
+            lines += str(record["line"]).split("\n")
+    return lines
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        for text in render_text(read_records(path)):
+            print(text)
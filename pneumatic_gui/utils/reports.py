@@ -0,0 +1,29 @@
+import datetime
+import os
+from typing import List, Optional
+
+REPORT_PREFIX = "bento-elec"
+
+def report_timestamp() -> str:
+    return datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+
+# bento-elec-<timestamp>_<name>.txt, the name the test reports have always had
+# (.jsonl for the streamed record file of the same run)
+def report_filename(timestamp: str, name: Optional[str] = None, ext: str = ".txt") -> str:
+    return f"{REPORT_PREFIX}-{timestamp}_{name if name else 'report'}{ext}"
+
+# Writes the report lines, plus the pressure trace as <report>_pressure.csv
+# when a PressureRingBuffer is given. `records` is the closed ReportSink file
+# of the run; it is moved to <report>.jsonl. Returns the report path.
+def write_report(report_lines: List[str], timestamp: str, name: Optional[str] = None, directory: str = ".",
+                 pressure=None, records: Optional[str] = None) -> str:
+    path = os.path.join(directory, report_filename(timestamp, name))
+    base = path[:-len(".txt")]
+    with open(path, "w") as f:
+        for line in report_lines:
+            f.write(line + "\n")
+    if pressure is not None:
+        pressure.export_csv(base + "_pressure.csv")
+    if records is not None and os.path.exists(records):
+        os.replace(records, base + ".jsonl")
+    return path
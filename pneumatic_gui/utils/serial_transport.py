@@ -0,0 +1,190 @@
+import asyncio
+import collections
+import logging
+import threading
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+# asyncio front end for the controller's USB console. The console answers
+# every "<command>\n" with lines of text ended by an empty line, in the order
+# the commands were sent, and has no request ids. So:
+#
+#   - the port is opened on the first command and kept open; an I/O error
+#     closes it and the next command opens it again (USB replugged)
+#   - a reader thread blocks in the pyserial read and hands the bytes to the
+#     event loop, which splits them into responses at `delimiter`
+#   - up to max_in_flight commands are written without waiting for the
+#     previous answer; responses are matched to commands first in, first out
+#   - when a response is still missing after timeout_s, every waiting command
+#     fails and the input buffer is dropped, so later commands start in step
+#     again. A command the console ignores entirely is not detectable: it
+#     takes the response of the command behind it
+#
+# Writes and the port open go through the default executor, so no coroutine
+# blocks the loop on the serial port. pyserial is imported on first open.
+
+_READ_TIMEOUT_S = 0.1   # reader thread wake-up to notice close()
+
+
+class SerialTransport:
+    def __init__(self, port: str, baudrate: int = 115200, delimiter: bytes = b"\n\n",
+                 timeout_s: float = 2.0, max_in_flight: int = 4):
+        self.port = port
+        self.baudrate = baudrate
+        self.delimiter = delimiter
+        self.timeout_s = timeout_s
+        self.max_in_flight = max_in_flight
+        self.opened = 0         # times the port was opened
+        self._serial = None
+        self._reader = None
+        self._loop = None
+        self._buffer = bytearray()
+        self._pending = collections.deque()
+        self._open_lock = None
+        self._write_lock = None
+        self._window = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._serial is not None
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # asyncio primitives belong to the loop they are first used on
+            self._loop = loop
+            self._open_lock = asyncio.Lock()
+            self._write_lock = asyncio.Lock()
+            self._window = asyncio.Semaphore(self.max_in_flight)
+        async with self._open_lock:
+            if self._serial is not None:
+                return
+            ser = await loop.run_in_executor(None, self._open_port)
+            self._serial = ser
+            self._buffer.clear()
+            self.opened += 1
+            self._reader = threading.Thread(target=self._read_port, args=(ser,),
+                                            name=f"serial-{self.port}", daemon=True)
+            self._reader.start()
+            logger.debug("Opened %s", self.port)
+
+    def _open_port(self):
+        import serial
+        return serial.Serial(self.port, baudrate=self.baudrate, timeout=_READ_TIMEOUT_S)
+
+    # Sends `command` and returns the response lines (empty lines dropped)
+    async def command(self, command: str) -> List[str]:
+        await self.open()
+        async with self._window:
+            future = self._loop.create_future()
+            async with self._write_lock:
+                await self.open()
+                ser = self._serial
+                self._pending.append(future)
+                try:
+                    await self._loop.run_in_executor(None, ser.write, (command + "\n").encode())
+                except Exception as e:
+                    self._lost(ser, e)
+                    raise
+            try:
+                frame = await asyncio.wait_for(asyncio.shield(future), self.timeout_s)
+            except asyncio.TimeoutError:
+                self._resync(Exception(f"No response to {command!r} on {self.port} within {self.timeout_s} s"))
+                # the shielded future now holds the error
+                frame = await future
+        return [line.strip() for line in frame.decode(errors="replace").splitlines() if line.strip()]
+
+    def _read_port(self, ser):
+        # reader thread: runs until the port is closed or fails
+        while True:
+            try:
+                data = ser.read(ser.in_waiting or 1)
+            except Exception as e:
+                if ser.is_open:
+                    self._call_soon(self._lost, ser, e)
+                return
+            if data:
+                self._call_soon(self._received, ser, data)
+
+    def _call_soon(self, callback, *args):
+        try:
+            self._loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            # loop closed under a still running reader
+            pass
+
+    def _received(self, ser, data: bytes):
+        if ser is not self._serial:
+            return
+        self._buffer += data
+        while True:
+            end = self._buffer.find(self.delimiter)
+            if end < 0:
+                return
+            frame = bytes(self._buffer[:end])
+            del self._buffer[:end + len(self.delimiter)]
+            if not frame.strip():
+                # blank lines between responses
+                continue
+            if not self._pending:
+                logger.debug("Unsolicited output on %s: %r", self.port, frame)
+                continue
+            future = self._pending.popleft()
+            if not future.done():
+                future.set_result(frame)
+
+    def _resync(self, exc: Exception):
+        self._fail_pending(exc)
+        self._buffer.clear()
+        if self._serial is not None:
+            try:
+                self._serial.reset_input_buffer()
+            except Exception:
+                logger.debug("Failed to reset input of %s", self.port, exc_info=True)
+
+    def _lost(self, ser, exc: Exception):
+        if ser is not self._serial:
+            return
+        logger.warning("Serial port %s failed: %s", self.port, exc)
+        self._serial = None
+        self._fail_pending(exc)
+        try:
+            ser.close()
+        except Exception:
+            pass
+
+    def _fail_pending(self, exc: Exception):
+        while self._pending:
+            future = self._pending.popleft()
+            if not future.done():
+                future.set_exception(exc)
+
+    async def close(self):
+        ser, self._serial = self._serial, None
+        self._fail_pending(Exception(f"Serial port {self.port} closed"))
+        if ser is None:
+            return
+        ser.close()
+        reader, self._reader = self._reader, None
+        if reader is not None:
+            await asyncio.get_running_loop().run_in_executor(None, reader.join, 1.0)
+
+
+# One transport per port, shared by every caller on the loop
+_transports = {}
+_transports_lock = threading.Lock()
+
+def get_serial_transport(port: str) -> SerialTransport:
+    with _transports_lock:
+        transport = _transports.get(port)
+        if transport is None:
+            transport = _transports[port] = SerialTransport(port)
+        return transport
+
+async def close_serial_transports():
+    with _transports_lock:
+        transports = list(_transports.values())
+        _transports.clear()
+    for transport in transports:
+        await transport.close()
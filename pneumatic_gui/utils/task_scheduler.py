@@ -1,18 +1,164 @@
 import asyncio
+import concurrent.futures
+import heapq
+import itertools
 import logging
+import threading
+import time
+from enum import IntEnum
 from utils.threading_loop import get_loop
 
 logger = logging.getLogger(__name__)
 
+
+class Priority(IntEnum):
+    EMERGENCY = 0  # e.g. a manual close; starts at once, even over the concurrency limit
+    COMMAND = 1
+    READ = 2
+    TEST = 3
+
+
+class TaskHandle:
+    # Handle for a scheduled coroutine; safe to use from any thread
+    def __init__(self, scheduler, coro, priority: Priority, name: str):
+        self.name = name
+        self.priority = priority
+        self.future = concurrent.futures.Future()
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        self._scheduler = scheduler
+        self._coro = coro
+        self._task = None
+        self._cancelled = False
+
+    def cancel(self):
+        self._scheduler.loop.call_soon_threadsafe(self._scheduler._cancel, self)
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self, timeout: float = None):
+        return self.future.result(timeout)
+
+    def add_done_callback(self, fn):
+        self.future.add_done_callback(lambda _: fn(self))
+
+
+class TaskScheduler:
+    # Runs coroutines on the background loop with priority lanes and bounded
+    # concurrency. Queued work starts lowest Priority value first (FIFO within
+    # a lane); at most max_concurrency tasks run at once, except EMERGENCY
+    # tasks, which never wait for a slot.
+    def __init__(self, loop: asyncio.AbstractEventLoop, max_concurrency: int = 4):
+        self.loop = loop
+        self.max_concurrency = max_concurrency
+        self._queue = []
+        self._seq = itertools.count()
+        self._running = set()
+        self._lock = threading.Lock()
+        self._lanes = {p: {"queued": 0, "started": 0, "completed": 0, "failed": 0, "cancelled": 0,
+                           "wait_total_s": 0.0, "wait_max_s": 0.0} for p in Priority}
+
+    def submit(self, coro, priority: Priority = Priority.COMMAND, name: str = None) -> TaskHandle:
+        handle = TaskHandle(self, coro, Priority(priority), name or getattr(coro, "__qualname__", "task"))
+        with self._lock:
+            self._lanes[handle.priority]["queued"] += 1
+        self.loop.call_soon_threadsafe(self._enqueue, handle)
+        return handle
+
+    def metrics(self) -> dict:
+        with self._lock:
+            lanes = {p.name: dict(stats) for p, stats in self._lanes.items()}
+            running = len(self._running)
+        for stats in lanes.values():
+            stats["wait_mean_s"] = stats["wait_total_s"] / stats["started"] if stats["started"] else None
+        return {"running": running, "max_concurrency": self.max_concurrency, "lanes": lanes}
+
+    # --- loop thread only below ---
+
+    def _enqueue(self, handle: TaskHandle):
+        heapq.heappush(self._queue, (handle.priority, next(self._seq), handle))
+        self._pump()
+
+    def _pump(self):
+        while self._queue:
+            priority, _, handle = self._queue[0]
+            if handle._cancelled:
+                heapq.heappop(self._queue)
+                continue
+            if len(self._running) >= self.max_concurrency and priority != Priority.EMERGENCY:
+                break
+            heapq.heappop(self._queue)
+            self._start(handle)
+
+    def _start(self, handle: TaskHandle):
+        handle.started_at = time.monotonic()
+        wait = handle.started_at - handle.enqueued_at
+        with self._lock:
+            lane = self._lanes[handle.priority]
+            lane["queued"] -= 1
+            lane["started"] += 1
+            lane["wait_total_s"] += wait
+            lane["wait_max_s"] = max(lane["wait_max_s"], wait)
+            self._running.add(handle)
+        handle._task = self.loop.create_task(handle._coro)
+        handle._task.add_done_callback(lambda task: self._finish(handle, task))
+
+    def _finish(self, handle: TaskHandle, task: asyncio.Task):
+        with self._lock:
+            self._running.discard(handle)
+            lane = self._lanes[handle.priority]
+            if task.cancelled():
+                lane["cancelled"] += 1
+            elif task.exception() is not None:
+                lane["failed"] += 1
+            else:
+                lane["completed"] += 1
+        # the future stays pending while the task runs, so cancel() still works
+        if handle.future.done():
+            pass
+        elif task.cancelled():
+            handle.future.cancel()
+        elif task.exception() is not None:
+            handle.future.set_exception(task.exception())
+        else:
+            handle.future.set_result(task.result())
+        self._pump()
+
+    def _cancel(self, handle: TaskHandle):
+        if handle._task is not None:
+            handle._task.cancel()
+        elif not handle._cancelled and not handle.future.done():
+            handle._cancelled = True
+            handle._coro.close()
+            handle.future.cancel()
+            with self._lock:
+                lane = self._lanes[handle.priority]
+                lane["queued"] -= 1
+                lane["cancelled"] += 1
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler() -> TaskScheduler:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = TaskScheduler(get_loop())
+        return _scheduler
+
 # Schedule coroutine on the background event loop
-def schedule_coro(coro):
-    loop = get_loop()
-    future = asyncio.run_coroutine_threadsafe(coro, loop)
+def schedule_coro(coro, priority: Priority = Priority.COMMAND, name: str = None) -> TaskHandle:
+    handle = get_scheduler().submit(coro, priority, name)
 
     def _on_done(fut):
+        if fut.cancelled():
+            return
         try:
             fut.result()
         except Exception:
             logger.exception("Async task failed")
 
-    future.add_done_callback(_on_done)
\ No newline at end of file
+    handle.future.add_done_callback(_on_done)
+    return handle
@@ -1,9 +1,15 @@
 import asyncio
+import logging
 import threading
 
+logger = logging.getLogger(__name__)
+
 # Create a dedicated asyncio event loop for the application
 loop = asyncio.new_event_loop()
 
+# CoAP client session shared by every command sent from this loop
+_coap_session = None
+
 def start_background_event_loop():
     def _start_loop():
         asyncio.set_event_loop(loop)
@@ -14,3 +20,39 @@ def start_background_event_loop():
 # Allow other modules to schedule coroutines on this loop
 def get_loop():
     return loop
+
+# Only call from coroutines running on the background loop
+def get_coap_session():
+    global _coap_session
+    if _coap_session is None:
+        from control.coap_client import CoapSession
+        _coap_session = CoapSession()
+    return _coap_session
+
+# Imports aiocoap and binds the shared session's UDP endpoint ahead of the
+# first command, so the first click does not pay for it
+async def warm_up_network():
+    await get_coap_session().get_context()
+
+# Close every controller client, the shared CoAP session and the open serial
+# ports, then stop the loop
+def stop_background_event_loop(timeout_s: float = 5):
+    global _coap_session
+    if not loop.is_running():
+        return
+    session, _coap_session = _coap_session, None
+
+    async def _shutdown():
+        from control.coap_client import close_controllers
+        from utils.serial_transport import close_serial_transports
+        await close_controllers()
+        if session is not None:
+            await session.shutdown()
+        await close_serial_transports()
+
+    future = asyncio.run_coroutine_threadsafe(_shutdown(), loop)
+    try:
+        future.result(timeout=timeout_s)
+    except Exception:
+        logger.exception("Failed to shut down CoAP session")
+    loop.call_soon_threadsafe(loop.stop)
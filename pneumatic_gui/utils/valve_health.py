@@ -0,0 +1,225 @@
+import argparse
+import json
+import sys
+import warnings
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+
+from utils.report_index import DEFAULT_DB, ReportIndex
+
+# Valve health over many recorded runs at once. The readings of every run are
+# loaded from the report index into (runs x channels) arrays, NaN where a run
+# has no reading, and every metric is computed for all runs and channels in
+# one vectorized pass:
+#
+#   delta_psi       open minus closed pressure; ~0 is a stuck valve (the
+#                   17.91 / 17.91 psi valve 2 readings of June 2025)
+#   settle_s        time the open pressure took to settle (plan runs only)
+#   settle_rate     delta_psi / settle_s, psi/s
+#   leak_rate       the leak_decay step's fitted rate where the run had a
+#                   leak test, else the drop from the open pressure while
+#                   the closed valve settled, per second, psi/s
+#
+#   cd pneumatic_gui && python -m utils.valve_health --box kkk
+#   cd pneumatic_gui && python -m utils.valve_health --min-delta 2 --format csv
+
+# readings loaded per run and channel
+_STEPS = ("read_closed", "read_open", "settle_open", "settle_closed", "leak")
+READ_CLOSED, READ_OPEN, SETTLE_OPEN, SETTLE_CLOSED, LEAK_DECAY = range(len(_STEPS))
+
+# fail reason bits
+STUCK = 1
+SLOW = 2
+LEAK = 4
+MISSING = 8
+REASONS = {STUCK: "stuck", SLOW: "slow", LEAK: "leak", MISSING: "missing"}
+
+
+class HealthLimits(NamedTuple):
+    min_delta_psi: float = 1.0          # the valve_test plan's min_rise_psi
+    max_settle_s: float = 2.0           # OPEN_SETTLE timeout
+    min_settle_rate: Optional[float] = None
+    max_leak_rate: Optional[float] = None  # unchecked until calibrated on real boxes
+
+
+class ValveRuns:
+    # closed / open / settle_s / closed_after / close_settle_s / leak_rate
+    # are float arrays of shape (runs, channels); run metadata arrays have
+    # one entry per run
+    def __init__(self, channels, closed, open, settle_s=None, closed_after=None, close_settle_s=None,
+                 leak_rate=None, timestamps=None, boxes=None, report_ids=None):
+        self.channels = np.asarray(channels, dtype=int)
+        self.closed = np.asarray(closed, dtype=float)
+        shape = self.closed.shape
+        nan = np.full(shape, np.nan)
+        self.open = np.asarray(open, dtype=float)
+        self.settle_s = nan if settle_s is None else np.asarray(settle_s, dtype=float)
+        self.closed_after = nan if closed_after is None else np.asarray(closed_after, dtype=float)
+        self.close_settle_s = nan if close_settle_s is None else np.asarray(close_settle_s, dtype=float)
+        self.leak_rate = nan if leak_rate is None else np.asarray(leak_rate, dtype=float)
+        self.timestamps = np.asarray(timestamps if timestamps is not None else [""] * shape[0], dtype=object)
+        self.boxes = np.asarray(boxes if boxes is not None else [None] * shape[0], dtype=object)
+        self.report_ids = np.asarray(report_ids if report_ids is not None else np.arange(shape[0]))
+
+    def __len__(self) -> int:
+        return self.closed.shape[0]
+
+
+def load_runs(index: ReportIndex, box: str = None, since: str = None, until: str = None) -> ValveRuns:
+    rows = index.readings(list(_STEPS), box, since, until)
+    if not rows:
+        return ValveRuns([], np.empty((0, 0)), np.empty((0, 0)))
+    report_id, timestamp, boxes, channel, step, psi, value = zip(*rows)
+    report_id = np.array(report_id)
+    channel = np.array(channel)
+    step = np.array(step)
+    psi = np.array(psi, dtype=float)
+    value = np.array(value, dtype=float)
+
+    run_ids, first, run = np.unique(report_id, return_index=True, return_inverse=True)
+    channels, column = np.unique(channel, return_inverse=True)
+    # rows arrive in run order, so a later reading of the same step (a retry)
+    # overwrites an earlier one
+    psi_grid = np.full((len(_STEPS), len(run_ids), len(channels)), np.nan)
+    value_grid = np.full_like(psi_grid, np.nan)
+    psi_grid[step, run, column] = psi
+    value_grid[step, run, column] = value
+
+    # open pressure: the settled value where there is one, else the single
+    # read after opening (reports from before the settle step)
+    settled = psi_grid[SETTLE_OPEN]
+    order = np.argsort(np.array(timestamp, dtype=object)[first], kind="stable")
+    return ValveRuns(
+        channels,
+        psi_grid[READ_CLOSED][order],
+        np.where(np.isnan(settled), psi_grid[READ_OPEN], settled)[order],
+        settle_s=value_grid[SETTLE_OPEN][order],
+        closed_after=psi_grid[SETTLE_CLOSED][order],
+        close_settle_s=value_grid[SETTLE_CLOSED][order],
+        leak_rate=value_grid[LEAK_DECAY][order],
+        timestamps=np.array(timestamp, dtype=object)[first][order],
+        boxes=np.array(boxes, dtype=object)[first][order],
+        report_ids=run_ids[order],
+    )
+
+
+class ValveHealth:
+    # Per (run, channel) metrics and verdicts; `present` marks the cells that
+    # have a closed or open reading at all
+    def __init__(self, runs: ValveRuns, limits: HealthLimits):
+        self.runs = runs
+        self.limits = limits
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.delta = runs.open - runs.closed
+            self.settle_rate = np.where(runs.settle_s > 0, self.delta / runs.settle_s, np.nan)
+            settle_leak = np.where(runs.close_settle_s > 0,
+                                   (runs.open - runs.closed_after) / runs.close_settle_s, np.nan)
+            self.leak_rate = np.where(np.isnan(runs.leak_rate), settle_leak, runs.leak_rate)
+        self.present = ~(np.isnan(runs.closed) & np.isnan(runs.open))
+
+        reasons = np.zeros(self.delta.shape, dtype=np.int8)
+        reasons |= np.where(self.present & np.isnan(self.delta), MISSING, 0).astype(np.int8)
+        # NaN comparisons are False: a metric that was not recorded never fails
+        reasons |= np.where(self.delta < limits.min_delta_psi, STUCK, 0).astype(np.int8)
+        slow = runs.settle_s > limits.max_settle_s
+        if limits.min_settle_rate is not None:
+            slow |= self.settle_rate < limits.min_settle_rate
+        reasons |= np.where(slow, SLOW, 0).astype(np.int8)
+        if limits.max_leak_rate is not None:
+            reasons |= np.where(self.leak_rate > limits.max_leak_rate, LEAK, 0).astype(np.int8)
+        self.reasons = reasons
+        self.passed = self.present & (reasons == 0)
+
+    def channel_summary(self) -> List[dict]:
+        tested = self.present.sum(axis=0)
+        passed = self.passed.sum(axis=0)
+        with warnings.catch_warnings():
+            # nanmedian / nanmin warn on all-NaN columns (a channel with no
+            # reading of that kind)
+            warnings.simplefilter("ignore", RuntimeWarning)
+            median_delta = np.nanmedian(self.delta, axis=0)
+            min_delta = np.nanmin(self.delta, axis=0)
+            median_settle = np.nanmedian(self.runs.settle_s, axis=0)
+            median_leak = np.nanmedian(self.leak_rate, axis=0)
+        counts = {name: ((self.reasons & bit) != 0).sum(axis=0) for bit, name in REASONS.items()}
+        return [{
+            "channel": int(channel),
+            "runs": int(tested[i]),
+            "passed": int(passed[i]),
+            "pass_rate": float(passed[i] / tested[i]) if tested[i] else None,
+            "median_delta_psi": _num(median_delta[i]),
+            "min_delta_psi": _num(min_delta[i]),
+            "median_settle_s": _num(median_settle[i]),
+            "median_leak_rate": _num(median_leak[i]),
+            **{name: int(count[i]) for name, count in counts.items()},
+        } for i, channel in enumerate(self.runs.channels)]
+
+    def failures(self) -> List[dict]:
+        runs, columns = np.nonzero(self.present & ~self.passed)
+        return [{
+            "timestamp": self.runs.timestamps[r],
+            "box": self.runs.boxes[r],
+            "channel": int(self.runs.channels[c]),
+            "reasons": describe_reasons(int(self.reasons[r, c])),
+            "closed_psi": _num(self.runs.closed[r, c]),
+            "open_psi": _num(self.runs.open[r, c]),
+            "delta_psi": _num(self.delta[r, c]),
+            "settle_s": _num(self.runs.settle_s[r, c]),
+            "leak_rate": _num(self.leak_rate[r, c]),
+        } for r, c in zip(runs, columns)]
+
+
+def analyze(runs: ValveRuns, limits: HealthLimits = HealthLimits()) -> ValveHealth:
+    return ValveHealth(runs, limits)
+
+
+def describe_reasons(reasons: int) -> str:
+    return ",".join(name for bit, name in REASONS.items() if reasons & bit)
+
+
+def _num(value) -> Optional[float]:
+    return None if np.isnan(value) else float(value)
+
+
+def _print(rows: List[dict], fmt: str, title: str):
+    if fmt == "csv":
+        import csv
+        writer = csv.DictWriter(sys.stdout, fieldnames=list(rows[0]) if rows else [])
+        writer.writeheader()
+        writer.writerows(rows)
+        return
+    print(title)
+    for row in rows:
+        print("  " + "  ".join(f"{k}={'-' if v is None else f'{v:.2f}' if isinstance(v, float) else v}"
+                               for k, v in row.items()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Valve health across indexed test runs")
+    parser.add_argument("--db", default=DEFAULT_DB, help=f"report index (default: {DEFAULT_DB})")
+    parser.add_argument("--box")
+    parser.add_argument("--since", help="YYYYMMDD[_HHMMSS]")
+    parser.add_argument("--until", help="YYYYMMDD[_HHMMSS]")
+    defaults = HealthLimits()
+    parser.add_argument("--min-delta", type=float, default=defaults.min_delta_psi,
+                        help="open-closed psi below which a valve is stuck")
+    parser.add_argument("--max-settle", type=float, default=defaults.max_settle_s,
+                        help="longest allowed open settle time (s)")
+    parser.add_argument("--min-settle-rate", type=float, help="slowest allowed settle rate (psi/s)")
+    parser.add_argument("--max-leak-rate", type=float, help="largest allowed leak rate (psi/s)")
+    parser.add_argument("--format", choices=("text", "csv", "json"), default="text")
+    parser.add_argument("--failures", action="store_true", help="list every failed valve of every run")
+    args = parser.parse_args()
+
+    with ReportIndex(args.db) as index:
+        runs = load_runs(index, args.box, args.since, args.until)
+    health = analyze(runs, HealthLimits(args.min_delta, args.max_settle, args.min_settle_rate, args.max_leak_rate))
+    summary = health.channel_summary()
+    failures = health.failures() if args.failures else None
+    if args.format == "json":
+        print(json.dumps({"runs": len(runs), "channels": summary, "failures": failures}, indent=2))
+    else:
+        _print(summary, args.format, f"{len(runs)} runs")
+        if failures is not None:
+            _print(failures, args.format, f"{len(failures)} failed valves")
@@ -4,13 +4,9 @@ import threading
 import logging
 import json
 import time
-from aiocoap import Context, Message, POST
-import aiocoap.error
-import serial
 from typing import List, Optional
 
 # --- Logging setup ---
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 # --- Global IP of controller (set it after getting from USB) ---
@@ -18,6 +14,8 @@ bento_controller_ip = "192.168.1.100"
 
 # --- Async CoAP command ---
 async def send_controller_comand(register: str, value, close_connection=False) -> dict:
+    from aiocoap import Context, Message, POST
+    import aiocoap.error
     timeout_s = 60
     logger.debug("send_controller_comand")
 
@@ -98,6 +96,7 @@ def get_ip_controller(serial_port: str = "/dev/ttyUSB0") -> Optional[str]:
 # --- Optional: Real USB serial fetch implementation (commented out) ---
 
 def send_usb_command_retrieve_response(serial_port: str, command: str) -> List[str]:
+    import serial
     try:
         with serial.Serial(serial_port, baudrate=115200, timeout=2) as ser:
             ser.write((command + '\n').encode('utf-8'))
@@ -197,4 +196,5 @@ class PneumaticControlGUI:
         schedule_coro(_task())
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
     PneumaticControlGUI()